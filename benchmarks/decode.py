@@ -0,0 +1,264 @@
+"""
+Micro benchmarks of the decoding and conversion hot paths
+
+Benchmarks (run on synthetic idread streams of data_api2.idread_encoder):
+  decode_dictionary     data_api2.idread_util.decode with DictionaryCollector
+  decode_mapping        data_api2.idread_util.decode with MappingCollector
+  decode_array          data_api2.idread_util.decode with ArrayCollector
+  decode_hdf5           data_api2.idread_util.decode with HDF5Collector
+  legacy_decode         data_api.idread.decode into a hdf5 file
+  build_data_frame      data_api.client._build_pandas_data_frame of json like data
+  cli_to_hdf5           data_api2.cli.to_hdf5
+  cli_from_hdf5         data_api2.cli.from_hdf5
+
+Every benchmark runs in a forked process so that its peak RSS can be measured. Throughput is reported in events/s
+(events of all channels) and MB/s (size of the stream, the data or the file). The results are written as JSON -
+compare them with the results of another commit with --compare.
+
+Usage: PYTHONPATH=. python benchmarks/decode.py --output results.json
+       PYTHONPATH=. python benchmarks/decode.py --scenarios scalar --compare results.json
+"""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+from data_api import idread, client
+from data_api2 import idread_util, idread_encoder, cli
+
+
+# name -> (channels, events) - the number of events is scaled with --scale
+scenarios = {
+    "scalar": ([idread_encoder.Channel("SCALAR-%02d" % i) for i in range(10)], 20000),
+    "waveform": ([idread_encoder.Channel("WAVEFORM-%02d" % i, shape=[2048]) for i in range(2)], 2000),
+    "waveform-lz4": ([idread_encoder.Channel("WAVEFORM-%02d" % i, shape=[2048], compression="bitshuffle_lz4")
+                      for i in range(2)], 2000),
+    "image-lz4": ([idread_encoder.Channel("IMAGE", type="uint16", shape=[512, 512], compression="bitshuffle_lz4")],
+                  200),
+}
+
+
+def _decode(stream, collector):
+    idread_util.decode(io.BytesIO(stream), collector_function=collector.add_data,
+                       header_function=getattr(collector, "add_header", None))
+    return collector
+
+
+def decode_dictionary(stream, channels, directory):
+    _decode(stream, idread_util.DictionaryCollector()).get_data()
+    return len(stream)
+
+
+def decode_mapping(stream, channels, directory):
+    _decode(stream, idread_util.MappingCollector(len(channels))).get_data()
+    return len(stream)
+
+
+def decode_array(stream, channels, directory):
+    _decode(stream, idread_util.ArrayCollector()).get_data()
+    return len(stream)
+
+
+def decode_hdf5(stream, channels, directory):
+    collector = idread_util.HDF5Collector()
+    collector.open(os.path.join(directory, "decode.h5"))
+    _decode(stream, collector)
+    collector.close()
+    return len(stream)
+
+
+def legacy_decode(stream, channels, directory):
+    collector = idread_util.HDF5Collector()
+    collector.open(os.path.join(directory, "legacy.h5"))
+    idread.decode(io.BytesIO(stream), serializer=collector)
+    collector.close()
+    return len(stream)
+
+
+def _json_data(stream):
+    # Data in the layout of a json response of the data api (data_api)
+    collector = _decode(stream, idread_util.ArrayCollector())
+    data = []
+    for channel in collector.get_data():
+        arrays = channel["data"]
+        seconds = ["%d.%09d" % (t // 1000000000, t % 1000000000) for t in arrays["timeRaw"].tolist()]
+        data.append({"channel": channel["channel"],
+                     "data": [{"value": value, "pulseId": pulse_id, "globalSeconds": s, "globalDate": s,
+                               "eventCount": 1}
+                              for value, pulse_id, s in zip(list(arrays["value"]), arrays["pulseId"].tolist(),
+                                                            seconds)]})
+    return data
+
+
+def build_data_frame(data, channels, directory):
+    client._build_pandas_data_frame(data, index_field="pulseId")
+    return sum([numpy.asarray(event["value"]).nbytes for channel in data for event in channel["data"]])
+
+
+def _cli_data(stream):
+    return _decode(stream, idread_util.DictionaryCollector(event_fields=["value", "pulseId", "timeRaw"])).get_data()
+
+
+def cli_to_hdf5(data, channels, directory):
+    filename = os.path.join(directory, "cli.h5")
+    cli.to_hdf5(data, filename, overwrite=True)
+    return os.path.getsize(filename)
+
+
+def cli_from_hdf5(filename, channels, directory):
+    cli.from_hdf5(filename)
+    return os.path.getsize(filename)
+
+
+def _prepare_cli_file(stream, directory):
+    filename = os.path.join(directory, "cli_input.h5")
+    cli.to_hdf5(_cli_data(stream), filename, overwrite=True)
+    return filename
+
+
+# name -> (function, preparation of its input from the stream) - preparation is not measured
+benchmarks = {
+    "decode_dictionary": (decode_dictionary, None),
+    "decode_mapping": (decode_mapping, None),
+    "decode_array": (decode_array, None),
+    "decode_hdf5": (decode_hdf5, None),
+    "legacy_decode": (legacy_decode, None),
+    "build_data_frame": (build_data_frame, lambda stream, directory: _json_data(stream)),
+    "cli_to_hdf5": (cli_to_hdf5, lambda stream, directory: _cli_data(stream)),
+    "cli_from_hdf5": (cli_from_hdf5, _prepare_cli_file),
+}
+
+
+def _max_rss():
+    # Peak resident set size of the process in MB (ru_maxrss is in KB on Linux, bytes on macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1e3
+
+
+def _run(function, data, channels, directory, queue):
+    # Runs in a forked process
+    baseline = _max_rss()
+    start = time.perf_counter()
+    size = function(data, channels, directory)
+    duration = time.perf_counter() - start
+    queue.put({"seconds": duration, "bytes": size, "peak_rss_mb": _max_rss(), "baseline_rss_mb": baseline})
+
+
+def measure(name, scenario, stream, channels, n_events, repeat=3):
+    """
+    Measure a benchmark - the best of repeat runs is reported
+
+    :return:    dictionary with the results
+    """
+    function, prepare = benchmarks[name]
+    context = multiprocessing.get_context("fork")
+
+    with tempfile.TemporaryDirectory() as directory:
+        data = prepare(stream, directory) if prepare is not None else stream
+
+        runs = []
+        for _ in range(repeat):
+            queue = context.Queue()
+            process = context.Process(target=_run, args=(function, data, channels, directory, queue))
+            process.start()
+            runs.append(queue.get())
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError("Benchmark %s failed for scenario %s" % (name, scenario))
+
+    best = min(runs, key=lambda x: x["seconds"])
+    events = n_events * len(channels)
+    return {"benchmark": name, "scenario": scenario, "events": events, "bytes": best["bytes"],
+            "seconds": best["seconds"], "events_per_s": events / best["seconds"],
+            "mb_per_s": best["bytes"] / 1e6 / best["seconds"],
+            "peak_rss_mb": max([x["peak_rss_mb"] for x in runs]),
+            "delta_rss_mb": max([x["peak_rss_mb"] - x["baseline_rss_mb"] for x in runs])}
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(selected_benchmarks, selected_scenarios, scale=1.0, repeat=3):
+    results = []
+    for scenario in selected_scenarios:
+        channels, n_events = scenarios[scenario]
+        n_events = max(int(n_events * scale), 1)
+        stream = b"".join(idread_encoder.generate(channels, n_events))
+
+        for name in selected_benchmarks:
+            result = measure(name, scenario, stream, channels, n_events, repeat=repeat)
+            print("%-18s %-14s %12.0f events/s %9.1f MB/s %9.1f MB peak RSS (+%.1f)" %
+                  (name, scenario, result["events_per_s"], result["mb_per_s"], result["peak_rss_mb"],
+                   result["delta_rss_mb"]), file=sys.stderr)
+            results.append(result)
+
+    return {"commit": _commit(), "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version(),
+            "numpy": numpy.__version__, "platform": platform.platform(), "scale": scale, "repeat": repeat,
+            "results": results}
+
+
+def compare(results, previous):
+    """
+    Print the relative change of the throughput to previous results
+    """
+    old = {(result["benchmark"], result["scenario"]): result for result in previous["results"]}
+    print("Comparison to %s (%s)" % (previous.get("commit"), previous.get("date")), file=sys.stderr)
+    if previous.get("scale") != results["scale"]:
+        print("Warning: results were measured with a different scale (%s) - fixed costs distort the comparison" %
+              previous.get("scale"), file=sys.stderr)
+    for result in results["results"]:
+        key = (result["benchmark"], result["scenario"])
+        if key not in old:
+            continue
+        change = result["events_per_s"] / old[key]["events_per_s"] - 1
+        rss = result["peak_rss_mb"] - old[key]["peak_rss_mb"]
+        print("%-18s %-14s throughput %+7.1f%%  peak RSS %+8.1f MB" % (key[0], key[1], change * 100, rss),
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro benchmarks of the decoders and collectors")
+    parser.add_argument("--benchmarks", nargs="+", default=list(benchmarks), choices=list(benchmarks),
+                        help="Benchmarks to run")
+    parser.add_argument("--scenarios", nargs="+", default=list(scenarios), choices=list(scenarios),
+                        help="Scenarios (shape and compression of the stream) to run")
+    parser.add_argument("--scale", type=float, default=1.0, help="Scale factor of the number of events")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per benchmark (best is reported)")
+    parser.add_argument("--output", help="Write the results (JSON) to this file instead of stdout")
+    parser.add_argument("--compare", help="Results (JSON) of a previous run to compare with")
+    args = parser.parse_args()
+
+    # The decoders log with level DEBUG and INFO
+    logging.disable(logging.INFO)
+
+    results = run(args.benchmarks, args.scenarios, scale=args.scale, repeat=args.repeat)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+End-to-end benchmark of the data_api2 client against a local mock server (tests/data_api2/mockserver.py)
+
+Measures the time from sending a query to a usable result for every mode:
+  json-stream               client.get_data_json - response parsed while it is received
+  json-buffered             client.get_data_json - whole response read into memory, then parsed
+  json-gzip                 client.get_data_json with gzip compressed response
+  rawevent-stream           client.get_data_idread - response decoded while it is received
+  rawevent-buffered         client.get_data_idread - whole response read into memory, then decoded
+  rawevent-gzip             client.get_data_idread with gzip compressed response
+  save-rawevent             client.save_data_iread into a hdf5 file
+  save-rawevent-buffered    client.save_data_iread - whole response read into memory, then decoded
+
+For every mode and concurrency the latency percentiles of the queries, the throughput (events/s and MB/s received)
+and the peak RSS of the (forked) client process are reported as table and optionally as JSON.
+
+The mock server runs in a separate process, its data rate, channels, latency and bandwidth are configured by the
+scenario options.
+
+Usage: PYTHONPATH=. python benchmarks/end_to_end.py --channels 10 --duration 60 --concurrency 1 4
+       PYTHONPATH=. python benchmarks/end_to_end.py --waveform-size 2048 --channels 2 --modes rawevent-stream
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+import requests
+
+from data_api2 import client, util
+
+
+mockserver = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tests", "data_api2",
+                          "mockserver.py")
+
+
+@contextlib.contextmanager
+def _buffered_query_stream(query, base_url, stats=None, buffer_size=65536, api=None, endpoints=None):
+    # Replacement of client._query_stream reading the whole response into memory before it is processed
+    response = requests.post(base_url + "/query", json=query)
+    if response.status_code != 200:
+        raise RuntimeError("Unable to retrieve data from server: ", response)
+
+    data = response.content
+    if data[:2] == b"\x1f\x8b":  # gzip magic number
+        data = gzip.decompress(data)
+
+    if stats is not None:
+        stats["bytes_received"] = len(response.content)
+        stats["bytes_decoded"] = len(data)
+        stats["compression_ratio"] = len(data) / len(response.content) if response.content else 1.0
+
+    yield io.BytesIO(data)
+
+
+# name -> (client function, compression, buffered)
+modes = {
+    "json-stream": ("json", None, False),
+    "json-buffered": ("json", None, True),
+    "json-gzip": ("json", "gzip", False),
+    "rawevent-stream": ("rawevent", None, False),
+    "rawevent-buffered": ("rawevent", None, True),
+    "rawevent-gzip": ("rawevent", "gzip", False),
+    "save-rawevent": ("save", None, False),
+    "save-rawevent-buffered": ("save", None, True),
+}
+
+
+def _query(api, query, base_url, filename, compression):
+    # Query with the client - returns the number of bytes received
+    stats = dict()
+    if api == "json":
+        client.get_data_json(query, base_url=base_url, compression=compression, stats=stats)
+    elif api == "rawevent":
+        client.get_data_idread(dict(query), base_url=base_url, compression=compression, stats=stats)
+    else:
+        client.save_data_iread(dict(query), filename, base_url=base_url, compression=compression, stats=stats)
+    return stats["bytes_received"]
+
+
+def _max_rss():
+    # Peak resident set size of the process in MB (ru_maxrss is in KB on Linux, bytes on macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1e3
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args):
+    """
+    Start the mock server in a separate process
+
+    :return:    (process, base_url)
+    """
+    port = _free_port()
+    command = [sys.executable, mockserver, "-p", str(port), "--rate", str(args.rate),
+               "--chunk-size", str(args.chunk_size), "--latency", str(args.latency)]
+    if args.waveform_size > 0:
+        command += ["--scalars", "0", "--waveforms", str(args.channels), "--waveform-size", str(args.waveform_size)]
+    else:
+        command += ["--scalars", str(args.channels)]
+    if args.throttle:
+        command += ["--throttle", str(args.throttle)]
+
+    environment = dict(os.environ)
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    environment["PYTHONPATH"] = os.pathsep.join([root] + [p for p in [environment.get("PYTHONPATH")] if p])
+
+    process = subprocess.Popen(command, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = "http://localhost:%d" % port
+
+    for _ in range(100):
+        try:
+            requests.get(base_url + "/params/backends", timeout=1)
+            return process, base_url
+        except requests.exceptions.ConnectionError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError("Unable to start the mock server")
+
+
+def _run(mode, queries, base_url, concurrency, directory, result_queue):
+    # Runs in a forked process
+    api, compression, buffered = modes[mode]
+    if buffered:
+        client._query_stream = _buffered_query_stream
+
+    def timed(index):
+        start = time.perf_counter()
+        size = _query(api, queries[index], base_url, os.path.join(directory, "%s_%d.h5" % (mode, index)),
+                      compression)
+        return time.perf_counter() - start, size
+
+    timed(0)  # warm up (connection setup, imports)
+    baseline = _max_rss()
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, range(1, len(queries))))
+    duration = time.perf_counter() - start
+
+    result_queue.put({"latencies": [latency for latency, _ in results], "bytes": sum([size for _, size in results]),
+                      "seconds": duration, "peak_rss_mb": _max_rss(), "baseline_rss_mb": baseline})
+
+
+def measure(mode, args, base_url, concurrency):
+    """
+    Run the queries of a mode with the given concurrency in a forked process
+
+    :return:    dictionary with the results
+    """
+    channels = [("MOCK:WAVEFORM-%03d" if args.waveform_size > 0 else "MOCK:SCALAR-%03d") % i
+                for i in range(args.channels)]
+    n_events = int(args.duration * args.rate)
+
+    # Every query requests a different range to avoid caching effects
+    queries = []
+    for i in range(args.requests + 1):
+        start = 1000 + i * n_events
+        queries.append(util.construct_data_query(channels, start=start, end=start + n_events - 1))
+
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as directory:
+        result_queue = context.Queue()
+        process = context.Process(target=_run, args=(mode, queries, base_url, concurrency, directory, result_queue))
+        process.start()
+        result = result_queue.get()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError("Benchmark of mode %s failed" % mode)
+
+    latencies = numpy.asarray(result["latencies"])
+    events = n_events * args.channels * args.requests
+    return {"mode": mode, "concurrency": concurrency, "requests": args.requests, "events": events,
+            "bytes": result["bytes"],
+            "latency_p50": float(numpy.percentile(latencies, 50)),
+            "latency_p90": float(numpy.percentile(latencies, 90)),
+            "latency_p99": float(numpy.percentile(latencies, 99)),
+            "latency_max": float(latencies.max()),
+            "events_per_s": events / result["seconds"],
+            "mb_per_s": result["bytes"] / 1e6 / result["seconds"],
+            "peak_rss_mb": result["peak_rss_mb"],
+            "delta_rss_mb": result["peak_rss_mb"] - result["baseline_rss_mb"]}
+
+
+def table(results):
+    """
+    Format the results as comparison table
+    """
+    lines = ["%-22s %4s %9s %9s %9s %12s %9s %10s %10s" %
+             ("mode", "conc", "p50 [s]", "p90 [s]", "p99 [s]", "events/s", "MB/s", "RSS [MB]", "+RSS [MB]")]
+    for result in results:
+        lines.append("%-22s %4d %9.3f %9.3f %9.3f %12.0f %9.1f %10.1f %10.1f" %
+                     (result["mode"], result["concurrency"], result["latency_p50"], result["latency_p90"],
+                      result["latency_p99"], result["events_per_s"], result["mb_per_s"], result["peak_rss_mb"],
+                      result["delta_rss_mb"]))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the client against a local mock server")
+    parser.add_argument("--modes", nargs="+", default=list(modes), choices=list(modes), help="Modes to measure")
+    parser.add_argument("--channels", type=int, default=10, help="Number of channels per query")
+    parser.add_argument("--rate", type=float, default=100.0, help="Events per second and channel")
+    parser.add_argument("--duration", type=float, default=60.0, help="Length of the queried range in seconds")
+    parser.add_argument("--waveform-size", type=int, default=0, help="Size of the waveforms (0: scalar channels)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1], help="Number of concurrent queries")
+    parser.add_argument("--requests", type=int, default=10, help="Number of queries per mode and concurrency")
+    parser.add_argument("--chunk-size", type=int, default=65536, help="Chunk size of the server responses")
+    parser.add_argument("--latency", type=float, default=0.0, help="Server latency in seconds")
+    parser.add_argument("--throttle", type=float, default=None, help="Server bandwidth per response (bytes/s)")
+    parser.add_argument("--output", help="Write the results (JSON) to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    process, base_url = start_server(args)
+    try:
+        results = []
+        for concurrency in args.concurrency:
+            for mode in args.modes:
+                results.append(measure(mode, args, base_url, concurrency))
+                print(table(results[-1:]).splitlines()[-1], file=sys.stderr)
+    finally:
+        process.terminate()
+        process.wait()
+
+    print(table(results))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scenario": {key: value for key, value in vars(args).items() if key not in ["output"]},
+                       "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
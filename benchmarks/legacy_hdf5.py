@@ -0,0 +1,125 @@
+"""
+Benchmark of the legacy data_api.to_hdf5 / from_hdf5 round trip
+
+Measures wall time and peak RSS of writing and reading a data frame with scalar and waveform channels. Every
+measurement runs in a forked process so that its peak RSS can be measured - delta_rss_mb is the growth over the RSS at
+the start of the process (which already holds the data frame). With --baseline the former list based implementation is measured as well for comparison.
+
+Usage: python benchmarks/legacy_hdf5.py --rows 1000000 --waveform 16
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy
+import pandas
+
+import data_api as api
+
+
+def create_data_frame(rows, channels, waveform):
+    columns = {"pulseId": numpy.arange(rows, dtype=numpy.int64),
+               "globalSeconds": 1500000000.0 + numpy.arange(rows) * 0.01,
+               "eventCount": numpy.ones(rows, dtype=numpy.int64)}
+    for i in range(channels):
+        columns["CHANNEL-%d" % i] = numpy.random.random(rows)
+    if waveform > 0:
+        waveforms = numpy.random.random((rows, waveform))
+        columns["WAVEFORM"] = list(waveforms)
+
+    data = pandas.DataFrame(columns)
+    data.set_index("pulseId", inplace=True)
+    return data
+
+
+def baseline_to_hdf5(data, filename):
+    # Former implementation - columns are converted to python lists
+    import h5py
+
+    outfile = h5py.File(filename, "w")
+    outfile.create_dataset(data.index.name, data=data.index.tolist())
+    for dataset in data.columns:
+        outfile.create_dataset(dataset, data=data[dataset].tolist(), shuffle=True, compression=5)
+    outfile.close()
+
+
+def baseline_from_hdf5(filename, index_field):
+    # Former implementation - the data frame is extended column by column
+    import h5py
+
+    infile = h5py.File(filename, "r")
+    data = pandas.DataFrame()
+    for k in infile.keys():
+        values = infile[k][:]
+        data[k] = list(values) if values.ndim > 1 else values
+    infile.close()
+    data.set_index(index_field, inplace=True)
+    return data
+
+
+def _max_rss():
+    # Peak resident set size of the process in MB (ru_maxrss is in KB on Linux, bytes on macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1e3
+
+
+def _run(function, args, queue):
+    # Runs in a forked process
+    baseline = _max_rss()
+    start = time.perf_counter()
+    function(*args)
+    duration = time.perf_counter() - start
+    peak = _max_rss()
+    queue.put({"seconds": duration, "peak_rss_mb": peak, "delta_rss_mb": peak - baseline})
+
+
+def measure(function, *args):
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=_run, args=(function, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("Benchmark of %s failed" % function.__name__)
+    return result
+
+
+def run(rows, channels, waveform, baseline=False):
+    data = create_data_frame(rows, channels, waveform)
+    results = {"rows": rows, "channels": channels, "waveform": waveform}
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "benchmark.h5")
+
+        results["to_hdf5"] = measure(api.to_hdf5, data, filename)
+        results["file_mb"] = os.path.getsize(filename) / 1e6
+        results["from_hdf5"] = measure(api.from_hdf5, filename, "pulseId")
+
+        if baseline:
+            os.remove(filename)
+            results["baseline_to_hdf5"] = measure(baseline_to_hdf5, data, filename)
+            results["baseline_from_hdf5"] = measure(baseline_from_hdf5, filename, "pulseId")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the legacy hdf5 round trip")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of rows")
+    parser.add_argument("--channels", type=int, default=10, help="Number of scalar channels")
+    parser.add_argument("--waveform", type=int, default=0, help="Length of an additional waveform channel (0: none)")
+    parser.add_argument("--baseline", action="store_true", help="Also measure the former list based implementation")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.rows, args.channels, args.waveform, baseline=args.baseline), indent=2))
+
+
+if __name__ == "__main__":
+    main()
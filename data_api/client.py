@@ -8,6 +8,9 @@ import numpy as np
 import pprint
 import logging
 import re
+import json
+
+from data_api2 import resample, idread_util
 
 logger = logging.getLogger("DataApiClient")
 logger.setLevel(logging.INFO)
@@ -109,10 +112,96 @@ def _set_time_range(start_date, end_date, delta_time, margin = 0.0):
 
 def _get_t_series(start, end, fixed_time_interval,tzinfo):
     import pandas
+    # Timezone aware boundaries are converted to the timezone of the data (e.g. Europe/Zurich for binary retrieval)
+    start, end = pandas.Timestamp(start), pandas.Timestamp(end)
+    if start.tzinfo is not None:
+        start = start.tz_convert(tzinfo)
+    if end.tzinfo is not None:
+        end = end.tz_convert(tzinfo)
     t_series = pandas.date_range(start=start, end=end, freq=fixed_time_interval, tz=tzinfo)
     #t_series_str = [t.strftime('%Y-%m-%dT%H:%M:%S.%f%z')[:-2]+':00' for t in t_series]
     return t_series
 
+def _to_column(values):
+    # Convert a list of values into a one dimensional column - multi dimensional values (e.g. waveforms) are kept
+    # as objects so that each row holds one value
+    try:
+        column = np.asarray(values)
+    except ValueError:  # values of different lengths (e.g. waveforms changing their size)
+        column = None
+    if column is None or column.ndim != 1:
+        column = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            column[i] = value
+    return column
+
+
+def _masked_column(values, length):
+    # Preallocate a column of the given length able to hold values - entries not filled afterwards are masked
+    # with NaN (or None for non numeric values) as pandas.merge(how="outer") would do
+    if values.dtype.kind in "fc":
+        return np.full(length, np.nan, dtype=values.dtype)
+    if values.dtype.kind in "iub":
+        return np.full(length, np.nan)
+    return np.full(length, None, dtype=object)
+
+
+def _align_channels(channels, index_field, metadata_fields):
+    """
+    Align the columns of several channels on the union of their index values (k-way alignment)
+
+    The union index is computed once over all channels, afterwards every channel is scattered into a preallocated
+    column. Memory and time scale linearly with the total number of events.
+
+    :param channels:        list of (metadata, columns) tuples, one per channel. metadata is a dictionary
+                            metadata field -> array (None for channels without data), columns a list of
+                            (column name, array) tuples. The index values of a channel must be unique.
+    :param index_field:     metadata field to align on
+    :param metadata_fields: metadata fields to take over into the aligned result
+    :return:                dictionary column name -> array, the union index is sorted
+    """
+
+    indices = [metadata[index_field] for metadata, _ in channels if metadata is not None]
+    if indices:
+        all_index = np.concatenate(indices)
+        # return_index gives the first occurrence - metadata is taken from the first channel holding an index value
+        union, first = np.unique(all_index, return_index=True)
+    else:
+        union, first = np.empty(0), np.empty(0, dtype=np.int64)
+
+    length = len(union)
+    aligned = dict()
+
+    for field in metadata_fields:
+        field_values = [metadata[field] for metadata, _ in channels if metadata is not None]
+        aligned[field] = np.concatenate(field_values)[first] if field_values else np.empty(0)
+
+    for metadata, columns in channels:
+        positions = None
+        if metadata is not None:
+            positions = np.searchsorted(union, metadata[index_field])
+
+        for name, values in columns:
+            if values is None:
+                aligned[name] = np.full(length, np.nan)
+            elif len(values) == length:
+                # Channel has a value for every index entry - nothing to mask
+                column = np.empty(length, dtype=values.dtype)
+                column[positions] = values
+                aligned[name] = column
+            else:
+                column = _masked_column(values, length)
+                column[positions] = values
+                aligned[name] = column
+
+    return aligned
+
+
+def _to_nanoseconds(index):
+    # Nanoseconds since epoch of a (timezone aware) pandas DatetimeIndex
+    return np.asarray(index.values.astype('datetime64[ns]').astype(np.int64))
+
+
 def _build_pandas_data_frame(data, **kwargs):
     import pandas
     # for nicer printing
@@ -120,50 +209,49 @@ def _build_pandas_data_frame(data, **kwargs):
 
     index_field = kwargs['index_field']
 
-    data_frame = None
-
     # Same as query["fields"] except "value"
     metadata_fields = ["pulseId", "globalSeconds", "globalDate", "eventCount"]
 
+    channels = []
+    column_names = []
     for channel_data in data:
         if not channel_data['data']:  # data_entry['data'] is empty, i.e. []
             # No data returned
             logger.warning("no data returned for channel %s" % channel_data['channel']['name'])
-            # Create empty pandas data_frame
-            tdf = pandas.DataFrame(columns=[index_field, channel_data['channel']['name']])
-        else:
-            if isinstance(channel_data['data'][0]['value'], dict):
-                # Server side aggregation
-                entry = []
-                keys = sorted(channel_data['data'][0]['value'])
+            channels.append((None, [(channel_data['channel']['name'], None)]))
+            column_names.append(channel_data['channel']['name'])
+            continue
 
-                for x in channel_data['data']:
-                    entry.append([x[m] for m in metadata_fields] + [x['value'][k] for k in keys])
-                columns = metadata_fields + [channel_data['channel']['name'] + ":" + k for k in keys]
+        entries = channel_data['data']
+        metadata = dict()
+        for m in metadata_fields:
+            metadata[m] = _to_column([x[m] for x in entries])
 
-            else:
-                # No aggregation
-                entry = []
-                for data_entry in channel_data['data']:
-                    entry.append([data_entry[m] for m in metadata_fields] + [data_entry['value']])
-                # entry = [[x[m] for m in metadata_fields] + [x['value'], ] for x in data_entry['data']]
-                columns = metadata_fields + [channel_data['channel']['name']]
-
-            tdf = pandas.DataFrame(entry, columns=columns)
-            tdf.drop_duplicates(index_field, inplace=True)
-
-            # TODO check if necessary
-            # because pandas.to_numeric has not enough precision (only float 64, not enough for globalSeconds)
-            # does 128 makes sense? do we need nanoseconds?
-            conversions = {"pulseId": np.int64}
-            for col in tdf.columns:
-                if col in conversions:
-                    tdf[col] = tdf[col].apply(conversions[col])
-
-        if data_frame is not None:
-            data_frame = pandas.merge(data_frame, tdf, how="outer")  # Missing values will be filled with NaN
+        # because pandas.to_numeric has not enough precision (only float 64, not enough for globalSeconds)
+        metadata["pulseId"] = metadata["pulseId"].astype(np.int64)
+
+        if isinstance(entries[0]['value'], dict):
+            # Server side aggregation
+            keys = sorted(entries[0]['value'])
+            columns = [(channel_data['channel']['name'] + ":" + k, _to_column([x['value'][k] for x in entries]))
+                       for k in keys]
         else:
-            data_frame = tdf
+            # No aggregation
+            columns = [(channel_data['channel']['name'], _to_column([x['value'] for x in entries]))]
+
+        # Drop duplicated index values - keep the first occurrence
+        _, first = np.unique(metadata[index_field], return_index=True)
+        if len(first) < len(entries):
+            keep = np.sort(first)
+            metadata = {m: values[keep] for m, values in metadata.items()}
+            columns = [(name, values[keep]) for name, values in columns]
+
+        channels.append((metadata, columns))
+        column_names.extend(name for name, _ in columns)
+
+    # Build the data frame in one step - missing values are masked with NaN
+    data_frame = pandas.DataFrame(_align_channels(channels, index_field, metadata_fields),
+                                  columns=metadata_fields + column_names)
 
     if data_frame.shape[0] > 0:
         # dataframe is not empty
@@ -172,11 +260,9 @@ def _build_pandas_data_frame(data, **kwargs):
         # this is a string manipulation !
         data_frame["globalNanoseconds"] = data_frame.globalSeconds.map(lambda x: int(x.split('.')[1][3:]))
         data_frame["globalSeconds"] = data_frame.globalSeconds.map(lambda x: float(x.split('.')[0] + "." + x.split('.')[1][:3]))
-        # Fix pulseid to int64 - not sure whether this really works
-        # data_frame["pulseId"] = data_frame["pulseId"].astype(np.int64)
 
+        # The aligned index is already sorted
         data_frame.set_index(index_field, inplace=True)
-        data_frame.sort_index(inplace=True)
 
         # convert to datetime if possible
         if index_field == 'globalDate':
@@ -185,6 +271,96 @@ def _build_pandas_data_frame(data, **kwargs):
     return data_frame
 
 
+def _format_global_date(global_time):
+    # Format nanoseconds since epoch like the globalDate field of the server, e.g. 2018-01-01T00:00:01.123456789+01:00
+    import pandas
+    dates = pandas.to_datetime(global_time, utc=True).tz_convert('Europe/Zurich')
+    seconds = dates.strftime('%Y-%m-%dT%H:%M:%S')
+    offsets = dates.strftime('%z')
+    return np.array(["%s.%09d%s:%s" % (date, nanoseconds, offset[:3], offset[3:])
+                     for date, nanoseconds, offset in zip(seconds, global_time % 1000000000, offsets)], dtype=object)
+
+
+def _build_pandas_data_frame_from_arrays(data, **kwargs):
+    # Same as _build_pandas_data_frame but for columnar data as returned by data_api2.idread_util.ArrayCollector
+    import pandas
+    # for nicer printing
+    pandas.set_option('display.float_format', lambda x: '%.3f' % x)
+
+    index_field = kwargs['index_field']
+
+    metadata_fields = ["pulseId", "globalSeconds", "globalDate", "eventCount"]
+
+    channels = []
+    column_names = []
+    for channel_data in data:
+        arrays = channel_data['data']
+        name = channel_data['channel']['name']
+        column_names.append(name)
+
+        if len(arrays['value']) == 0:
+            logger.warning("no data returned for channel %s" % name)
+            channels.append((None, [(name, None)]))
+            continue
+
+        # globalSeconds and globalDate are kept as nanoseconds until the channels are aligned
+        metadata = {"pulseId": arrays['pulseId'], "globalSeconds": arrays['timeRaw'],
+                    "globalDate": arrays['timeRaw'], "eventCount": np.ones(len(arrays['value']), dtype=np.int64)}
+        values = _to_column(list(arrays['value'])) if arrays['value'].ndim > 1 else arrays['value']
+
+        # Drop duplicated index values - keep the first occurrence
+        _, first = np.unique(metadata[index_field], return_index=True)
+        if len(first) < len(values):
+            keep = np.sort(first)
+            metadata = {m: column[keep] for m, column in metadata.items()}
+            values = values[keep]
+
+        channels.append((metadata, [(name, values)]))
+
+    data_frame = pandas.DataFrame(_align_channels(channels, index_field, metadata_fields),
+                                  columns=metadata_fields + column_names)
+
+    if data_frame.shape[0] > 0:
+        global_time = data_frame["globalSeconds"].values.astype(np.int64)
+
+        # Apply milliseconds rounding
+        data_frame["globalNanoseconds"] = global_time % 1000000
+        data_frame["globalSeconds"] = (global_time // 1000000) / 1e3
+        if index_field == "globalDate":
+            data_frame["globalDate"] = pandas.to_datetime(global_time, utc=True).tz_convert('Europe/Zurich')
+        else:
+            # Same string representation as returned by the server for json queries
+            data_frame["globalDate"] = _format_global_date(global_time)
+
+        data_frame.set_index(index_field, inplace=True)
+
+    return data_frame
+
+
+def _get_data_binary(query, base_url):
+    # Retrieve data in the rawevent format and decode it into columnar arrays
+
+    logger.debug(json.dumps(query))
+    collector = idread_util.ArrayCollector(event_fields=["value", "pulseId", "timeRaw"])
+
+    with requests.post(base_url + '/query', json=query, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError("Unable to retrieve data from server: ", response)
+
+        idread_util.decode(response.raw, collector_function=collector.add_data)
+
+    data = collector.get_data()
+
+    # Channels without any data are not part of the stream - add them to be consistent with the json retrieval
+    returned_channels = set(channel_data['channel']['name'] for channel_data in data)
+    for channel in query["channels"]:
+        if channel["name"] not in returned_channels:
+            data.append({"channel": channel, "data": {"value": np.empty(0), "pulseId": np.empty(0, dtype=np.int64),
+                                                      "timeRaw": np.empty(0, dtype=np.int64)}})
+
+    return data
+
+
 class Aggregation(object):
     """ For more details see: https://git.psi.ch/sf_daq/ch.psi.daq.queryrest#data-aggregation """
 
@@ -223,7 +399,7 @@ def get_data(channels, start=None, end= None, range_type="globalDate", delta_ran
              include_nanoseconds=True, aggregation=None, base_url=None,
              server_side_mapping=False, server_side_mapping_strategy="provide-as-is",
              mapping_function=_build_pandas_data_frame,
-             fixed_time = False, fixed_time_interval = "1.0 S", interpolation_method = "last"):
+             fixed_time = False, fixed_time_interval = "1.0 S", interpolation_method = "last", binary=False):
     """
     Retrieve data from the Data API.
 
@@ -262,6 +438,11 @@ def get_data(channels, start=None, end= None, range_type="globalDate", delta_ran
         possible values are described in https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html
     :param interpolation_method: string
         interpolation method. Possible options are last (default), previous, linear and nearest.
+    :param binary: bool
+        retrieve the data in the binary rawevent (idread) format instead of json. The data is decoded into columnar
+        arrays and returned in the same DataFrame layout. Aggregation and server side mapping are not supported in
+        this mode. A custom mapping_function receives the columnar data as returned by
+        data_api2.idread_util.ArrayCollector.
 
     Returns:
     df : Pandas DataFrame
@@ -278,6 +459,12 @@ def get_data(channels, start=None, end= None, range_type="globalDate", delta_ran
     if index_field not in ["globalDate", "globalSeconds", "pulseId"]:
         RuntimeError("index_field must be 'globalDate', 'globalSeconds', or 'pulseId'")
 
+    if fixed_time and interpolation_method not in resample.interpolation_methods:
+        raise RuntimeError("%s is not a valid interpolation specification" % interpolation_method)
+
+    if binary and (aggregation is not None or server_side_mapping):
+        raise ValueError("Aggregation and server side mapping are not supported for binary retrieval")
+
     # Check if a single channel is passed instead of a list of channels
     if isinstance(channels, str):
         channels = [channels, ]
@@ -323,14 +510,23 @@ def get_data(channels, start=None, end= None, range_type="globalDate", delta_ran
 
     # print(query)
 
-    # Query server
-    response = requests.post(base_url + '/query', json=query)
+    if binary:
+        # Request iread packed data
+        query["response"] = {"format": "rawevent"}
 
-    # Check for successful return of data
-    if response.status_code != 200:
-        raise RuntimeError("Unable to retrieve data from server: ", response)
+        data = _get_data_binary(query, base_url)
 
-    data = response.json()
+        if mapping_function is _build_pandas_data_frame:
+            mapping_function = _build_pandas_data_frame_from_arrays
+    else:
+        # Query server
+        response = requests.post(base_url + '/query', json=query)
+
+        # Check for successful return of data
+        if response.status_code != 200:
+            raise RuntimeError("Unable to retrieve data from server: ", response)
+
+        data = response.json()
 
     # print(data)
     data = mapping_function(data, index_field=index_field)
@@ -346,35 +542,20 @@ def get_data(channels, start=None, end= None, range_type="globalDate", delta_ran
 
         # Use timestamps from data rather than start/end since timezone aware
         t_series = _get_t_series(start, end, fixed_time_interval, data.index[0].tzinfo)
-        df_t_series = pandas.DataFrame(index=t_series)
+        grid = _to_nanoseconds(t_series)
         # channels that are only relevant for non fixed times
         channel_ignore_list = ['pulseId', 'globalSeconds', 'eventCount', 'globalNanoSeconds']
 
-        interp_data_origin = data[[channel for channel in channels if channel not in channel_ignore_list]]
-        # put time series into data
-        interp_data = pandas.concat([interp_data_origin, df_t_series], sort=False)
-        # sort the time series into data
-        interp_data.sort_index(inplace=True)
-        # interpolate data
-        if interpolation_method in ['last', 'previous']:
-            if interpolation_method == 'last':
-                fillmethod = 'pad'
-            elif interpolation_method == 'previous':
-                fillmethod = 'backfill'
-            # simple padding with fillna
-            interp_data.fillna(method=fillmethod, inplace=True)
-        elif interpolation_method == 'linear':
-            # linear interpolation based on time
-            interp_data.interpolate(method = 'time', inplace=True)
-        elif interpolation_method == 'nearest':
-            interp_data.interpolate(method = interpolation_method, inplace=True)
-        else:
-            raise RuntimeError("%s is not a valid interpolation specification" % interpolation_method)
+        # Resample every channel straight onto the time series - masked (NaN) entries of a channel are not samples
+        interp_data = dict()
+        for channel in channels:
+            if channel in channel_ignore_list:
+                continue
+            samples = data[channel].dropna()
+            interp_data[channel] = resample.resample(_to_nanoseconds(samples.index), samples.values, grid,
+                                                     method=interpolation_method)
 
-        # slice to get only time series values
-        interp_data = interp_data[interp_data.index.isin(df_t_series.index)]
-        # name columns
-        interp_data.columns = channels
+        interp_data = pandas.DataFrame(interp_data, index=t_series)
         # name index
         interp_data.index = interp_data.index.rename('globalDate')
 
@@ -385,7 +566,7 @@ def get_data(channels, start=None, end= None, range_type="globalDate", delta_ran
 def get_data_iread(channels, start=None, end= None, range_type="globalDate", delta_range=1, index_field="globalDate",
              include_nanoseconds=True, aggregation=None, base_url=default_base_url,
              server_side_mapping=False, server_side_mapping_strategy="provide-as-is",
-             mapping_function=_build_pandas_data_frame, filename=None):
+             mapping_function=_build_pandas_data_frame, filename=None, compress=False):
 
     from data_api.h5 import Serializer
     import data_api.idread as iread
@@ -453,12 +634,38 @@ def get_data_iread(channels, start=None, end= None, range_type="globalDate", del
     serializer.open(filename)
 
     with requests.post(base_url + '/query', json=query, stream=True) as response:
-        iread.decode(response.raw, serializer=serializer)
+        iread.decode(response.raw, serializer=serializer, compress=compress)
 
     serializer.close()
 
 
-def to_hdf5(data, filename, overwrite=False, compression="gzip", compression_opts=5, shuffle=True):
+def _column_chunk(values):
+    # Convert a chunk of a data frame column into an array h5py can write. Numeric columns are used as is, object
+    # columns (e.g. waveforms) are stacked - other columns fall back to a conversion via lists.
+    if values.dtype != object:
+        return values
+
+    try:
+        return np.stack(values)
+    except (ValueError, TypeError):
+        return np.asarray(values.tolist())
+
+
+def _write_column(outfile, name, values, chunk_size, dataset_options):
+    if len(values) == 0 or values.dtype != object:
+        outfile.create_dataset(name, data=_column_chunk(values), **dataset_options)
+        return
+
+    # Convert and write the column in chunks - only one chunk of the converted column is held in memory
+    first = _column_chunk(values[:chunk_size])
+    dataset = outfile.create_dataset(name, shape=(len(values),) + first.shape[1:], dtype=first.dtype,
+                                     **dataset_options)
+    dataset[:len(first)] = first
+    for start in range(chunk_size, len(values), chunk_size):
+        dataset[start:start + chunk_size] = _column_chunk(values[start:start + chunk_size])
+
+
+def to_hdf5(data, filename, overwrite=False, compression="gzip", compression_opts=5, shuffle=True, chunk_size=10000):
     import h5py
 
     dataset_options = {'shuffle': shuffle}
@@ -474,33 +681,35 @@ def to_hdf5(data, filename, overwrite=False, compression="gzip", compression_opt
         else:
             raise RuntimeError("File %s exists, and overwrite flag is False, exiting" % filename)
 
-    outfile = h5py.File(filename, "w")
-
-    if data.index.name != "globalDate":  # Skip globalDate
-        outfile.create_dataset(data.index.name, data=data.index.tolist())
-
-    for dataset in data.columns:
-        if dataset == "globalDate":  # Skip globalDate
-            continue
+    with h5py.File(filename, "w") as outfile:
+        if data.index.name != "globalDate":  # Skip globalDate
+            outfile.create_dataset(data.index.name, data=_column_chunk(data.index.to_numpy()))
 
-        outfile.create_dataset(dataset, data=data[dataset].tolist(), **dataset_options)
+        for dataset in data.columns:
+            if dataset == "globalDate":  # Skip globalDate
+                continue
 
-    outfile.close()
+            _write_column(outfile, dataset, data[dataset].to_numpy(), chunk_size, dataset_options)
 
 
 def from_hdf5(filename, index_field="globalSeconds"):
     import h5py
     import pandas
 
-    infile = h5py.File(filename, "r")
-    data = pandas.DataFrame()
-    for k in infile.keys():
-        data[k] = infile[k][:]
+    columns = dict()
+    with h5py.File(filename, "r") as infile:
+        for k in infile.keys():
+            values = infile[k][()]
+            if values.ndim > 1:  # waveforms - one array per row
+                values = list(values)
+            columns[k] = values
 
-    try:
-        data.set_index(index_field, inplace=True)
-    except:
-        raise RuntimeError("Cannot set index on %s, possible values are: %s" % (index_field, str(list(infile.keys()))))
+    if index_field not in columns:
+        raise RuntimeError("Cannot set index on %s, possible values are: %s" % (index_field, str(list(columns.keys()))))
+
+    # Build the data frame in one step - without copying the read arrays
+    index = pandas.Index(columns.pop(index_field), name=index_field)
+    data = pandas.DataFrame(columns, index=index, copy=False)
 
     return data
 
@@ -607,6 +816,63 @@ def parse_duration(duration_str):
     return delta
 
 
+def _split_range(start, end, split=None):
+    """
+    Split a query range into segments
+    :param start:   start pulse-id or date
+    :param end:     end pulse-id or date
+    :param split:   number of pulses or timedelta per segment - None for a single segment
+    :return:        list of (start, end) tuples
+    """
+    segments = []
+    while True:
+        if start == end:
+            break
+
+        segment_end = end
+        if split is not None and (end - start) > split:
+            segment_end = start + split
+
+        segments.append((start, segment_end))
+        start = segment_end
+
+    return segments
+
+
+def _save_segment(channels, start, end, range_type, filename=None, binary=False, overwrite=False):
+    """
+    Download a segment and write it to filename. The file is written to a temporary file first and only moved to
+    filename once complete, so that an interrupted download never leaves a partial file behind.
+
+    :return: data of the segment if no filename is given, None otherwise
+    """
+
+    if filename is None:
+        if binary:
+            raise RuntimeError("Binary download requires a filename")
+        return get_data(channels, start=start, end=end, range_type=range_type, index_field="pulseId")
+
+    if os.path.isfile(filename) and not overwrite:
+        raise RuntimeError("File %s exists, and overwrite flag is False, exiting" % filename)
+
+    temporary_filename = filename + ".part"
+    try:
+        if binary:
+            get_data_iread(channels, start=start, end=end, range_type=range_type, index_field="pulseId",
+                           filename=temporary_filename)
+        else:
+            data = get_data(channels, start=start, end=end, range_type=range_type, index_field="pulseId")
+            to_hdf5(data, filename=temporary_filename, overwrite=True)
+
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        if os.path.isfile(temporary_filename):
+            os.remove(temporary_filename)
+        raise
+
+    logger.info("Written %s" % filename)
+
+
 def cli():
     import argparse
 
@@ -628,6 +894,7 @@ def cli():
     parser.add_argument("--split", type=str, help="Number of pulses or duration (ISO8601) per file", default="")
     parser.add_argument("--print", help="Prints out the downloaded data. Output can be cut.", action="store_true")
     parser.add_argument("--binary", help="Download as binary", action="store_true", default=False)
+    parser.add_argument("--jobs", type=int, help="Number of split files downloaded in parallel", default=1)
 
     args = parser.parse_args()
 
@@ -642,7 +909,7 @@ def cli():
             logger.error("File %s already exists" % filename)
             return
 
-        n_filename = "%s_%03d.h5" % (re.sub("\.h5$", "", filename), 0)
+        n_filename = "%s_%03d.h5" % (re.sub(r"\.h5$", "", filename), 0)
         if os.path.isfile(n_filename):
             logger.error("File %s already exists" % n_filename)
             return
@@ -659,90 +926,47 @@ def cli():
             logger.warning("Please select either --print or --filename")
             parser.print_help()
             return
+
+        channels = args.channels.split(",")
+
         if args.from_pulse != -1:
             if args.to_pulse == -1:
                 logger.error("Please set a range limit with --to_pulse")
                 return
 
-            start_pulse = int(args.from_pulse)
-            file_counter = 0
-
-            while True:
-
-                end_pulse = int(args.to_pulse)
-
-                if start_pulse == end_pulse:
-                    break
-
-                if split != "" and filename != "" and (end_pulse-start_pulse) > int(split):
-                    end_pulse = start_pulse+int(split)
-
-                if filename != "":
-                    if split != "":
-                        new_filename = re.sub("\.h5$", "", filename)
-                        new_filename = "%s_%03d.h5" % (new_filename, file_counter)
-                    else:
-                        new_filename = filename
-
-                if binary_download:
-                    get_data_iread(args.channels.split(","), start=start_pulse, end=end_pulse, range_type="pulseId",
-                                   index_field="pulseId", filename=new_filename)
-
-                else:
-                    data = get_data(args.channels.split(","), start=start_pulse, end=end_pulse, range_type="pulseId", index_field="pulseId")
-
-                    if data is not None:
-                        if filename != "":
-                            to_hdf5(data, filename=new_filename, overwrite=args.overwrite)
-                        elif args.print:
-                            print(data)
-                        else:
-                            logger.warning("Please select either --print or --filename")
-                            parser.print_help()
-
-                start_pulse = end_pulse
-                file_counter += 1
+            range_type = "pulseId"
+            segments = _split_range(int(args.from_pulse), int(args.to_pulse),
+                                    int(split) if split != "" and filename != "" else None)
         else:
-            start_time = _convert_date(args.from_time)
-            file_counter = 0
-
-            while True:
-
-                end_time = _convert_date(args.to_time)
-
-                if start_time == end_time:
-                    break
-
-                if split != "" and filename != "" and (end_time-start_time) > parse_duration(split):
-                    end_time = start_time+parse_duration(split)
-
-                if filename != "":
-                    if split != "":
-                        new_filename = re.sub("\.h5$", "", filename)
-                        new_filename = "%s_%03d.h5" % (new_filename, file_counter)
-                    else:
-                        new_filename = filename
+            range_type = "globalDate"
+            segments = _split_range(_convert_date(args.from_time), _convert_date(args.to_time),
+                                    parse_duration(split) if split != "" and filename != "" else None)
+
+        filenames = [None] * len(segments)
+        if filename != "":
+            if split != "":
+                filenames = ["%s_%03d.h5" % (re.sub(r"\.h5$", "", filename), i) for i in range(len(segments))]
+            else:
+                filenames = [filename]
 
-                if binary_download:
-                    get_data_iread(args.channels.split(","), start=start_time, end=end_time,
-                                   range_type="globalDate",
-                                   index_field="pulseId", filename=new_filename)
+        def save(segment, segment_filename):
+            return _save_segment(channels, segment[0], segment[1], range_type, filename=segment_filename,
+                                 binary=binary_download, overwrite=args.overwrite)
 
-                else:
-                    data = get_data(args.channels.split(","), start=start_time, end=end_time, range_type="globalDate", index_field="pulseId")
+        if args.jobs > 1:
+            from concurrent.futures import ThreadPoolExecutor
 
+            # Results are consumed in the order of the segments
+            with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+                results = executor.map(save, segments, filenames)
+                for data in results:
                     if data is not None:
-
-                        if filename != "":
-                            to_hdf5(data, filename=new_filename, overwrite=args.overwrite)
-                        elif args.print:
-                            print(data)
-                        else:
-                            logger.warning("Please select either --print or --filename")
-                            parser.print_help()
-
-                start_time = end_time
-                file_counter += 1
+                        print(data)
+        else:
+            for segment, segment_filename in zip(segments, filenames):
+                data = save(segment, segment_filename)
+                if data is not None:
+                    print(data)
     else:
         parser.print_help()
         return
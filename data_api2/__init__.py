@@ -1,2 +1,8 @@
-from data_api2.client import get_supported_backends, get_pulse_id_from_timestamp, get_timestamp_from_pulse_id, search, get_data, get_data_idread
+from data_api2.client import get_supported_backends, get_pulse_id_from_timestamp, get_timestamp_from_pulse_id, search, get_data, get_data_idread, EndpointPool
 from data_api2.util import construct_aggregation, construct_value_mapping, construct_response, construct_data_query, as_dict
+from data_api2.resample import time_grid, resample_data
+from data_api2.aggregation import aggregate, AggregationCollector
+from data_api2.lod import LevelOfDetail
+from data_api2.pyramid import RollupPyramid
+from data_api2.h5reader import H5Reader
+from data_api2.vds import stitch
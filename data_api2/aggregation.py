@@ -0,0 +1,444 @@
+import numpy
+from datetime import datetime
+
+from data_api2 import util
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Client side binned aggregation of raw events. The supported options are the same as for the server side
+# aggregation (see util.construct_aggregation): nrOfBins, durationPerBin or pulsesPerBin with the aggregations
+# min, mean, max and count as well as the extrema minValue and maxValue.
+#
+# The events of a channel are assigned to bins with integer arithmetic and folded chunk-wise into running per bin
+# statistics (numpy reduceat) - aggregating a long range never holds more than one chunk of raw events in memory.
+# Only bins containing events are stored - sparse events with fine bins do not allocate the empty bins in between.
+
+supported_aggregations = ["min", "mean", "max", "count"]
+supported_extrema = ["minValue", "maxValue"]
+
+
+class _Binning:
+    """
+    Assignment of events to bin numbers
+    """
+
+    def __init__(self, aggregation, start=None, end=None):
+        """
+        :param aggregation: aggregation as created by util.construct_aggregation
+        :param start:       start of the range - pulse-id (int) or date (datetime/string), required for nrOfBins
+        :param end:         end of the range - pulse-id (int) or date (datetime/string), required for nrOfBins
+        """
+
+        self.by_pulse = False
+        self.nr_of_bins = None
+        self.origin = 0
+
+        if "nrOfBins" in aggregation:
+            if start is None or end is None:
+                raise ValueError("nrOfBins requires start and end of the range")
+            self.by_pulse = isinstance(start, (int, numpy.integer)) and not isinstance(start, (bool, numpy.bool_))
+            self.nr_of_bins = int(aggregation["nrOfBins"])
+            self.origin = _to_position(start)
+            self.width = max(_to_position(end) - self.origin, 1) / self.nr_of_bins
+        elif "durationPerBin" in aggregation:
+            duration = aggregation["durationPerBin"]
+            if isinstance(duration, str):
+                duration = util.parse_duration(duration)
+            # nanoseconds, integer arithmetic to not lose precision
+            self.width = duration.days * 86400000000000 + duration.seconds * 1000000000 + \
+                duration.microseconds * 1000
+            if start is not None:
+                self.origin = _to_position(start)
+        elif "pulsesPerBin" in aggregation:
+            self.by_pulse = True
+            self.width = int(aggregation["pulsesPerBin"])
+            if start is not None:
+                self.origin = _to_position(start)
+        else:
+            raise ValueError("Aggregation needs to specify one of nrOfBins, durationPerBin or pulsesPerBin")
+
+        if self.width <= 0:
+            raise ValueError("Bin width needs to be positive")
+
+    def bins(self, pulse_ids, times):
+        positions = pulse_ids if self.by_pulse else times
+
+        if self.nr_of_bins is not None:
+            bins = numpy.floor((positions - self.origin) / self.width).astype(numpy.int64)
+            # The end of the range belongs to the last bin
+            return numpy.clip(bins, 0, self.nr_of_bins - 1)
+
+        return (positions - self.origin) // self.width
+
+    def bin_start(self, bins):
+        if self.nr_of_bins is not None:
+            return self.origin + numpy.floor(bins * self.width).astype(numpy.int64)
+        return self.origin + bins * self.width
+
+
+class _Bins:
+    """
+    Running statistics of the bins of one channel - only bins with events are stored: the sorted bin numbers (ids)
+    and the statistics in arrays of the same order. The arrays grow geometrically, so that a steadily progressing
+    range (new bins at the end) does not reallocate for every chunk.
+    """
+
+    def __init__(self):
+        self.ids = None
+        self.size = 0
+        self.arrays = None
+
+    def _allocate(self, length, event_min, event_sum):
+        arrays = dict()
+        arrays["count"] = numpy.zeros(length, dtype=numpy.int64)
+        arrays["events"] = numpy.zeros(length, dtype=numpy.int64)
+        arrays["sum"] = numpy.zeros((length,) + event_sum.shape[1:], dtype=event_sum.dtype)
+        arrays["min"] = numpy.zeros((length,) + event_min.shape[1:], dtype=event_min.dtype)
+        arrays["max"] = numpy.zeros((length,) + event_min.shape[1:], dtype=event_min.dtype)
+        for field in ["first_pulse", "first_time", "min_pulse", "min_time", "max_pulse", "max_time"]:
+            arrays[field] = numpy.zeros(length, dtype=numpy.int64)
+        return arrays
+
+    def _reserve(self, unique_bins, event_min, event_sum):
+        # Add the bins of a chunk that are not stored yet - returns the positions of the (sorted) bins in the arrays
+
+        if self.arrays is None:
+            self.size = len(unique_bins)
+            self.ids = unique_bins.astype(numpy.int64)
+            self.arrays = self._allocate(self.size, event_min, event_sum)
+            return numpy.arange(self.size)
+
+        ids = self.ids[:self.size]
+        positions = numpy.searchsorted(ids, unique_bins)
+        new = unique_bins[(positions == self.size) | (ids[numpy.minimum(positions, self.size - 1)] != unique_bins)]
+        if len(new) == 0:
+            return positions
+
+        size = self.size + len(new)
+        capacity = len(self.ids)
+        if size > capacity:
+            capacity = max(size, 2 * capacity)
+
+        if new[0] > ids[-1]:
+            # Bins after the last stored bin - append
+            if capacity > len(self.ids):
+                arrays = self._allocate(capacity, self.arrays["min"], self.arrays["sum"])
+                for field, values in self.arrays.items():
+                    arrays[field][:self.size] = values[:self.size]
+                self.arrays = arrays
+                self.ids = numpy.concatenate((ids, numpy.zeros(capacity - self.size, dtype=numpy.int64)))
+            self.ids[self.size:size] = new
+        else:
+            # Merge the new bins into the stored bins
+            merged = numpy.sort(numpy.concatenate((ids, new)))
+            moved = numpy.searchsorted(merged, ids)
+            arrays = self._allocate(capacity, self.arrays["min"], self.arrays["sum"])
+            for field, values in self.arrays.items():
+                arrays[field][moved] = values[:self.size]
+            self.arrays = arrays
+            self.ids = numpy.concatenate((merged, numpy.zeros(capacity - size, dtype=numpy.int64)))
+
+        self.size = size
+        return numpy.searchsorted(self.ids[:self.size], unique_bins)
+
+    def add(self, bins, event_min, event_max, event_sum, event_count, pulse_ids, times):
+        """
+        Fold a chunk of events into the bins
+
+        :param bins:        bin number of each event
+        :param event_min:   minimum of each event (the value itself for scalars)
+        :param event_max:   maximum of each event
+        :param event_sum:   sum of each event
+        :param event_count: number of values of each event
+        :param pulse_ids:   pulse-id of each event
+        :param times:       global time (nanoseconds) of each event
+        """
+
+        if len(bins) == 0:
+            return
+
+        if numpy.any(bins[1:] < bins[:-1]):
+            order = numpy.argsort(bins, kind="stable")
+            bins, event_min, event_max, event_sum, event_count, pulse_ids, times = \
+                [a[order] for a in (bins, event_min, event_max, event_sum, event_count, pulse_ids, times)]
+
+        unique_bins, starts = numpy.unique(bins, return_index=True)
+        ends = numpy.append(starts[1:], len(bins))
+
+        chunk_count = numpy.add.reduceat(event_count, starts)
+        chunk_sum = numpy.add.reduceat(event_sum, starts, axis=0)
+        chunk_min = numpy.minimum.reduceat(event_min, starts, axis=0)
+        chunk_max = numpy.maximum.reduceat(event_max, starts, axis=0)
+
+        positions = self._reserve(unique_bins, event_min, event_sum)
+        a = self.arrays
+        empty = a["events"][positions] == 0
+
+        # Events arrive in order - the first event of a bin is only set once
+        a["first_pulse"][positions] = numpy.where(empty, pulse_ids[starts], a["first_pulse"][positions])
+        a["first_time"][positions] = numpy.where(empty, times[starts], a["first_time"][positions])
+
+        if event_min.ndim == 1:
+            # Position of the extreme events of each bin - sorting by (bin, value) keeps the bin boundaries
+            index_min = numpy.lexsort((event_min, bins))[starts]
+            index_max = numpy.lexsort((event_max, bins))[ends - 1]
+
+            smaller = empty | (chunk_min < a["min"][positions])
+            larger = empty | (chunk_max > a["max"][positions])
+
+            a["min_pulse"][positions] = numpy.where(smaller, pulse_ids[index_min], a["min_pulse"][positions])
+            a["min_time"][positions] = numpy.where(smaller, times[index_min], a["min_time"][positions])
+            a["max_pulse"][positions] = numpy.where(larger, pulse_ids[index_max], a["max_pulse"][positions])
+            a["max_time"][positions] = numpy.where(larger, times[index_max], a["max_time"][positions])
+
+            a["min"][positions] = numpy.where(smaller, chunk_min, a["min"][positions])
+            a["max"][positions] = numpy.where(larger, chunk_max, a["max"][positions])
+        else:
+            mask = empty.reshape((-1,) + (1,) * (event_min.ndim - 1))
+            a["min"][positions] = numpy.where(mask, chunk_min, numpy.minimum(chunk_min, a["min"][positions]))
+            a["max"][positions] = numpy.where(mask, chunk_max, numpy.maximum(chunk_max, a["max"][positions]))
+
+        a["sum"][positions] += chunk_sum
+        a["count"][positions] += chunk_count
+        a["events"][positions] += ends - starts
+
+    def get(self):
+        """
+        :return: bin numbers and dictionary of arrays of all non empty bins
+        """
+        if self.arrays is None:
+            return numpy.empty(0, dtype=numpy.int64), None
+
+        used = numpy.flatnonzero(self.arrays["events"][:self.size])
+        return self.ids[used], {field: values[used] for field, values in self.arrays.items()}
+
+
+def _event_partials(values, aggregation_type):
+    # Reduce every event to (min, max, sum, count) - scalars are reduced to themselves, for arrays the aggregation
+    # type decides whether to aggregate over all values of an event (value) or per array index (index)
+
+    values = numpy.asarray(values)
+    if values.dtype == object:
+        raise ValueError("Only numeric values can be aggregated")
+
+    if values.ndim == 1 or aggregation_type == "index":
+        event_sum = values.astype(numpy.float64)
+        return values, values, event_sum, numpy.ones(len(values), dtype=numpy.int64)
+
+    flat = values.reshape((len(values), -1))
+    return flat.min(axis=1), flat.max(axis=1), flat.sum(axis=1, dtype=numpy.float64), \
+        numpy.full(len(values), flat.shape[1], dtype=numpy.int64)
+
+
+class AggregationCollector:
+    """
+    Collector aggregating idread data client side while it is decoded
+
+    Returns a list like this (bins without events are omitted):
+    [{"channel":{"name": "", "backend":""},
+      "data":[{"value": {"min": x, "mean": x, "max": x, "count": x}, "eventCount": x, "pulseId": x, "timeRaw": x,
+               "extrema": {"minValue": {"value": x, "pulseId": x, "timeRaw": x}, ...}}, ...]},...]
+
+    pulseId and timeRaw of a bin are the ones of the first event in the bin.
+    """
+
+    def __init__(self, aggregation, start=None, end=None, chunk_size=100000):
+        """
+        :param aggregation: aggregation as created by util.construct_aggregation
+        :param start:       start of the range - pulse-id (int) or date, required for nrOfBins. For durationPerBin and
+                            pulsesPerBin bins are aligned to start (if given)
+        :param end:         end of the range - pulse-id (int) or date, required for nrOfBins
+        :param chunk_size:  number of raw events per channel buffered before they are folded into the bins
+        """
+
+        aggregations = aggregation.get("aggregations", ["min", "mean", "max"])
+        if not set(aggregations).issubset(supported_aggregations):
+            raise ValueError("Only following types of aggregation supported: " + " ".join(supported_aggregations))
+
+        extrema = aggregation.get("extrema") or []
+        if not set(extrema).issubset(supported_extrema):
+            raise ValueError("Only following extrema supported: " + " ".join(supported_extrema))
+
+        self.aggregations = aggregations
+        self.extrema = extrema
+        self.aggregation_type = aggregation.get("aggregationType", "value")
+        self.binning = _Binning(aggregation, start=start, end=end)
+        self.chunk_size = chunk_size
+
+        self.channel_data = dict()
+        self.channel_buffers = dict()
+
+    def add_data(self, channel_name, backend, value, pulse_id, global_time, ioc_time, status, severity):
+
+        if value is None:
+            return
+
+        key = (backend, channel_name)
+        buffer = self.channel_buffers.get(key)
+        if buffer is None:
+            buffer = ([], [], [])
+            self.channel_buffers[key] = buffer
+            self.channel_data[key] = _Bins()
+
+        buffer[0].append(value)
+        buffer[1].append(pulse_id)
+        buffer[2].append(global_time)
+
+        if len(buffer[0]) >= self.chunk_size:
+            self._fold(key)
+
+    def add_arrays(self, channel_name, backend, values, pulse_ids, times):
+        """
+        Aggregate a chunk of already columnar events
+
+        :param channel_name:
+        :param backend:
+        :param values:      array of values
+        :param pulse_ids:   array of pulse-ids
+        :param times:       array of global times in nanoseconds
+        """
+        key = (backend, channel_name)
+        if key not in self.channel_data:
+            self.channel_buffers[key] = ([], [], [])
+            self.channel_data[key] = _Bins()
+
+        self._fold(key)  # keep the order of the events
+        self._add_arrays(key, values, pulse_ids, times)
+
+    def _fold(self, key):
+        values, pulse_ids, times = self.channel_buffers[key]
+        if not values:
+            return
+
+        self.channel_buffers[key] = ([], [], [])
+        self._add_arrays(key, values, pulse_ids, times)
+
+    def _add_arrays(self, key, values, pulse_ids, times):
+        pulse_ids = numpy.asarray(pulse_ids, dtype=numpy.int64)
+        times = numpy.asarray(times, dtype=numpy.int64)
+        event_min, event_max, event_sum, event_count = _event_partials(values, self.aggregation_type)
+
+        bins = self.binning.bins(pulse_ids, times)
+        self.channel_data[key].add(bins, event_min, event_max, event_sum, event_count, pulse_ids, times)
+
+    def get_arrays(self):
+        """
+        :return: list like [{"channel":{"name": "", "backend":""}, "data": {"bin": array, "binStart": array,
+                 "min": array, "mean": array, "max": array, "count": array, "eventCount": array, "pulseId": array,
+                 "timeRaw": array, ...}}, ...]
+        """
+        data = []
+        for backend, channel in list(self.channel_data):
+            data.append({"channel": {"name": channel, "backend": backend},
+                         "data": self.get_channel_arrays(channel, backend)})
+
+        return data
+
+    def get_channel_arrays(self, channel_name, backend=None):
+        """
+        Columnar aggregation of a single channel - see get_arrays
+
+        :param channel_name:
+        :param backend:
+        :return:            dictionary of arrays, None if no data was collected for the channel
+        """
+        key = (backend, channel_name)
+        if key not in self.channel_data:
+            return None
+
+        self._fold(key)
+        bins, arrays = self.channel_data[key].get()
+
+        result = {"bin": bins, "binStart": self.binning.bin_start(bins)}
+        if arrays is not None:
+            result["min"] = arrays["min"]
+            result["max"] = arrays["max"]
+            result["mean"] = arrays["sum"] / arrays["count"].reshape((-1,) + (1,) * (arrays["sum"].ndim - 1))
+            result["count"] = arrays["count"]
+            result["eventCount"] = arrays["events"]
+            result["pulseId"] = arrays["first_pulse"]
+            result["timeRaw"] = arrays["first_time"]
+            result["minPulseId"] = arrays["min_pulse"]
+            result["minTimeRaw"] = arrays["min_time"]
+            result["maxPulseId"] = arrays["max_pulse"]
+            result["maxTimeRaw"] = arrays["max_time"]
+
+        return result
+
+    def get_data(self):
+        data = []
+        for channel in self.get_arrays():
+            arrays = channel["data"]
+            events = []
+            for i in range(len(arrays["bin"])):
+                value = dict()
+                for aggregation in self.aggregations:
+                    value[aggregation] = arrays[aggregation][i]
+
+                event = {"value": value, "eventCount": int(arrays["eventCount"][i]),
+                         "pulseId": int(arrays["pulseId"][i]), "timeRaw": int(arrays["timeRaw"][i])}
+
+                if self.extrema and arrays["min"].ndim == 1:
+                    extrema = dict()
+                    if "minValue" in self.extrema:
+                        extrema["minValue"] = {"value": arrays["min"][i], "pulseId": int(arrays["minPulseId"][i]),
+                                               "timeRaw": int(arrays["minTimeRaw"][i])}
+                    if "maxValue" in self.extrema:
+                        extrema["maxValue"] = {"value": arrays["max"][i], "pulseId": int(arrays["maxPulseId"][i]),
+                                               "timeRaw": int(arrays["maxTimeRaw"][i])}
+                    event["extrema"] = extrema
+
+                events.append(event)
+
+            data.append({"channel": channel["channel"], "data": events})
+
+        return data
+
+
+def aggregate(data, aggregation, start=None, end=None):
+    """
+    Aggregate already retrieved raw data client side
+
+    :param data:        data as returned by get_data (list of events per channel, the events need to contain value,
+                        pulseId and timeRaw or time) or by idread_util.ArrayCollector (columnar)
+    :param aggregation: aggregation as created by util.construct_aggregation
+    :param start:       start of the range - pulse-id (int) or date, required for nrOfBins
+    :param end:         end of the range - pulse-id (int) or date, required for nrOfBins
+    :return:            aggregated data - see AggregationCollector
+    """
+
+    collector = AggregationCollector(aggregation, start=start, end=end)
+
+    for channel in data:
+        events = channel["data"]
+        name = channel["channel"]["name"]
+        backend = channel["channel"].get("backend")
+
+        if isinstance(events, dict):  # columnar
+            collector.add_arrays(name, backend, events["value"], events["pulseId"], events["timeRaw"])
+            continue
+
+        events = [event for event in events if event is not None and event["value"] is not None]
+        if not events:
+            continue
+
+        if "timeRaw" in events[0]:
+            times = [event["timeRaw"] for event in events]
+        else:
+            times = [_to_position(event["time"]) for event in events]
+
+        pulse_ids = [event.get("pulseId", -1) for event in events]
+        collector.add_arrays(name, backend, [event["value"] for event in events], pulse_ids, times)
+
+    return collector.get_data()
+
+
+def _to_position(value):
+    # Position of a range boundary - pulse-ids and nanoseconds are used as is, dates are converted to nanoseconds
+    if isinstance(value, (int, numpy.integer)):
+        return int(value)
+    if isinstance(value, (str, datetime)):
+        return util.convert_date_to_nanoseconds(value)
+    raise ValueError("Unsupported range type: " + str(type(value)))
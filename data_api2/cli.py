@@ -5,14 +5,18 @@ from pathlib import Path
 from datetime import datetime
 from datetime import timedelta
 import pprint
+import re
 import sys
+import threading
 
 import dateutil.parser
 import pytz
 import h5py
+import numpy
 
 import data_api2 as api
-from data_api2 import util
+from data_api2 import util, idread_util, vds
+from data_api2 import client
 
 logger = logging.getLogger("DataApiClient")
 logger.setLevel(logging.INFO)
@@ -31,6 +35,14 @@ def _convert_date(date_string):
 
     return date
 
+def _check_overwrite(filename, overwrite):
+    if filename.exists():
+        if overwrite:
+            logger.info("Overwriting %s", filename.as_posix())
+        else:
+            raise RuntimeError("File %s exists, not overwriting by default." %
+                               filename.as_posix())
+
 def to_hdf5(data, filename, overwrite=False, compression="gzip",
              compression_opts=5, shuffle=True):
     #pprint.pprint(data)
@@ -43,12 +55,7 @@ def to_hdf5(data, filename, overwrite=False, compression="gzip",
         dataset_options['compression'] = compression
         if compression == "gzip":
             dataset_options['compression_opts'] = compression_opts
-    if filename.exists():
-        if overwrite:
-            logger.info("Overwriting %s", filename.as_posix())
-        else:
-            raise RuntimeError("File %s exists, not overwriting by default." %
-                               filename.as_posix())
+    _check_overwrite(filename, overwrite)
     outfile = h5py.File(filename.as_posix(), "w")
 
     for channel in data:
@@ -69,38 +76,61 @@ def to_hdf5(data, filename, overwrite=False, compression="gzip",
 
     outfile.close()
 
-def from_hdf5(filename):
+def _read_dataset(dataset, lazy=False):
+    """Read a dataset with one bulk read - or as memory mapped view if lazy and the layout allows it"""
+    if lazy and dataset.chunks is None and dataset.compression is None and dataset.size > 0:
+        offset = dataset.id.get_offset()
+        if offset is not None:
+            return numpy.memmap(dataset.file.filename, mode="r", dtype=dataset.dtype, shape=dataset.shape,
+                                offset=offset)
+    return dataset[()]
+
+def from_hdf5(filename, events=False, lazy=False):
+    """
+    Read a file written by to_hdf5 (or the save action)
+
+    :param filename:
+    :param events:      return a list of dictionaries per event (see to_events) instead of arrays
+    :param lazy:        memory map the datasets instead of reading them (only possible for contiguous, uncompressed
+                        datasets - others are read)
+    :return:            [{"channel": {"name": "", "backend": "hdf5"},
+                          "data": {"value": array, "timeRaw": array, "pulseId": array}}, ...]
+                        pulseId is missing for channels without pulse ids
+    """
     if not isinstance(filename, (str, Path)):
         raise RuntimeError("Filename must be str or Path")
     if isinstance(filename, str):
         filename = Path(filename)
-    infile = h5py.File(filename, "r")
 
     res = []
-
-    for (channel_name, data) in infile.items():
-        datapoints = []
-        for i in range(len(data["values"])):
+    with h5py.File(filename.as_posix(), "r") as infile:
+        for (channel_name, data) in infile.items():
+            columns = {"value": _read_dataset(data["values"], lazy=lazy),
+                       "timeRaw": _read_dataset(data["timestamps"], lazy=lazy)}
             if "pulseids" in data:
-                datapoint = {
-                    "value": data["values"][i],
-                    "timeRaw": data["timestamps"][i],
-                    "pulseId": data["pulseids"][i]}
-            else:
-                datapoint = {
-                    "value": data["values"][i],
-                    "timeRaw": data["timestamps"][i]}
-            datapoints.append(datapoint)
-        res.append(
-            {
-                "channel":{"name": channel_name, "backend": "hdf5"},
-                "data":datapoints
-            })
+                columns["pulseId"] = _read_dataset(data["pulseids"], lazy=lazy)
+
+            res.append(
+                {
+                    "channel": {"name": channel_name, "backend": "hdf5"},
+                    "data": columns
+                })
+
+    if events:
+        return to_events(res)
 
     return res
 
-    infile.close()
+def to_events(data):
+    """Convert columnar data (see from_hdf5) into the list of dictionaries per event format"""
+    res = []
+    for channel in data:
+        columns = channel["data"]
+        fields = [field for field in ["value", "timeRaw", "pulseId"] if field in columns]
+        datapoints = [dict(zip(fields, values)) for values in zip(*[columns[field] for field in fields])]
+        res.append({"channel": channel["channel"], "data": datapoints})
 
+    return res
 
 def search(args):
     """CLI Action search"""
@@ -108,56 +138,233 @@ def search(args):
     pprint.pprint(res)
     return 0
 
+def _search_exact(names, backends):
+    """Search a batch of channel names with a single anchored alternation regex"""
+    regex = "^(" + "|".join([re.escape(name) for name in names]) + ")$"
+    return api.search(regex, backends=backends)
+
+def _classify_channels(channels, batch_size=100, workers=8):
+    """Split channels into data buffer and archiver appliance channels"""
+    backends = ["sf-databuffer", "sf-archiverappliance"]
+    classification = dict()
+
+    # Channels given in backend/channel notation do not need a lookup
+    unresolved = []
+    for channel in channels:
+        if "/" in channel:
+            classification[channel] = channel.split("/")[0]
+        else:
+            unresolved.append(channel)
+
+    # Look up the other channels in batches - one request for (up to) batch_size channels
+    found = {backend: set() for backend in backends}
+    for i in range(0, len(unresolved), batch_size):
+        batch = unresolved[i:i + batch_size]
+        try:
+            res = _search_exact(batch, backends)
+        except Exception as e:
+            logger.warning("Batched channel lookup failed: %s", e)
+            continue
+        for backend in backends:
+            found[backend].update(res.get(backend, []))
+
+    remaining = []
+    for channel in unresolved:
+        if channel in found["sf-databuffer"]:
+            classification[channel] = "sf-databuffer"
+        elif channel in found["sf-archiverappliance"]:
+            classification[channel] = "sf-archiverappliance"
+        else:
+            remaining.append(channel)
+
+    # Fall back to individual (concurrent) lookups for channels the batched lookup could not resolve
+    if remaining:
+        from concurrent.futures import ThreadPoolExecutor
+
+        logger.info("Looking up %d channels individually", len(remaining))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda channel: api.search(channel, backends=["sf-databuffer"]), remaining)
+            for channel, res in zip(remaining, results):
+                classification[channel] = "sf-databuffer" if res.get('sf-databuffer') else "sf-archiverappliance"
+
+    db_channels = [channel for channel in channels if classification[channel] == "sf-databuffer"]
+    aa_channels = [channel for channel in channels if classification[channel] != "sf-databuffer"]
+
+    return db_channels, aa_channels
+
+def _split_range(start, end, split, by_pulse):
+    """Split the query range into segments of split pulses or split (ISO8601) duration"""
+    if not split:
+        return [(start, end)]
+
+    segments = []
+    if by_pulse:
+        # Pulse ranges are inclusive - segments do not overlap
+        step = int(split)
+        for segment_start in range(start, end + 1, step):
+            segments.append((segment_start, min(segment_start + step - 1, end)))
+    else:
+        step = util.parse_duration(split)
+        if step <= timedelta(0):
+            raise ValueError("Invalid split duration: %s" % split)
+        while start < end:
+            segments.append((start, min(start + step, end)))
+            start = segments[-1][1]
+
+    return segments
+
+def _split_filename(filename, index):
+    """Filename of the index-th split file"""
+    filename = Path(filename)
+    return filename.with_name("%s_%03d%s" % (filename.stem, index, filename.suffix or ".h5"))
+
+class _SaveCollector(idread_util.HDF5Collector):
+    """
+    Collector writing decoded events directly in the layout of to_hdf5: one group per channel with the datasets
+    values, pulseids (not for channels without pulse ids) and timestamps. Values are written in batches.
+    """
+
+    def __init__(self, channels_without_pulse_id=(), compress=False, batch_size=1000):
+        super().__init__(compress=compress, batch_size=batch_size)
+        self.channels_without_pulse_id = set(channels_without_pulse_id)
+        self.end_time = None  # events at or after end_time (nanoseconds) are skipped
+
+    def add_data(self, channel_name, backend, value, pulse_id, global_time, ioc_time, status, severity):
+
+        if value is None:  # No data for this channel in this message
+            return
+
+        if self.end_time is not None and global_time >= self.end_time:
+            return
+
+        if channel_name in self.channels:
+            dtype, shape = self.channels[channel_name]
+            if shape == [1]:
+                shape = []
+        else:
+            value = numpy.asarray(value)
+            dtype, shape = value.dtype, list(value.shape)
+
+        self.append_dataset('/' + channel_name + '/values', value, dtype=dtype, shape=shape, compress=self.compress)
+        if channel_name not in self.channels_without_pulse_id:
+            self.append_dataset('/' + channel_name + '/pulseids', pulse_id, dtype='i8', shape=[],
+                                compress=self.compress)
+        self.append_dataset('/' + channel_name + '/timestamps', global_time, dtype='i8', shape=[],
+                            compress=self.compress)
+
+def _channel_name(channel):
+    """Name of a channel given in backend/channel notation"""
+    return channel.split("/")[-1]
+
+class _SynchronizedCollector:
+    """Serializes the calls of concurrently decoded queries into one collector"""
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.lock = threading.Lock()
+
+    def add_header(self, channels):
+        header_function = getattr(self.collector, "add_header", None)
+        if header_function is not None:
+            with self.lock:
+                header_function(channels)
+
+    def add_data(self, channel_name, backend, value, pulse_id, global_time, ioc_time, status, severity):
+        with self.lock:
+            self.collector.add_data(channel_name, backend, value, pulse_id, global_time, ioc_time, status, severity)
+
+def _fetch(collector, db_channels, aa_channels, start, end, by_pulse):
+    """Retrieve a range of the data buffer and archiver appliance channels into collector"""
+    queries = []
+    if by_pulse:
+        # If range is pulse ids
+        if db_channels:
+            queries.append(util.construct_data_query(
+                channels=db_channels,
+                start=start,
+                end=end,
+                range_type='pulseId',
+                event_fields=["value", "pulseId", "timeRaw"]
+            ))
+    else:
+        if aa_channels:
+            # If range is time
+            queries.append(util.construct_data_query(
+                channels=aa_channels,
+                start=start,
+                end=end,
+                event_fields=["value", "timeRaw"]
+            ))
+
+        if db_channels:
+            # If range is time
+            queries.append(util.construct_data_query(
+                channels=db_channels,
+                start=start,
+                end=end,
+                event_fields=["value", "pulseId", "timeRaw"]
+            ))
+
+    if len(queries) == 1:
+        client.save_data_iread(queries[0], None, collector=collector)
+    elif queries:
+        # The backends are independent - query them in parallel (spread over the endpoints if an EndpointPool is used)
+        # and decode into the same collector
+        from concurrent.futures import ThreadPoolExecutor
+
+        synchronized_collector = _SynchronizedCollector(collector)
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            futures = [executor.submit(client.save_data_iread, query, None, collector=synchronized_collector)
+                       for query in queries]
+            for future in futures:
+                future.result()  # raise the errors of the queries
+
 def save(args):
     """CLI Action save"""
     channels = args.channels.split(',')
-    # Figure out wihch channels have pulse ids
-    db_channels = []
-    for channel in channels:
-        res = api.search(channel, backends=["sf-databuffer"])
-        if res['sf-databuffer']:
-            db_channels.append(channel)
 
-    aa_channels = []
-    for channel in channels:
-        if channel not in db_channels:
-            aa_channels.append(channel)
+    if args.endpoints:
+        # All queries (channel lookup and data) are balanced over the endpoints
+        client.default_base_url = client.EndpointPool(args.endpoints.split(","))
 
-    if args.from_pulse != -1 and args.to_pulse != -1:
+    db_channels, aa_channels = _classify_channels(channels)
+
+    by_pulse = args.from_pulse != -1 and args.to_pulse != -1
+    if by_pulse:
         if aa_channels:
             logger.error(
                 "Cannot search archiver appliance channels with pulse "
                 "ids. The following channels were not found in data buffer: "
                 "%s", aa_channels)
-        # If range is pulse ids
-        query = util.construct_data_query(
-            channels=db_channels,
-            start=args.from_pulse,
-            end=args.to_pulse,
-            range_type='pulseId',
-            event_fields=["value", "pulseId", "timeRaw"]
-        )
-        res = api.get_data_idread(query)
-
+        start, end = int(args.from_pulse), int(args.to_pulse)
     else:
-        # If range is time
-        query = util.construct_data_query(
-            channels=aa_channels,
-            start=args.from_time,
-            end=args.to_time,
-            event_fields=["value", "timeRaw"]
-        )
-        res = api.get_data_idread(query)
-
-        # If range is time
-        query = util.construct_data_query(
-            channels=db_channels,
-            start=args.from_time,
-            end=args.to_time,
-            event_fields=["value", "pulseId", "timeRaw"]
-        )
-        res += api.get_data_idread(query)
-    to_hdf5(res, args.filename, overwrite=args.overwrite)
+        start, end = args.from_time, args.to_time
+
+    segments = _split_range(start, end, args.split, by_pulse)
+    collector = _SaveCollector(channels_without_pulse_id=[_channel_name(channel) for channel in aa_channels])
+
+    # Events are decoded straight into the file of their segment - memory does not grow with the export size
+    for index, (segment_start, segment_end) in enumerate(segments):
+        last = index == len(segments) - 1
+
+        filename = Path(_split_filename(args.filename, index) if args.split else args.filename)
+        _check_overwrite(filename, args.overwrite)
+
+        # Events at the boundary of time segments belong to the next segment
+        collector.end_time = None
+        if not by_pulse and not last:
+            collector.end_time = util.convert_date_to_nanoseconds(segment_end)
+
+        collector.open(filename.as_posix())
+        try:
+            _fetch(collector, db_channels, aa_channels, segment_start, segment_end, by_pulse)
+        finally:
+            collector.close()
+        logger.info("Written %s", filename)
+
+        if args.print:
+            pprint.pprint(from_hdf5(filename))
+
     return 0
 
 def cli_open(args):
@@ -166,6 +373,17 @@ def cli_open(args):
     pprint.pprint(res)
     return 0
 
+def stitch(args):
+    """CLI Action stitch"""
+    filenames = args.files
+    if len(filenames) == 1 and not Path(filenames[0]).exists():
+        # split file prefix, e.g. export.h5 for export_000.h5, export_001.h5, ...
+        prefix = Path(filenames[0])
+        filenames = sorted(prefix.parent.glob("%s_[0-9][0-9][0-9]%s" % (prefix.stem, prefix.suffix or ".h5")))
+    lengths = vds.stitch(filenames, args.filename, overwrite=args.overwrite)
+    logger.info("Datasets: %s", lengths)
+    return 0
+
 def parse_args():
     """Parse cli arguments with argparse"""
     time_end = datetime.now()
@@ -200,6 +418,9 @@ def parse_args():
         "--split", help="Number of pulses or duration (ISO8601) per file", default="")
     parser_save.add_argument(
         "--print", help="Prints out the downloaded data. Output can be cut.", action="store_true")
+    parser_save.add_argument(
+        "--endpoints", help="Data API endpoints (base URLs) serving the same backends, comma-separated list - "
+                            "queries are balanced over them and fail over if one fails", default="")
     #parser_save.add_argument(
     #    "--binary", help="Download as binary", action="store_true", default=False)
 
@@ -207,6 +428,14 @@ def parse_args():
     parser_open.add_argument(
         "filename", help="Name of the output file", default="")
 
+    parser_stitch = subparsers.add_parser('stitch')
+    parser_stitch.add_argument(
+        "filename", help="Name of the index file")
+    parser_stitch.add_argument(
+        "files", nargs="+", help="Split files in order - or the file name given to save --split")
+    parser_stitch.add_argument(
+        "--overwrite", action="store_true", help="Overwrite the index file", default=False)
+
     args = parser.parse_args()
     if args.action is None:
         parser.print_help()
@@ -224,6 +453,8 @@ def main():
         return save(args)
     if args.action == 'open':
         return cli_open(args)
+    if args.action == 'stitch':
+        return stitch(args)
 
     return 0
 
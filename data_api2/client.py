@@ -5,6 +5,13 @@ import requests
 import logging
 import json
 import io
+import gzip
+import struct
+import http.client
+import urllib3
+import contextlib
+import time
+import threading
 import numpy
 import dateutil.parser
 
@@ -25,25 +32,339 @@ if util.check_reachability_server("https://sf-data-api.psi.ch"):
 logger.debug("Using endpoint %s" % default_base_url)
 
 
-def get_data(query, base_url=None, raw=False):
+class EndpointPool:
+    """
+    Pool of endpoints serving the same backends. It can be passed as base_url to the query functions (or be set as
+    default_base_url) instead of a single URL: every query is sent to the endpoint with the lowest latency (time until
+    the response headers are received) weighted by its number of running queries - i.e. concurrent queries are spread
+    over the endpoints. Endpoints failing with connection errors, timeouts or server errors are not used for a cool
+    down period (doubled on every further failure) and queries fail over to the other endpoints. Interrupted downloads
+    of save_data_iread are resumed on another endpoint.
+
+    pool = EndpointPool(["https://sf-data-api.psi.ch", "https://sf-data-api-2.psi.ch"])
+    client.get_data(query, base_url=pool)
+    """
+
+    def __init__(self, urls, timeout=30.0, cooldown=5.0, max_cooldown=300.0, smoothing=0.3, max_probes=1):
+        """
+        :param urls:            base URLs of the endpoints (in order of preference)
+        :param timeout:         seconds without a response (connect or read) until an endpoint is considered failed
+        :param cooldown:        seconds a failed endpoint is not used
+        :param max_cooldown:    maximum seconds a repeatedly failing endpoint is not used
+        :param smoothing:       weight of a new latency measurement in the moving average of the latency
+        :param max_probes:      maximum number of concurrent queries to an endpoint without latency measurement (as
+                                long as other endpoints are available)
+        """
+        if not urls:
+            raise ValueError("At least one endpoint is required")
+
+        self.urls = list(urls)
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.smoothing = smoothing
+        self.max_probes = max_probes
+
+        self.lock = threading.Lock()
+        self.endpoints = {url: {"latency": None, "running": 0, "failures": 0, "down_until": 0.0} for url in self.urls}
+
+    def __repr__(self):
+        return "EndpointPool(%s)" % self.urls
+
+    def select(self, exclude=()):
+        """
+        :param exclude:     endpoints not to use (e.g. already failed for a query) - ignored if all are excluded
+        :return:            URL of the best endpoint. If all endpoints are down the one that is down the shortest.
+        """
+        with self.lock:
+            return self._select(exclude)
+
+    def acquire(self, exclude=()):
+        """
+        Select the best endpoint and register the start of a query to it (see select and begin) - concurrent queries
+        see each other's selection
+
+        :param exclude:     endpoints not to use (e.g. already failed for a query) - ignored if all are excluded
+        :return:            URL of the endpoint - call end(url) once the query is done
+        """
+        with self.lock:
+            url = self._select(exclude)
+            self.endpoints[url]["running"] += 1
+            return url
+
+    def _select(self, exclude):
+        # Needs to be called with the lock held
+        urls = [url for url in self.urls if url not in exclude] or self.urls
+        now = time.monotonic()
+        available = [url for url in urls if self.endpoints[url]["down_until"] <= now]
+        if not available:
+            return min(urls, key=lambda url: self.endpoints[url]["down_until"])
+
+        # Endpoints without latency measurement are assumed to be as slow as the slowest measured endpoint. Only
+        # max_probes queries are sent to them at a time - an endpoint that accepts connections but does not
+        # respond would otherwise attract all queries until they time out.
+        measured = [self.endpoints[url]["latency"] for url in self.urls if self.endpoints[url]["latency"] is not None]
+        prior = max(measured) if measured else 0.0
+
+        probing = [url for url in available
+                   if self.endpoints[url]["latency"] is None and self.endpoints[url]["running"] >= self.max_probes]
+        available = [url for url in available if url not in probing] or available
+
+        def score(url):
+            endpoint = self.endpoints[url]
+            latency = endpoint["latency"] if endpoint["latency"] is not None else prior
+            return latency * (endpoint["running"] + 1), endpoint["running"]
+
+        return min(available, key=score)
+
+    def begin(self, url):
+        """
+        Register the start of a query to the endpoint
+        """
+        with self.lock:
+            self.endpoints[url]["running"] += 1
+
+    def end(self, url, error=None):
+        """
+        Register the end of a query to the endpoint
+
+        :param error:   exception the query failed with - None for success
+        """
+        with self.lock:
+            endpoint = self.endpoints[url]
+            endpoint["running"] -= 1
+            if error is None:
+                endpoint["failures"] = 0
+            elif _retryable(error):  # client errors (e.g. invalid queries) do not affect the health of the endpoint
+                endpoint["failures"] += 1
+                cooldown = min(self.cooldown * 2 ** (endpoint["failures"] - 1), self.max_cooldown)
+                endpoint["down_until"] = time.monotonic() + cooldown
+                logger.warning("Endpoint %s failed (%s) - not used for %.1f seconds" % (url, repr(error), cooldown))
+
+    def observe(self, url, latency):
+        """
+        Add a latency measurement (seconds) of the endpoint
+        """
+        with self.lock:
+            endpoint = self.endpoints[url]
+            if endpoint["latency"] is None:
+                endpoint["latency"] = latency
+            else:
+                endpoint["latency"] += self.smoothing * (latency - endpoint["latency"])
+
+    def status(self):
+        """
+        :return:    dictionary url -> latency (seconds or None), running (number of queries), failures (number of
+                    consecutive failures) and available (False while the endpoint is not used after a failure)
+        """
+        with self.lock:
+            now = time.monotonic()
+            return {url: {"latency": endpoint["latency"], "running": endpoint["running"],
+                          "failures": endpoint["failures"], "available": endpoint["down_until"] <= now}
+                    for url, endpoint in self.endpoints.items()}
+
+
+def _with_failover(base_url, function):
+    """
+    Call function(url, endpoints) with the URL of the endpoint. If base_url is an EndpointPool the call is repeated
+    with the other endpoints of the pool if it fails with a connection or server error.
+
+    :param base_url:    URL, EndpointPool or None for default_base_url
+    :param function:    function(url, endpoints) - endpoints is the EndpointPool (None for a single URL)
+    :return:            return value of the function
+    """
+    if base_url is None:
+        base_url = default_base_url
+
+    if not isinstance(base_url, EndpointPool):
+        return function(base_url, None)
+
+    failed = []
+    while True:
+        url = base_url.acquire(exclude=failed)
+        try:
+            result = function(url, base_url)
+        except Exception as e:
+            base_url.end(url, error=e)
+            failed.append(url)
+            if not _retryable(e) or len(failed) >= len(base_url.urls):
+                raise
+            logger.warning("Query to %s failed - failing over to the next endpoint" % url)
+            continue
+
+        base_url.end(url)
+        return result
+
+
+def get_data(query, base_url=None, raw=False, compression=None, stats=None):
     """
     Get data from Data API
     :param query:
     :param base_url:
     :param raw:
+    :param compression: request a compressed response ("gzip")
+    :param stats:       dictionary filled with the transfer statistics (see _query_stream)
     :return: data dictionary
     """
     if raw:
-        return get_data_idread(query, base_url=base_url)
+        return get_data_idread(query, base_url=base_url, compression=compression, stats=stats)
     else:
-        return get_data_json(query, base_url=base_url)
+        return get_data_json(query, base_url=base_url, compression=compression, stats=stats)
+
+
+# Functions called with the statistics of every query - see add_stats_callback
+_stats_callbacks = []
+
+
+def add_stats_callback(callback):
+    """
+    Register a function that is called with the statistics (dictionary, see _query_stream) of every query - e.g. to
+    collect metrics. The callback is also called if a query fails.
+
+    :param callback:    function with the signature callback(stats)
+    """
+    _stats_callbacks.append(callback)
+
+
+def remove_stats_callback(callback):
+    _stats_callbacks.remove(callback)
+
+
+def _new_stats(stats):
+    # Statistics need to be collected if requested by the caller or a callback is registered
+    if stats is None and _stats_callbacks:
+        return dict()
+    return stats
+
+
+class _CountingReader(io.RawIOBase):
+    """
+    Reader counting the bytes read from the wrapped stream and the time spent reading
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+        self.time = 0.0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        start = time.perf_counter()
+        data = self.stream.read(len(buffer))
+        self.time += time.perf_counter() - start
+        size = len(data)
+        buffer[:size] = data
+        self.count += size
+        return size
+
+
+def _with_compression(query, compression):
+    if compression is None:
+        return query
+
+    query = dict(query)  # copy the query dict so that the passed query can be reused
+    query["response"] = dict(query.get("response", {}))
+    query["response"].update(util.construct_response(compression=compression))
+    return query
+
+
+@contextlib.contextmanager
+def _query_stream(query, base_url, stats=None, buffer_size=65536, api=None, endpoints=None):
+    """
+    Post a query and provide the response body as stream. Compressed (gzip) bodies are decompressed incrementally
+    while the stream is read.
 
+    :param query:
+    :param base_url:
+    :param stats:       dictionary filled with the statistics of the query once the stream is consumed (or failed):
+                        api, base_url, channels, status_code, time_to_first_byte (until the response headers are
+                        received), total_time, read_time (waiting for the server/network), gzip_time (decompression of
+                        the response), bytes_received (bytes transferred), bytes_decoded (bytes after decompression),
+                        compression_ratio and error (None or description of the failure).
+                        The statistics are passed to the registered callbacks (see add_stats_callback).
+    :param buffer_size:
+    :param api:         name of the calling function (for the statistics)
+    :param endpoints:   EndpointPool base_url belongs to - its timeout is applied and the latency is recorded
+    :return:            stream (file like object)
+    """
 
-def get_data_json(query, base_url=None):
+    stats = _new_stats(stats)
+    if stats is not None:
+        stats["api"] = api
+        stats["base_url"] = base_url
+        stats["channels"] = [channel["name"] for channel in query.get("channels", [])]
+        stats["error"] = None
+
+    start_time = time.perf_counter()
+    received = None
+    decoded = None
+    compressed = False
+    try:
+        timeout = endpoints.timeout if endpoints is not None else None
+        # Only gzip is decompressed by the client itself (see below) - do not advertise deflate, br, ...
+        with requests.post(base_url + '/query', json=query, stream=True, timeout=timeout,
+                           headers={"Accept-Encoding": "gzip, identity"}) as response:
+            time_to_first_byte = time.perf_counter() - start_time
+            if stats is not None:
+                stats["time_to_first_byte"] = time_to_first_byte
+                stats["status_code"] = response.status_code
+            if endpoints is not None and response.status_code < 500:
+                endpoints.observe(base_url, time_to_first_byte)
+
+            if response.status_code != 200:
+                raise RuntimeError("Unable to retrieve data from server: ", response)
+
+            # Decompression of gzip is done here (independent of Content-Encoding) to be able to count the transferred
+            # bytes. Other content encodings (not requested, but e.g. added by a proxy) are left to urllib3.
+            content_encoding = response.headers.get("Content-Encoding", "identity").strip().lower()
+            response.raw.decode_content = content_encoding not in ["gzip", "x-gzip", "identity", ""]
+            received = _CountingReader(response.raw)
+            stream = io.BufferedReader(received, buffer_size)
+
+            # gzip magic number - twice if a gzip content encoding was applied to a compressed response
+            while stream.peek(2)[:2] == b"\x1f\x8b":
+                compressed = True
+                stream = io.BufferedReader(gzip.GzipFile(fileobj=stream, mode="rb"), buffer_size)
+
+            decoded = _CountingReader(stream)
+            yield io.BufferedReader(decoded, buffer_size)
+
+        ratio = decoded.count / received.count if received.count > 0 else 1.0
+        logger.info("Received %d bytes (%d bytes decoded - compression ratio %.2f)" %
+                    (received.count, decoded.count, ratio))
+
+    except Exception as e:
+        if stats is not None:
+            stats["error"] = repr(e)
+        raise
+
+    finally:
+        if stats is not None:
+            stats["total_time"] = time.perf_counter() - start_time
+            if received is not None:
+                stats["bytes_received"] = received.count
+                stats["bytes_decoded"] = decoded.count
+                stats["compression_ratio"] = decoded.count / received.count if received.count > 0 else 1.0
+                stats["read_time"] = received.time
+                stats["gzip_time"] = max(decoded.time - received.time, 0.0) if compressed else 0.0
+
+            for callback in _stats_callbacks:
+                try:
+                    callback(stats)
+                except Exception:
+                    logger.exception("Stats callback failed")
+
+
+def get_data_json(query, base_url=None, compression=None, stats=None):
     """
     Retrieve data in json format
     :param query:
     :param base_url:
+    :param compression: request a compressed response ("gzip") - the response is decompressed while it is parsed
+    :param stats:       dictionary filled with the statistics of the query (see _query_stream) plus parse_time and
+                        events (per channel)
     :return:            Usually the return format is like this
                         [{channel:{}, data:[{pulseId: , value: ...}]}, ]
                         However the format is depending on the kind of query
@@ -87,16 +408,21 @@ def get_data_json(query, base_url=None):
         query = dict(query)  # copy the query dict so that the passed query can be reused
         query["eventFields"] = backend_event_fields
 
-    if base_url is None:
-        base_url = default_base_url
-
-    logger.info("curl -H \"Content-Type: application/json\" -X POST -d '" + json.dumps(query) + "' " + base_url + "/query")
-    response = requests.post(base_url + '/query', json=query)
+    query = _with_compression(query, compression)
+    stats = _new_stats(stats)
 
-    if response.status_code != 200:
-        raise RuntimeError("Unable to retrieve data from server: ", response)
+    def query_endpoint(base_url, endpoints):
+        logger.info("curl -H \"Content-Type: application/json\" -X POST -d '" + json.dumps(query) + "' " + base_url + "/query")
+        with _query_stream(query, base_url, stats=stats, api="get_data_json", endpoints=endpoints) as stream:
+            start_time = time.perf_counter()
+            data = json.load(io.TextIOWrapper(stream, encoding="utf-8"))
+            if stats is not None:
+                stats["parse_time"] = time.perf_counter() - start_time
+                if "mapping" not in query:
+                    stats["events"] = {channel["channel"]["name"]: len(channel["data"]) for channel in data}
+        return data
 
-    data = response.json()
+    data = _with_failover(base_url, query_endpoint)
 
     # Post processing of the data
     # Convert multidimensional data to the correct shape
@@ -126,11 +452,14 @@ def get_data_json(query, base_url=None):
     return data
 
 
-def get_data_idread(query, base_url=None):
+def get_data_idread(query, base_url=None, compression=None, stats=None):
     """
     Retrieve data in idread format
     :param query:
     :param base_url:
+    :param compression: request a compressed response ("gzip") - the response is decompressed while it is decoded
+    :param stats:       dictionary filled with the statistics of the query (see _query_stream) and the decoding
+                        (see idread_util.decode)
     :return:            The return format is like this
                         [{channel:{}, data:[{pulseId: , value: ...}]}, ]
     """
@@ -165,9 +494,6 @@ def get_data_idread(query, base_url=None):
         query = dict(query)  # copy the query dict so that the passed query can be reused
         query["eventFields"] = backend_event_fields
 
-    if base_url is None:
-        base_url = default_base_url
-
     # Ensure that we request raw events
     if "response" in query:
         # Overwrite whatever is in format
@@ -175,32 +501,135 @@ def get_data_idread(query, base_url=None):
     else:
         query["response"] = util.construct_response(format="rawevent")
 
+    query = _with_compression(query, compression)
+
     # https://github.psi.ch/sf_daq/idread_specification#reference-implementation
     # https://github.psi.ch/sf_daq/ch.psi.daq.queryrest#rest-interface
 
-    # curl command that can be used for debugging
-    logger.info("curl -H \"Content-Type: application/json\" -X POST -d '"+json.dumps(query)+"' "+base_url + '/query')
+    stats = _new_stats(stats)
 
-    if "mapping" in query:
-        collector = idread_util.MappingCollector(len(query["channels"]), event_fields=requested_event_fields)
-    else:
-        collector = idread_util.DictionaryCollector(event_fields=requested_event_fields)
+    def query_endpoint(base_url, endpoints):
+        # curl command that can be used for debugging
+        logger.info("curl -H \"Content-Type: application/json\" -X POST -d '"+json.dumps(query)+"' "+base_url + '/query')
 
-    stream = False
-    if stream:
-        with requests.post(base_url + '/query', json=query, stream=stream) as response:
-            idread_util.decode(response.raw, collector_function=collector.add_data)
-    else:
-        response = requests.post(base_url + '/query', json=query)
-        idread_util.decode(io.BytesIO(response.content), collector_function=collector.add_data)
+        if "mapping" in query:
+            collector = idread_util.MappingCollector(len(query["channels"]), event_fields=requested_event_fields)
+        else:
+            collector = idread_util.DictionaryCollector(event_fields=requested_event_fields)
+
+        with _query_stream(query, base_url, stats=stats, api="get_data_idread", endpoints=endpoints) as stream:
+            idread_util.decode(stream, collector_function=collector.add_data, stats=stats)
+        return collector
+
+    return _with_failover(base_url, query_endpoint).get_data()
+
+
+class _ResumeTracker:
+    """
+    Collector wrapper keeping track of the decoded events to be able to resume an interrupted query: remembers the
+    last event written per channel and the position (pulse-id or global time) of the last completely decoded message.
+    After a resume events up to the last written event of a channel are dropped - i.e. no duplicates are written.
+    """
 
-    return collector.get_data()
+    def __init__(self, collector_function, header_function=None, by_pulse=True):
+        self.collector_function = collector_function
+        self.header_function = header_function
+        self.by_pulse = by_pulse
+
+        self.last = dict()          # (backend, channel) -> position of the last event passed to the collector
+        self.resume_last = None     # copy of last at the time of the resume - events up to it are dropped
+        self.completed = None       # position of the last completely decoded message
+        self.n_channels = 0
+        self.index = 0              # index of the next channel within the current message
+        self.position = None        # position of the current message
+
+    def add_header(self, channels):
+        self.n_channels = len(channels)
+        self.index = 0
+        self.position = None
+        if self.header_function is not None:
+            self.header_function(channels)
+
+    def add_data(self, channel_name, backend, value, pulse_id, global_time, ioc_time, status, severity):
+        if value is not None:
+            position = pulse_id if self.by_pulse else global_time
+            key = (backend, channel_name)
+
+            if self.resume_last is None or key not in self.resume_last or position > self.resume_last[key]:
+                self.collector_function(channel_name, backend, value, pulse_id, global_time, ioc_time, status,
+                                        severity)
+                self.last[key] = position
+
+            if self.position is None or position > self.position:
+                self.position = position
+
+        self.index += 1
+        if self.index == self.n_channels:  # message complete
+            if self.position is not None:
+                self.completed = self.position
+            self.index = 0
+            self.position = None
+
+    def resume(self, query):
+        """
+        :return:    query for the remaining range - starting at the last completely decoded message
+        """
+        self.resume_last = dict(self.last)
+        if self.completed is None:
+            return query
+
+        query_range = dict(query["range"])
+        query_range.pop("startExpansion", None)
+        if self.by_pulse:
+            query_range["startPulseId"] = int(self.completed)
+        else:
+            if "startDate" in query_range:
+                end = util.convert_date_to_nanoseconds(query_range.pop("endDate"))
+                query_range.pop("startDate")
+                query_range["endSeconds"] = "%d.%09d" % divmod(end, 1000000000)
+            query_range["startSeconds"] = "%d.%09d" % divmod(int(self.completed), 1000000000)
 
+        query = dict(query)  # copy the query dict so that the passed query can be reused
+        query["range"] = query_range
+        return query
+
+
+def _retryable(error):
+    # Errors of a query that are worth a retry - connection problems, truncated responses and server errors
+    if isinstance(error, (requests.exceptions.RequestException, urllib3.exceptions.HTTPError,
+                          http.client.HTTPException, ConnectionError, EOFError, struct.error)):
+        return True
+    if isinstance(error, RuntimeError) and len(error.args) > 1 and isinstance(error.args[1], requests.Response):
+        return error.args[1].status_code >= 500
+    return False
+
+
+def save_data_iread(query, filename, base_url=None, collector=None, compression=None, stats=None, retries=3,
+                    backoff=1.0, max_backoff=60.0):
+    """
+    Retrieve data in idread format and write it to a hdf5 file (or pass it to a collector)
+
+    If the connection drops (or the server fails) the query is retried with exponential backoff. The retried query
+    starts at the last completely decoded pulse-id (or global time) - already written data is kept and the events of
+    the retried query are appended without duplicates. If base_url is an EndpointPool the query is resumed on another
+    endpoint (without delay if one is available).
 
-def save_data_iread(query, filename, base_url=None, collector=None):
+    :param query:
+    :param filename:    hdf5 file to write to (if no collector is given)
+    :param base_url:    URL or EndpointPool
+    :param collector:   collector to pass the events to instead of writing a hdf5 file
+    :param compression: request a compressed response ("gzip")
+    :param stats:       dictionary filled with the statistics of the query (see _query_stream and idread_util.decode)
+                        - bytes and events are summed over all attempts, retries is the number of retries
+    :param retries:     maximum number of retries
+    :param backoff:     delay (seconds) before the first retry - doubled for every further retry
+    :param max_backoff: maximum delay (seconds) between retries
+    :return:
+    """
 
     if base_url is None:
         base_url = default_base_url
+    endpoints = base_url if isinstance(base_url, EndpointPool) else None
 
     # Ensure that we request raw events
     # TODO TO BE REMOVED
@@ -213,25 +642,79 @@ def save_data_iread(query, filename, base_url=None, collector=None):
     # https://github.psi.ch/sf_daq/idread_specification#reference-implementation
     # https://github.psi.ch/sf_daq/ch.psi.daq.queryrest#rest-interface
 
-    # curl command that can be used for debugging
-    logger.info("curl -H \"Content-Type: application/json\" -X POST -d '"+json.dumps(query)+"' "+base_url + '/query')
-
     if collector is not None:
         serializer = collector
     else:
         serializer = idread_util.HDF5Collector()
         serializer.open(filename)
 
-    stream = False
-    if stream:
-        with requests.post(base_url + '/query', json=query, stream=stream) as response:
-            idread_util.decode(response.raw, collector_function=serializer.add_data)
-    else:
-        response = requests.post(base_url + '/query', json=query)
-        idread_util.decode(io.BytesIO(response.content), collector_function=serializer.add_data)
-
-    if collector is None:
-        serializer.close()
+    # Collectors can make use of the channel types defined in the header
+    tracker = _ResumeTracker(serializer.add_data, header_function=getattr(serializer, "add_header", None),
+                             by_pulse="startPulseId" in query["range"])
+
+    stats = _new_stats(stats)
+    totals = {"bytes_received": 0, "bytes_decoded": 0, "events": dict()}
+
+    current_query = query
+    # The endpoint is reserved (acquire) until the attempt ended
+    url = endpoints.acquire() if endpoints is not None else base_url
+    attempt = 0
+    while True:
+        # curl command that can be used for debugging
+        logger.info("curl -H \"Content-Type: application/json\" -X POST -d '" + json.dumps(current_query) + "' " +
+                    url + '/query')
+
+        attempt_stats = {"retries": 1 if attempt > 0 else 0} if stats is not None else None
+        try:
+            with _query_stream(_with_compression(current_query, compression), url, stats=attempt_stats,
+                               api="save_data_iread", endpoints=endpoints) as stream:
+                idread_util.decode(stream, collector_function=tracker.add_data,
+                                   header_function=tracker.add_header, stats=attempt_stats)
+
+                if collector is None:
+                    start_time = time.perf_counter()
+                    serializer.close()
+                    if attempt_stats is not None:
+                        attempt_stats["close_time"] = time.perf_counter() - start_time
+
+            if endpoints is not None:
+                endpoints.end(url)
+            break
+
+        except Exception as e:
+            if endpoints is not None:
+                endpoints.end(url, error=e)
+            if attempt >= retries or not _retryable(e):
+                if collector is None and serializer.file is not None:
+                    # Keep the data decoded so far
+                    try:
+                        serializer.close()
+                    except Exception:
+                        logger.exception("Unable to close %s" % filename)
+                raise
+
+            attempt += 1
+            failed_url = url
+            url = endpoints.acquire(exclude=[failed_url]) if endpoints is not None else base_url
+            if url != failed_url:
+                logger.warning("Query to %s failed (%s) - resuming on %s (retry %d of %d)" %
+                               (failed_url, repr(e), url, attempt, retries))
+            else:
+                delay = min(backoff * 2 ** (attempt - 1), max_backoff)
+                logger.warning("Query failed (%s) - retry %d of %d in %.1f seconds" %
+                               (repr(e), attempt, retries, delay))
+                time.sleep(delay)
+            current_query = tracker.resume(query)
+
+        finally:
+            if attempt_stats is not None:
+                totals["bytes_received"] += attempt_stats.get("bytes_received", 0)
+                totals["bytes_decoded"] += attempt_stats.get("bytes_decoded", 0)
+                for channel, count in attempt_stats.get("events", {}).items():
+                    totals["events"][channel] = totals["events"].get(channel, 0) + count
+                stats.update(attempt_stats)
+                stats.update(totals)
+                stats["retries"] = attempt
 
 
 def search(regex, backends=None, ordering=None, reload=None, base_url=None):
@@ -248,20 +731,21 @@ def search(regex, backends=None, ordering=None, reload=None, base_url=None):
                         example: [{"backend": "somebackend", "channels":["channel"]}, ...]
     """
 
-    if base_url is None:
-        base_url = default_base_url
-
     query = util.construct_channel_list_query(regex, backends=backends, ordering=ordering, reload=reload)
 
-    # For debugging purposes print out curl command
-    logger.info("curl -H \"Content-Type: application/json\" -X POST -d '" + json.dumps(query) + "' " + base_url + "/channels")
+    def query_endpoint(base_url, endpoints):
+        # For debugging purposes print out curl command
+        logger.info("curl -H \"Content-Type: application/json\" -X POST -d '" + json.dumps(query) + "' " + base_url + "/channels")
+
+        response = requests.post(base_url + '/channels', json=query,
+                                 timeout=endpoints.timeout if endpoints is not None else None)
 
-    response = requests.post(base_url + '/channels', json=query)
+        if response.status_code != 200:
+            raise RuntimeError("Unable to retrieve data from server: ", response)
 
-    if response.status_code != 200:
-        raise RuntimeError("Unable to retrieve data from server: ", response)
+        return response.json()
 
-    raw_results = response.json()
+    raw_results = _with_failover(base_url, query_endpoint)
 
     # convert the return value to a dictionary
     results = dict()
@@ -301,7 +785,7 @@ def get_timestamp_from_pulse_id(pulse_ids, mapping_channel="SIN-CVME-TIFGUN-EVR0
 
 
 def get_pulse_id_from_timestamp(global_timestamp=None, mapping_channel="SIN-CVME-TIFGUN-EVR0:BEAMOK",
-                                base_url=default_base_url):
+                                base_url=None):
     """
     Retrieve pulse_id for given timestamp
 
@@ -339,9 +823,10 @@ def get_supported_backends(base_url=None):
     :return:
     """
 
-    if base_url is None:
-        base_url = default_base_url
+    def query_endpoint(base_url, endpoints):
+        logger.info("curl " + base_url + "/params/backends")
+        response = requests.get(base_url + '/params/backends',
+                                timeout=endpoints.timeout if endpoints is not None else None)
+        return response.json()
 
-    logger.info("curl " + base_url + "/params/backends")
-    response = requests.get(base_url + '/params/backends')
-    return response.json()
+    return _with_failover(base_url, query_endpoint)
@@ -0,0 +1,214 @@
+import numpy
+import h5py
+
+from data_api2 import util
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Lazy access to exported hdf5 files. Supported layouts:
+#   data_api2.cli (to_hdf5 and the save action):   /<channel>/values, /<channel>/pulseids, /<channel>/timestamps
+#   idread_util.HDF5Collector (and data_api.h5):   /<channel>/data, /<channel>/pulse_id, /<channel>/timestamp, ...
+#                                                   (data_api.h5.Serializer writes scalars with shape (N, 1) - they
+#                                                   are returned as 1-D columns)
+#   data_api.to_hdf5 (legacy data frames):          /<channel>, /pulseId, /globalSeconds, ... (one table)
+# Nothing is read when the file is opened - slices are located with a binary search on the (sorted) pulse-id or
+# timestamp dataset and only the requested hyperslab is read.
+
+_legacy_metadata = ["pulseId", "globalSeconds", "globalNanoseconds", "globalDate", "eventCount"]
+
+
+def _column(dataset, start, stop, step=1):
+    # Read a slice of a dataset - columns of shape (N, 1) are returned one dimensional
+    values = dataset[start:stop:step]
+    if values.ndim == 2 and values.shape[1] == 1:
+        values = values[:, 0]
+    return values
+
+
+def _search(dataset, value, side="left"):
+    # Binary search on a sorted dataset - reads one element per step
+    low, high = 0, dataset.shape[0]
+    while low < high:
+        middle = (low + high) // 2
+        element = dataset[middle]
+        if dataset.ndim == 2:  # column of shape (N, 1)
+            element = element[0]
+        if element < value or (side == "right" and element == value):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class Channel:
+    """
+    Channel of an hdf5 file - the columns are h5py datasets, data is only read when sliced
+    """
+
+    def __init__(self, name, values, pulse_ids=None, timestamps=None, time_unit=1):
+        """
+        :param name:        channel name
+        :param values:      values dataset
+        :param pulse_ids:   pulse-id dataset (sorted) - None if not available
+        :param timestamps:  timestamp dataset (sorted) - None if not available
+        :param time_unit:   nanoseconds per unit of the timestamp dataset
+        """
+        self.name = name
+        self.values = values
+        self.pulse_ids = pulse_ids
+        self.timestamps = timestamps
+        self.time_unit = time_unit
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __getitem__(self, key):
+        """
+        Positional slice, e.g. channel[100:200]
+        :return: dictionary of arrays {"value": array, "pulseId": array, "timeRaw": array}
+        """
+        if not isinstance(key, slice):
+            raise TypeError("Channels can only be sliced")
+        start, stop, step = key.indices(len(self))
+        return self._read(start, stop, step)
+
+    def _read(self, start, stop, step=1):
+        data = {"value": _column(self.values, start, stop, step)}
+        if self.pulse_ids is not None:
+            data["pulseId"] = _column(self.pulse_ids, start, stop, step)
+        if self.timestamps is not None:
+            timestamps = _column(self.timestamps, start, stop, step)
+            if self.time_unit != 1:
+                timestamps = numpy.round(timestamps * self.time_unit).astype(numpy.int64)
+            data["timeRaw"] = timestamps
+        return data
+
+    def pulse_index(self, start=None, end=None):
+        """
+        Positional range of the events with start <= pulse-id <= end
+        :return: (first, stop) tuple
+        """
+        if self.pulse_ids is None:
+            raise RuntimeError("Channel %s has no pulse-ids" % self.name)
+
+        first = 0 if start is None else _search(self.pulse_ids, start, side="left")
+        stop = len(self) if end is None else _search(self.pulse_ids, end, side="right")
+        return first, max(first, stop)
+
+    def time_index(self, start=None, end=None):
+        """
+        Positional range of the events with start <= time <= end
+        :param start:   date or nanoseconds
+        :param end:     date or nanoseconds
+        :return:        (first, stop) tuple
+        """
+        if self.timestamps is None:
+            raise RuntimeError("Channel %s has no timestamps" % self.name)
+
+        first = 0 if start is None else _search(self.timestamps, self._time_position(start), side="left")
+        stop = len(self) if end is None else _search(self.timestamps, self._time_position(end), side="right")
+        return first, max(first, stop)
+
+    def _time_position(self, date):
+        # date in the unit of the timestamp dataset
+        nanoseconds = _to_nanoseconds(date)
+        if self.time_unit != 1:
+            return nanoseconds / self.time_unit
+        return nanoseconds
+
+    def pulse_slice(self, start=None, end=None):
+        """
+        Read the events with start <= pulse-id <= end
+        :return: dictionary of arrays {"value": array, "pulseId": array, "timeRaw": array}
+        """
+        return self._read(*self.pulse_index(start, end))
+
+    def time_slice(self, start=None, end=None):
+        """
+        Read the events with start <= time <= end
+        :param start:   date or nanoseconds
+        :param end:     date or nanoseconds
+        :return:        dictionary of arrays {"value": array, "pulseId": array, "timeRaw": array}
+        """
+        return self._read(*self.time_index(start, end))
+
+
+class H5Reader:
+    """
+    Lazy reader for exported hdf5 files
+
+    Example:
+    with H5Reader("export.h5") as reader:
+        data = reader["SINEG01-RCIR-PUP10:SIG-AMPLT"].pulse_slice(5166875100, 5166875200)
+    """
+
+    def __init__(self, filename):
+        self.file = h5py.File(str(filename), "r")
+        self.channels = self._detect_channels()
+
+    def _detect_channels(self):
+        channels = dict()
+        for name, item in self.file.items():
+            if not isinstance(item, h5py.Group):
+                continue
+
+            if "values" in item:  # data_api2.cli layout
+                channels[name] = Channel(name, item["values"], item.get("pulseids"), item.get("timestamps"))
+            elif "data" in item:  # HDF5Collector layout
+                channels[name] = Channel(name, item["data"], item.get("pulse_id"), item.get("timestamp"))
+
+        if not channels:  # legacy data frame layout - every non metadata dataset is a channel
+            pulse_ids = self.file.get("pulseId")
+            timestamps = self.file.get("globalSeconds")
+            for name, item in self.file.items():
+                if isinstance(item, h5py.Dataset) and name not in _legacy_metadata:
+                    channels[name] = Channel(name, item, pulse_ids, timestamps, time_unit=1000000000)
+
+        return channels
+
+    def __getitem__(self, channel_name):
+        return self.channels[channel_name]
+
+    def __contains__(self, channel_name):
+        return channel_name in self.channels
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def keys(self):
+        return self.channels.keys()
+
+    def pulse_slice(self, start=None, end=None, channels=None):
+        """
+        Read the events with start <= pulse-id <= end of all (or the given) channels
+        :return: [{"channel": {"name": ""}, "data": {"value": array, "pulseId": array, "timeRaw": array}}, ...]
+        """
+        channels = self.channels.keys() if channels is None else channels
+        return [{"channel": {"name": name}, "data": self.channels[name].pulse_slice(start, end)}
+                for name in channels]
+
+    def time_slice(self, start=None, end=None, channels=None):
+        """
+        Read the events with start <= time <= end of all (or the given) channels
+        :return: [{"channel": {"name": ""}, "data": {"value": array, "pulseId": array, "timeRaw": array}}, ...]
+        """
+        channels = self.channels.keys() if channels is None else channels
+        return [{"channel": {"name": name}, "data": self.channels[name].time_slice(start, end)}
+                for name in channels]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _to_nanoseconds(value):
+    if isinstance(value, (int, numpy.integer)):
+        return int(value)
+    return util.convert_date_to_nanoseconds(value)
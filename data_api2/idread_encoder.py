@@ -0,0 +1,250 @@
+import io
+import json
+import struct
+import hashlib
+import numpy
+import bitshuffle
+
+# Encoder for the idread (rawevent) format - the inverse of idread_util.decode. Used to create test data and
+# synthetic streams of arbitrary size for benchmarks and the local stand-in server.
+#
+# Message layout (all sizes and ids big endian):
+#   size (int64, bytes following the size field), id (int16)
+#   id 1 - header: hash (int64), compression (int8), json (optionally bitshuffle/lz4 compressed)
+#   id 0 - values: for every channel of the header: event_size (int32) followed by event_size bytes
+#          ioc_time (int64), pulse_id (int64), global_time (int64), status (int8), severity (int8), value
+#          An event_size of 0 marks a channel without event for this message.
+# Event fields and values use the byte order ("encoding") of the channel.
+
+# Types supported by the decoder - type name -> numpy dtype (without byte order)
+types = {"float64": "f8", "float32": "f4",
+         "int8": "i1", "uint8": "u1", "int16": "i2", "uint16": "u2",
+         "int32": "i4", "uint32": "u4", "int64": "i8", "uint64": "u8"}
+
+compressions = [None, "bitshuffle_lz4"]
+
+_bitshuffle_target_block_size = 8192  # bytes - same default as bitshuffle
+
+
+def _block_size(itemsize):
+    # Default block size of bitshuffle in number of elements
+    block_size = (_bitshuffle_target_block_size // itemsize) // 8 * 8
+    return max(block_size, 128)
+
+
+def _compress(data):
+    # bitshuffle/lz4 with the length (bytes) and block size (bytes) prefix used by bsread/idread
+    data = numpy.ascontiguousarray(data)
+    block_size = _block_size(data.dtype.itemsize)
+    compressed = bitshuffle.compress_lz4(data.reshape(-1), block_size)
+    return struct.pack(">q", data.nbytes) + struct.pack(">i", block_size * data.dtype.itemsize) + \
+        compressed.tobytes()
+
+
+class Channel:
+    """
+    Channel definition of an idread stream
+    """
+
+    def __init__(self, name, backend="sf-databuffer", type="float64", shape=None, encoding="little",
+                 compression=None):
+        """
+        :param name:
+        :param backend:
+        :param type:        one of types
+        :param shape:       shape in numpy order (slowest dimension first) - None for scalars
+        :param encoding:    byte order - "little" or "big"
+        :param compression: one of compressions - compression is only supported for arrays
+        """
+        if type not in types:
+            raise ValueError("Unsupported type %s - supported types: %s" % (type, " ".join(types)))
+        if encoding not in ["little", "big"]:
+            raise ValueError("Unsupported encoding %s" % encoding)
+        if compression not in compressions:
+            raise ValueError("Unsupported compression %s" % compression)
+        if compression is not None and shape is None:
+            raise ValueError("Compression is only supported for arrays")
+
+        self.name = name
+        self.backend = backend
+        self.type = type
+        self.shape = list(shape) if shape is not None else None
+        self.encoding = encoding
+        self.compression = compression
+
+        byte_order = ">" if encoding == "big" else "<"
+        self.dtype = numpy.dtype(byte_order + types[type])
+        self.event_format = byte_order + "qqqbb"
+
+    def header(self):
+        header = {"name": self.name, "backend": self.backend, "type": self.type, "encoding": self.encoding}
+        if self.shape is not None:
+            header["shape"] = self.shape[::-1]  # bsread order - fastest dimension first
+        if self.compression is not None:
+            header["compression"] = self.compression
+        return header
+
+    def encode_value(self, value):
+        """
+        Encode a value of the channel (without event header)
+        """
+        if self.shape is None:
+            return numpy.asarray(value, dtype=self.dtype).tobytes()
+
+        value = numpy.asarray(value, dtype=self.dtype)
+        if list(value.shape) != self.shape:
+            raise ValueError("Value of %s has shape %s - expected %s" % (self.name, list(value.shape), self.shape))
+
+        if self.compression == "bitshuffle_lz4":
+            return _compress(value)
+        return value.tobytes()
+
+    def encode_event(self, value_bytes, pulse_id, global_time, ioc_time=None, status=0, severity=0):
+        """
+        Encode an event with already encoded value bytes (see encode_value)
+        """
+        if ioc_time is None:
+            ioc_time = global_time
+        event = struct.pack(self.event_format, ioc_time, pulse_id, global_time, status, severity) + value_bytes
+        return struct.pack(self.event_format[0] + "i", len(event)) + event
+
+
+def encode_header(channels, compress=False):
+    """
+    Encode a header message
+
+    :param channels:    list of Channel
+    :param compress:    bitshuffle/lz4 compress the header
+    :return:            bytes
+    """
+    data = json.dumps({"channels": [channel.header() for channel in channels]}).encode()
+    header_hash = struct.unpack(">q", hashlib.md5(data).digest()[:8])[0]
+
+    if compress:
+        data = _compress(numpy.frombuffer(data, dtype=numpy.uint8))
+
+    message = struct.pack(">h", 1) + struct.pack(">q", header_hash) + struct.pack(">b", 1 if compress else 0) + data
+    return struct.pack(">q", len(message)) + message
+
+
+def encode_values(events):
+    """
+    Encode a values message
+
+    :param events:  list with the encoded event (see Channel.encode_event) of every channel of the header - None for
+                    channels without event in this message
+    :return:        bytes
+    """
+    parts = [struct.pack(">h", 0)]
+    for event in events:
+        parts.append(event if event is not None else b"\x00\x00\x00\x00")
+    message = b"".join(parts)
+    return struct.pack(">q", len(message)) + message
+
+
+def encode(stream, channels, events, compress_header=False):
+    """
+    Encode events into an idread stream
+
+    :param stream:          writable file like object
+    :param channels:        list of Channel
+    :param events:          iterable of messages, each message being a list with one entry per channel: either None
+                            (no event) or a tuple (value, pulse_id, global_time, ioc_time, status, severity)
+    :param compress_header:
+    """
+    stream.write(encode_header(channels, compress=compress_header))
+    for message in events:
+        encoded = []
+        for channel, event in zip(channels, message):
+            if event is None:
+                encoded.append(None)
+            else:
+                value, pulse_id, global_time, ioc_time, status, severity = event
+                encoded.append(channel.encode_event(channel.encode_value(value), pulse_id, global_time,
+                                                    ioc_time=ioc_time, status=status, severity=severity))
+        stream.write(encode_values(encoded))
+
+
+def _value_pool(channel, size, random):
+    # Pre-encoded values to cycle through - keeps the generation cheap enough for multi-GB streams
+    shape = [] if channel.shape is None else channel.shape
+    pool = []
+    for _ in range(size):
+        if channel.dtype.kind == "f":
+            value = random.standard_normal(shape)
+        else:
+            info = numpy.iinfo(channel.dtype)
+            value = random.integers(max(info.min, -1000), min(info.max, 1000), size=shape, endpoint=True)
+        pool.append(channel.encode_value(value))
+    return pool
+
+
+def generate(channels, n_events, start_pulse_id=0, start_time=1500000000000000000, interval=10000000,
+             missing=0.0, seed=0, pool_size=16, compress_header=False):
+    """
+    Generate a synthetic idread stream message by message
+
+    :param channels:        list of Channel
+    :param n_events:        number of values messages - None for an endless stream
+    :param start_pulse_id:  pulse-id of the first message - increases by one per message
+    :param start_time:      global time (nanoseconds) of the first message
+    :param interval:        time between messages (nanoseconds)
+    :param missing:         probability of a channel having no event in a message
+    :param seed:            seed for the random values
+    :param pool_size:       number of distinct values per channel
+    :param compress_header:
+    :return:                generator of bytes (one message each)
+    """
+    random = numpy.random.default_rng(seed)
+    pools = [_value_pool(channel, pool_size, random) for channel in channels]
+
+    yield encode_header(channels, compress=compress_header)
+
+    i = 0
+    while n_events is None or i < n_events:
+        pulse_id = start_pulse_id + i
+        global_time = start_time + i * interval
+        absent = random.random(len(channels)) < missing if missing > 0 else None
+
+        events = []
+        for index, channel in enumerate(channels):
+            if absent is not None and absent[index]:
+                events.append(None)
+            else:
+                events.append(channel.encode_event(pools[index][i % pool_size], pulse_id, global_time))
+        yield encode_values(events)
+        i += 1
+
+
+class GeneratorStream(io.RawIOBase):
+    """
+    Readable stream over a generator of bytes (e.g. generate()) - data is produced while it is read
+    """
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.buffer = b""
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.offset >= len(self.buffer):
+            try:
+                self.buffer = next(self.generator)
+                self.offset = 0
+            except StopIteration:
+                return 0
+
+        size = min(len(buffer), len(self.buffer) - self.offset)
+        buffer[:size] = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+
+def generate_stream(*args, **kwargs):
+    """
+    Synthetic idread stream as buffered file like object - see generate for the parameters
+    """
+    return io.BufferedReader(GeneratorStream(generate(*args, **kwargs)), 1024 * 1024)
@@ -3,6 +3,7 @@ import bitshuffle
 import json
 import struct
 import h5py
+import time
 from datetime import datetime
 
 import logging
@@ -148,46 +149,147 @@ class MappingCollector:
         return self.backend_data
 
 
+class ArrayCollector:
+    """
+    Collector to collect idread data into columnar numpy arrays - one array per channel and event field
+
+    Returns a list like this:
+    [{"channel":{"name": "", "backend":""}, "data":{"value": array, "pulseId": array, ...}},...]
+
+    Events without a value (no data for the channel in this message) are skipped.
+    """
+    def __init__(self, event_fields=["value", "pulseId", "timeRaw", "iocTimeRaw", "status", "severity"]):
+        self.event_fields = event_fields
+        self.channel_data = dict()
+
+    def add_data(self, channel_name, backend, value, pulse_id, global_time, ioc_time, status, severity):
+
+        # Internal datastructure used looks like this:
+        # channel_data[(backend, channel)] -> ([values], [pulse_ids], [global_times], [ioc_times], ...)
+
+        if value is None:
+            return
+
+        key = (backend, channel_name)
+        columns = self.channel_data.get(key)
+        if columns is None:
+            columns = ([], [], [], [], [], [])
+            self.channel_data[key] = columns
+
+        columns[0].append(value)
+        columns[1].append(pulse_id)
+        columns[2].append(global_time)
+        columns[3].append(ioc_time)
+        columns[4].append(status)
+        columns[5].append(severity)
+
+    def get_data(self):
+        data = []
+        for (backend, channel), columns in self.channel_data.items():
+            arrays = dict()
+            for field in self.event_fields:
+                if field == "value":
+                    arrays["value"] = _to_value_array(columns[0])
+                elif field == "pulseId":
+                    arrays["pulseId"] = numpy.asarray(columns[1], dtype=numpy.int64)
+                elif field == "timeRaw":  # this is global time globalTime in the idread specification
+                    arrays["timeRaw"] = numpy.asarray(columns[2], dtype=numpy.int64)
+                elif field == "iocTimeRaw":
+                    arrays["iocTimeRaw"] = numpy.asarray(columns[3], dtype=numpy.int64)
+                elif field == "status":
+                    arrays["status"] = numpy.asarray(columns[4], dtype=numpy.int8)
+                elif field == "severity":
+                    arrays["severity"] = numpy.asarray(columns[5], dtype=numpy.int8)
+
+            data.append({"channel": {"name": channel, "backend": backend}, "data": arrays})
+
+        return data
+
+
+def _to_value_array(values):
+    # Values of the same shape are stacked - values of different shapes (e.g. waveforms changing their length) are
+    # kept as an object array with one value per event
+    try:
+        return numpy.asarray(values)
+    except ValueError:
+        array = numpy.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            array[i] = value
+        return array
+
+
 class Dataset:
     def __init__(self, name, reference, count=0):
         self.name = name
-        self.count = count
+        self.count = count          # number of entries written to the file
         self.reference = reference
+        self.buffer = []            # entries not yet written to the file
 
 
 class HDF5Collector:
     """
     Collector to write idread based data directly to a hdf5 file
+
+    Values are buffered per dataset and written in batches of batch_size entries - one hdf5 write per batch instead
+    of one per event. Datasets are allocated with chunks of about chunk_size bytes and grow geometrically - they are
+    shrunk to their actual size when the file is closed.
     """
 
-    def __init__(self, compress=False):
+    def __init__(self, compress=False, batch_size=1000, chunk_size=1 << 20):
         self.file = None
         self.datasets = dict()
         self.compress = compress
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.channels = dict()
 
     def open(self, file_name):
 
         if self.file:
             logger.info('File '+self.file.name+' is currently open - will close it')
-            self.close_file()
+            self.close()
 
         logger.info('Open file '+file_name)
         self.file = h5py.File(file_name, "w")
+        self.datasets = dict()
 
     def close(self):
         self.compact_data()
 
         logger.info('Close file '+self.file.name)
         self.file.close()
+        self.file = None
+
+    def flush(self):
+        # Write all buffered values to the file
+        for dataset in self.datasets.values():
+            self._write_buffer(dataset)
 
     def compact_data(self):
-        # Compact datasets, i.e. shrink them to actual size
+        # Write remaining buffered values and shrink datasets to actual size
+        self.flush()
 
         for key, dataset in self.datasets.items():
             if dataset.count < dataset.reference.shape[0]:
                 logger.info('Compact data for dataset ' + dataset.name + ' from ' + str(dataset.reference.shape[0]) + ' to ' + str(dataset.count))
                 dataset.reference.resize(dataset.count, axis=0)
 
+    def _write_buffer(self, dataset):
+        if not dataset.buffer:
+            return
+
+        n_entries = len(dataset.buffer)
+        reference = dataset.reference
+        values = numpy.asarray(dataset.buffer, dtype=reference.dtype).reshape((n_entries,) + reference.shape[1:])
+
+        if reference.shape[0] < dataset.count + n_entries:
+            # Grow geometrically - a resize per batch is expensive for large datasets
+            reference.resize(max(dataset.count + n_entries, 2 * reference.shape[0]), axis=0)
+
+        reference[dataset.count:dataset.count + n_entries] = values
+        dataset.count += n_entries
+        dataset.buffer = []
+
     def append_dataset(self, dataset_name, value, dtype="f8", shape=[1,], compress=False):
         # print(dataset_name, value)
 
@@ -203,59 +305,102 @@ class HDF5Collector:
                 if compression != 'none':
                     dataset_options["compression"] = compression
                     if compression == "gzip":
-                        dataset_options["compression"] = compression_opts
-
-            reference = self.file.require_dataset(dataset_name, [1,]+shape, dtype=dtype, maxshape=[None,]+shape, **dataset_options)
+                        dataset_options["compression_opts"] = compression_opts
+
+            shape = list(shape)
+            # Chunks of (about) chunk_size bytes - auto chunking picks tiny chunks for datasets created empty
+            entry_size = int(numpy.prod(shape, dtype=numpy.int64)) * numpy.dtype(dtype).itemsize
+            chunk_entries = max(1, min(self.batch_size, self.chunk_size // max(entry_size, 1)))
+            reference = self.file.require_dataset(dataset_name, [0,]+shape, dtype=dtype, maxshape=[None,]+shape,
+                                                  chunks=tuple([chunk_entries]+shape), **dataset_options)
             self.datasets[dataset_name] = Dataset(dataset_name, reference)
 
         dataset = self.datasets[dataset_name]
-        # Check if dataset has required size, if not extend it
-        if dataset.reference.shape[0] < dataset.count + 1:
-            dataset.reference.resize(dataset.count + 1000, axis=0)
 
         # TODO need to add an None check - i.e. for different frequencies
-        if value is not None:
-            dataset.reference[dataset.count] = value
+        if value is None:
+            value = numpy.zeros(dataset.reference.shape[1:], dtype=dataset.reference.dtype)
 
-        dataset.count += 1
+        dataset.buffer.append(value)
+
+        if len(dataset.buffer) >= self.batch_size:
+            self._write_buffer(dataset)
 
     # def add_data(self, channel_name, value_name, value, dtype="f8", shape=[1, ]):
     #     self.append_dataset('/' + channel_name + '/' + value_name, value, dtype=dtype, shape=shape, compress=self.compress)
 
+    def add_header(self, channels):
+        # Remember data type and shape of the channels - scalar values are decoded into python types
+        for channel in channels:
+            dtype = numpy.dtype(channel['dtype'])
+            self.channels[channel['name']] = (dtype.newbyteorder('='), list(channel['shape']))
+
     def add_data(self, channel_name, backend, value, pulse_id, global_time, ioc_time, status, severity):
         # TODO Right now ignoring backend!
+
+        if value is None:  # No data for this channel in this message
+            return
+
+        if channel_name in self.channels:
+            dtype, shape = self.channels[channel_name]
+            if shape == [1]:
+                shape = []
+        else:
+            value = numpy.asarray(value)
+            dtype, shape = value.dtype, list(value.shape)
+
         self.append_dataset('/' + channel_name + '/data', value,
-                            dtype=value.dtype, shape=value.shape, compress=self.compress)
+                            dtype=dtype, shape=shape, compress=self.compress)
         self.append_dataset('/' + channel_name + '/pulse_id', pulse_id,
-                            dtype=pulse_id.dtype, shape=pulse_id.shape, compress=self.compress)
+                            dtype='i8', shape=[], compress=self.compress)
         self.append_dataset('/' + channel_name + '/timestamp', global_time,
-                            dtype=global_time.dtype, shape=global_time.shape, compress=self.compress)
+                            dtype='i8', shape=[], compress=self.compress)
         self.append_dataset('/' + channel_name + '/ioc_timestamp', ioc_time,
-                            dtype=ioc_time.dtype, shape=ioc_time.shape, compress=self.compress)
+                            dtype='i8', shape=[], compress=self.compress)
         self.append_dataset('/' + channel_name + '/status', status,
-                            dtype=status.dtype, shape=status.shape, compress=self.compress)
-        self.append_dataset('/' + channel_name + '/severity', ioc_time,
-                            dtype=severity.dtype, shape=severity.shape, compress=self.compress)
+                            dtype='i1', shape=[], compress=self.compress)
+        self.append_dataset('/' + channel_name + '/severity', severity,
+                            dtype='i1', shape=[], compress=self.compress)
 
 
-def decode(bytes, collector_function=None):
+def decode(bytes, collector_function=None, header_function=None, stats=None):
     """
     Decode idread decoded data
 
     :param bytes:              bytes to decode
     :param collector_function: function to collect decoded values. The signature of the function is as follows:
                                def add_data(self, channel_name, backend, value, pulse_id, global_time, ioc_time, status, severity):
+    :param header_function:    optional function called with the list of channels each time a header is decoded.
+                               Each channel is a dictionary with (at least) name, backend, dtype (numpy dtype string
+                               incl. byte order), shape (numpy order, [1] for scalars) and compression
+    :param stats:              optional dictionary filled with timing information (seconds) and counts of the decoding:
+                               decode_time (total, incl. reading the stream), header_time, decompress_time,
+                               collect_time (time spent in the collector function), messages (number of values
+                               messages), events and missing (number of events / messages without event per channel).
+                               Timing adds a small overhead - it is only done if stats is passed.
     :return:
     """
 
     channels = None
 
+    timed = stats is not None
+    if timed:
+        start_time = time.perf_counter()
+        header_time = 0.0
+        decompress_time = 0.0
+        collect_time = 0.0
+        messages = 0
+        events = dict()
+        missing = dict()
+
     while True:
         # read size
         b = bytes.read(8)
         if b == b'':
             logger.debug('End of stream')
             break
+        if len(b) < 8:
+            raise EOFError('Unexpected end of stream')
 
         # size = numpy.frombuffer(b, dtype='>i8')
         # size = int.from_bytes(b, byteorder='big')
@@ -266,6 +411,9 @@ def decode(bytes, collector_function=None):
         id = struct.unpack(">h", bytes.read(2))[0]
 
         if id == 1:  # Read Header
+            if timed:
+                t = time.perf_counter()
+
             header = _read_header(bytes, size)
             logging.debug(header)
 
@@ -317,9 +465,18 @@ def decode(bytes, collector_function=None):
 
             logger.debug(channels)
 
+            if header_function is not None:
+                header_function(channels)
+
+            if timed:
+                header_time += time.perf_counter() - t
+                for channel in channels:
+                    events.setdefault(channel['name'], 0)
+                    missing.setdefault(channel['name'], 0)
+
         elif id == 0:  # Read Values
 
-            if channels is None or channel == []:  # Header was not yet received
+            if not channels:  # Header was not yet received
                 bytes.read(int(size - 2))
                 logging.warning('No channels specified, cannot deserialize - drop remaining bytes')
 
@@ -353,8 +510,12 @@ def decode(bytes, collector_function=None):
                         # number of bytes to subtract from event_size = 8 - 8 - 8 - 1 - 1 = 26
                         n_bytes_to_read = int(event_size-26)
                         raw_bytes = bytes.read(n_bytes_to_read)
+                        if len(raw_bytes) < n_bytes_to_read:
+                            raise EOFError('Unexpected end of stream')
 
                         if channel['compression'] is not None:
+                            if timed:
+                                t = time.perf_counter()
 
                             # TODO need to check for compression type -
                             # Ideally this is done while header parsing, and here I would get the decode function
@@ -365,13 +526,16 @@ def decode(bytes, collector_function=None):
                                                              dtype=numpy.uint8),
                                                              shape=(channel['shape']),
                                                              dtype=numpy.dtype(channel["dtype"]),
-                                                             block_size=b_size / channel['size'])
+                                                             block_size=b_size // channel['size'])
+
+                            if timed:
+                                decompress_time += time.perf_counter() - t
 
                         else:
                             if channel['shape'] is None or channel['shape'] == [1]:
                                 data = struct.unpack(channel['stype'], raw_bytes)[0]
                             elif len(channel['shape']) == 1:
-                                data = struct.unpack(channel['stype'], raw_bytes)
+                                data = numpy.frombuffer(raw_bytes, dtype=channel["dtype"])
                             else:
                                 data = numpy.frombuffer(raw_bytes, dtype=channel["dtype"])
                                 data = data.reshape(channel['shape'])
@@ -379,7 +543,21 @@ def decode(bytes, collector_function=None):
                     size_counter += (2 + 4 + event_size)  # 2 for id, 4 for event_size
 
                     if collector_function is not None:
-                        collector_function(channel['name'], channel["backend"], data, pulse_id, global_time, ioc_time, status, severity)
+                        if timed:
+                            t = time.perf_counter()
+                            collector_function(channel['name'], channel["backend"], data, pulse_id, global_time, ioc_time, status, severity)
+                            collect_time += time.perf_counter() - t
+                        else:
+                            collector_function(channel['name'], channel["backend"], data, pulse_id, global_time, ioc_time, status, severity)
+
+                    if timed:
+                        if event_size == 0:
+                            missing[channel['name']] += 1
+                        else:
+                            events[channel['name']] += 1
+
+                if timed:
+                    messages += 1
 
                 remaining_bytes = size-size_counter
                 if remaining_bytes > 0:
@@ -391,12 +569,23 @@ def decode(bytes, collector_function=None):
             logging.warning("id %i not supported - drop remaining bytes" % id)
             bytes.read(int(size-2))
 
+    if timed:
+        stats["decode_time"] = time.perf_counter() - start_time
+        stats["header_time"] = header_time
+        stats["decompress_time"] = decompress_time
+        stats["collect_time"] = collect_time
+        stats["messages"] = messages
+        stats["events"] = events
+        stats["missing"] = missing
+
 
 def _read_header(byte_array, size):
     hash = numpy.frombuffer(byte_array.read(8), dtype='>i8')
     compression = numpy.frombuffer(byte_array.read(1), dtype='>i1')
 
     raw_data = byte_array.read(int(size - 2 - 8 - 1))
+    if len(raw_data) < size - 2 - 8 - 1:
+        raise EOFError('Unexpected end of stream')
 
     if compression == 0:  # header not compressed
         data = raw_data.decode()
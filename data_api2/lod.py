@@ -0,0 +1,238 @@
+import math
+import numpy
+
+from data_api2 import util, client, aggregation, metrics
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Level of detail retrieval for plotting. For a given range and point budget only about budget rows are transferred:
+# wide ranges are requested aggregated (min/mean/max/count per bin), narrow ranges (where the number of events fits
+# the budget) as raw events. Retrieved levels are cached per channel and reused for all ranges they cover in enough
+# detail.
+
+
+class _Level:
+    def __init__(self, start, end, width, data, raw=False):
+        self.start = start      # covered range in nanoseconds [start, end]
+        self.end = end
+        self.width = width      # bin width in nanoseconds (0 for raw events)
+        self.data = data        # dictionary of arrays, sorted by timeRaw
+        self.raw = raw
+
+    def covers(self, start, end):
+        return self.start <= start and end <= self.end
+
+    def slice(self, start, end):
+        times = self.data["timeRaw"]
+        first = numpy.searchsorted(times, start, side="left")
+        last = numpy.searchsorted(times, end, side="right")
+        return {field: values[first:last] for field, values in self.data.items()}
+
+    def count(self, start, end):
+        # (Estimated) number of raw events within the range
+        if self.raw:
+            return len(self.slice(start, end)["timeRaw"])
+        return int(self.slice(start, end)["count"].sum())
+
+
+class LevelOfDetail:
+    """
+    Retrieve data for plotting with a point budget
+
+    Example:
+    lod = LevelOfDetail(points=1000)
+    data = lod.get_data(["SINEG01-RCIR-PUP10:SIG-AMPLT"], start, end)
+
+    Returns a list like this:
+    [{"channel": {"name": "", "backend": ""}, "aggregated": True,
+      "data": {"timeRaw": array, "min": array, "mean": array, "max": array, "count": array}}, ...]
+    or for raw data ("aggregated": False):
+      "data": {"timeRaw": array, "pulseId": array, "value": array}
+    """
+
+    def __init__(self, points=1000, base_url=None, max_levels=10, pyramid=None):
+        """
+        :param points:      point budget - maximum number of rows to retrieve per channel and query
+        :param base_url:    Base URL of the data api
+        :param max_levels:  maximum number of cached levels per channel - the oldest level is dropped first
+        :param pyramid:     pyramid.RollupPyramid - all retrieved raw events are rolled up into it and ranges it
+                            covers are served from it
+        """
+        self.points = points
+        self.base_url = base_url
+        self.max_levels = max_levels
+        self.pyramid = pyramid
+        self.cache = dict()
+
+    def get_data(self, channels, start, end, points=None):
+        """
+        Get data for the given range with (about) points rows per channel
+
+        :param channels:    channel or list of channels (backend/channel notation is supported)
+        :param start:       start date (datetime or string)
+        :param end:         end date (datetime or string)
+        :param points:      point budget for this query - defaults to the budget given at construction
+        :return:            see class documentation
+        """
+
+        if isinstance(channels, str):
+            channels = [channels, ]
+
+        if points is None:
+            points = self.points
+
+        start_ns = util.convert_date_to_nanoseconds(start)
+        end_ns = util.convert_date_to_nanoseconds(end)
+        if end_ns <= start_ns:
+            raise ValueError("end needs to be after start")
+
+        data = []
+        for channel in channels:
+            aggregated, values = self._get_channel(channel, start_ns, end_ns, points)
+
+            backend, channel_name = _split_channel(channel)
+            channel_spec = {"name": channel_name}
+            if backend is not None:
+                channel_spec["backend"] = backend
+
+            data.append({"channel": channel_spec, "aggregated": aggregated, "data": values})
+
+        return data
+
+    def _get_channel(self, channel, start, end, points):
+        levels = self.cache.setdefault(channel, [])
+        width = int(math.ceil((end - start) / points))
+
+        covering = [level for level in levels if level.covers(start, end)]
+
+        # Raw data that covers the range is the most detailed level available
+        for level in covering:
+            if level.raw:
+                logger.debug("Serving %s from cached raw data" % channel)
+                metrics.cache_access("lod", True)
+                return self._from_raw(level, start, end, points)
+
+        # Rollups of previously retrieved raw events - as long as the range holds more events than the budget
+        if self.pyramid is not None:
+            backend, channel_name = _split_channel(channel)
+            if self.pyramid.covers(channel_name, start, end, backend=backend):
+                rollup = self.pyramid.get_data(channel_name, start, end, points=points, backend=backend)
+                if rollup is not None and int(rollup["data"]["count"].sum()) > points:
+                    logger.debug("Serving %s from rollup level %s" % (channel, rollup["resolution"]))
+                    metrics.cache_access("lod", True)
+                    return True, rollup["data"]
+
+        # Coarsest cached aggregation that is still detailed enough - bins up to twice the requested width are
+        # accepted (i.e. at least half of the point budget) as durationPerBin widths are rounded to full seconds
+        detailed = [level for level in covering if level.width <= 2 * width]
+        if detailed:
+            logger.debug("Serving %s from cached aggregation" % channel)
+            metrics.cache_access("lod", True)
+            level = max(detailed, key=lambda x: x.width)
+            return True, level.slice(start, end)
+
+        metrics.cache_access("lod", False)
+
+        # Zoomed in - check with the counts of a coarser level whether the raw events fit the budget
+        if covering:
+            level = min(covering, key=lambda x: x.width)
+            if level.count(start, end) <= points:
+                level = self._add_level(channel, self._fetch_raw(channel, start, end))
+                return False, level.data
+
+        level = self._add_level(channel, self._fetch_aggregated(channel, start, end, points))
+        if int(level.data["count"].sum()) <= points:
+            # All events fit into the budget - retrieve raw data instead of the aggregation
+            level = self._add_level(channel, self._fetch_raw(channel, start, end))
+            return False, level.data
+
+        return True, level.slice(start, end)
+
+    def _from_raw(self, level, start, end, points):
+        values = level.slice(start, end)
+        if len(values["timeRaw"]) <= points:
+            return False, values
+
+        # Too many events for the budget - aggregate the cached events client side
+        collector = aggregation.AggregationCollector(
+            util.construct_aggregation(aggregations=["min", "mean", "max", "count"], nr_of_bins=points),
+            start=util.convert_nanoseconds_to_date(start), end=util.convert_nanoseconds_to_date(end))
+        collector.add_arrays("", None, values["value"], values["pulseId"], values["timeRaw"])
+        arrays = collector.get_arrays()[0]["data"]
+        return True, {"timeRaw": arrays["binStart"], "min": arrays["min"], "mean": arrays["mean"],
+                      "max": arrays["max"], "count": arrays["count"]}
+
+    def _add_level(self, channel, level):
+        if level.raw and self.pyramid is not None:
+            self._add_to_pyramid(channel, level)
+
+        levels = self.cache[channel]
+        levels.append(level)
+        if len(levels) > self.max_levels:
+            levels.pop(0)
+        return level
+
+    def _add_to_pyramid(self, channel, level):
+        backend, channel_name = _split_channel(channel)
+        times = level.data["timeRaw"]
+
+        # Events of already covered ranges are rolled up already
+        new = numpy.ones(len(times), dtype=bool)
+        for range_start, range_end in self.pyramid.channel_ranges.get((backend, channel_name), []):
+            new &= (times < range_start) | (times > range_end)
+
+        self.pyramid.add_arrays(channel_name, backend, level.data["value"][new], level.data["pulseId"][new],
+                                times[new])
+        self.pyramid.add_range(channel_name, level.start, level.end, backend=backend)
+
+    def _fetch_aggregated(self, channel, start, end, points):
+        width = int(math.ceil((end - start) / points))
+
+        if width >= 1000000000:
+            # Whole seconds bins are aligned and can be reused across neighbouring ranges
+            seconds = int(math.ceil(width / 1e9))
+            width = seconds * 1000000000
+            agg = util.construct_aggregation(aggregations=["min", "mean", "max", "count"],
+                                             duration_per_bin="PT%dS" % seconds)
+        else:
+            agg = util.construct_aggregation(aggregations=["min", "mean", "max", "count"], nr_of_bins=points)
+
+        query = util.construct_data_query(channel, start=util.convert_nanoseconds_to_date(start),
+                                          end=util.convert_nanoseconds_to_date(end), aggregation=agg,
+                                          event_fields=["value", "time", "pulseId"])
+        result = client.get_data_json(query, base_url=self.base_url)
+
+        events = [event for event in result[0]["data"] if event is not None] if result else []
+        data = dict()
+        data["timeRaw"] = numpy.array([util.convert_date_to_nanoseconds(event["time"]) for event in events],
+                                      dtype=numpy.int64)
+        for field in ["min", "mean", "max", "count"]:
+            data[field] = numpy.array([event["value"][field] for event in events])
+        if len(events) == 0:
+            data["count"] = numpy.empty(0, dtype=numpy.int64)
+
+        return _Level(start, end, width, data)
+
+    def _fetch_raw(self, channel, start, end):
+        query = util.construct_data_query(channel, start=util.convert_nanoseconds_to_date(start),
+                                          end=util.convert_nanoseconds_to_date(end),
+                                          event_fields=["value", "pulseId", "timeRaw"])
+        collector = client.get_data_idread(query, base_url=self.base_url)
+
+        events = [event for event in collector[0]["data"] if event is not None] if collector else []
+        data = dict()
+        data["timeRaw"] = numpy.array([event["timeRaw"] for event in events], dtype=numpy.int64)
+        data["pulseId"] = numpy.array([event["pulseId"] for event in events], dtype=numpy.int64)
+        data["value"] = numpy.array([event["value"] for event in events])
+
+        return _Level(start, end, 0, data, raw=True)
+
+
+def _split_channel(channel):
+    # backend/channel notation - returns (backend, channel)
+    if "/" in channel:
+        backend, channel_name = channel.split("/", 1)
+        return backend, channel_name
+    return None, channel
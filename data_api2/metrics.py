@@ -0,0 +1,292 @@
+import math
+import threading
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from data_api2 import client
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Metrics of the client for long running services (e.g. export daemons). The metrics are collected from the query
+# statistics of the client (see client.add_stats_callback) and exposed in the Prometheus text format:
+#
+#   metrics.enable()                    # collect metrics of all queries into metrics.registry
+#   metrics.start_http_server(9100)     # serve http://localhost:9100/metrics
+#
+# Exported metrics (labels in brackets):
+#   data_api_requests_total (api, endpoint, result)     queries - result is "ok" or "error"
+#   data_api_bytes_received_total (api)                 bytes transferred
+#   data_api_bytes_decoded_total (api)                  bytes after decompression
+#   data_api_events_total (api)                         decoded events
+#   data_api_retries_total (api)                        retried queries
+#   data_api_request_duration_seconds (api)             histogram of the total query time
+#   data_api_time_to_first_byte_seconds (api)           histogram of the time until the response headers arrived
+#   data_api_decode_duration_seconds (api)              histogram of the decode/parse time
+#   data_api_cache_requests_total (cache, result)       cache lookups - result is "hit" or "miss"
+
+default_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _format_labels(names, values, extra=None):
+    labels = ["%s=\"%s\"" % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        labels.append("%s=\"%s\"" % extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return repr(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+class Counter:
+    """
+    Monotonically increasing value per label combination
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(labels.get(label, "") for label in self.labels), 0)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _format_labels(self.labels, key), value) for key, value in self.values.items()]
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets (Prometheus histogram) per label combination
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = sorted(buckets if buckets is not None else default_buckets) + [math.inf]
+        self.values = dict()  # label values -> ([count per bucket], sum, count)
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def get(self, **labels):
+        """
+        :return:    (count, sum) of the observed values
+        """
+        entry = self.values.get(tuple(labels.get(label, "") for label in self.labels))
+        if entry is None:
+            return 0, 0.0
+        return entry[2], entry[1]
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((self.name + "_bucket",
+                                    _format_labels(self.labels, key, extra=("le", _format_value(float(bound)))),
+                                    cumulative))
+                samples.append((self.name + "_sum", _format_labels(self.labels, key), total))
+                samples.append((self.name + "_count", _format_labels(self.labels, key), count))
+        return samples
+
+
+class Registry:
+    """
+    Collection of metrics that can be rendered in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics = dict()
+        self.lock = threading.Lock()
+
+    def _register(self, metric_class, name, help, labels, **kwargs):
+        with self.lock:
+            if name in self.metrics:
+                metric = self.metrics[name]
+                if not isinstance(metric, metric_class) or metric.labels != tuple(labels):
+                    raise ValueError("Metric %s is already registered with a different type or labels" % name)
+                return metric
+            metric = metric_class(name, help, labels=labels, **kwargs)
+            self.metrics[name] = metric
+            return metric
+
+    def counter(self, name, help, labels=()):
+        """
+        Get or create a counter
+        """
+        return self._register(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=None):
+        """
+        Get or create a histogram
+        """
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        """
+        :return:    all metrics in the Prometheus text format (version 0.0.4)
+        """
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help.replace("\\", "\\\\").replace("\n", "\\n")))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append("%s%s %s" % (name, labels, _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class ClientMetrics:
+    """
+    Callback for client.add_stats_callback collecting the query statistics into a registry
+    """
+
+    def __init__(self, registry):
+        self.requests = registry.counter("data_api_requests_total", "Number of queries",
+                                         labels=("api", "endpoint", "result"))
+        self.bytes_received = registry.counter("data_api_bytes_received_total", "Bytes transferred", labels=("api",))
+        self.bytes_decoded = registry.counter("data_api_bytes_decoded_total", "Bytes after decompression",
+                                              labels=("api",))
+        self.events = registry.counter("data_api_events_total", "Decoded events", labels=("api",))
+        self.retries = registry.counter("data_api_retries_total", "Retried queries", labels=("api",))
+        self.duration = registry.histogram("data_api_request_duration_seconds", "Total time of a query",
+                                           labels=("api",))
+        self.time_to_first_byte = registry.histogram("data_api_time_to_first_byte_seconds",
+                                                     "Time until the response headers are received", labels=("api",))
+        self.decode_duration = registry.histogram("data_api_decode_duration_seconds",
+                                                  "Time to decode or parse a response", labels=("api",))
+
+    def __call__(self, stats):
+        api = stats.get("api") or ""
+        self.requests.inc(api=api, endpoint=stats.get("base_url", ""),
+                          result="error" if stats.get("error") else "ok")
+
+        self.bytes_received.inc(stats.get("bytes_received", 0), api=api)
+        self.bytes_decoded.inc(stats.get("bytes_decoded", 0), api=api)
+        self.events.inc(sum(stats.get("events", {}).values()), api=api)
+        self.retries.inc(stats.get("retries", 0), api=api)
+
+        if "total_time" in stats:
+            self.duration.observe(stats["total_time"], api=api)
+        if "time_to_first_byte" in stats:
+            self.time_to_first_byte.observe(stats["time_to_first_byte"], api=api)
+        if "decode_time" in stats:
+            self.decode_duration.observe(stats["decode_time"], api=api)
+        elif "parse_time" in stats:
+            self.decode_duration.observe(stats["parse_time"], api=api)
+
+
+_client_metrics = weakref.WeakKeyDictionary()  # registry -> registered ClientMetrics
+
+
+def enable(registry=registry):
+    """
+    Collect the statistics of all client queries into the registry
+
+    :param registry:
+    :return:            ClientMetrics
+    """
+    if registry not in _client_metrics:
+        _client_metrics[registry] = ClientMetrics(registry)
+        client.add_stats_callback(_client_metrics[registry])
+    return _client_metrics[registry]
+
+
+def disable(registry=registry):
+    """
+    Stop collecting the statistics of client queries into the registry
+    """
+    metrics = _client_metrics.pop(registry, None)
+    if metrics is not None:
+        client.remove_stats_callback(metrics)
+
+
+def cache_access(cache, hit, registry=registry):
+    """
+    Count a cache lookup - only if metrics are enabled for the registry (see enable)
+
+    :param cache:       name of the cache
+    :param hit:         True if the lookup was served from the cache
+    :param registry:
+    """
+    if registry not in _client_metrics:
+        return
+    registry.counter("data_api_cache_requests_total", "Cache lookups",
+                     labels=("cache", "result")).inc(cache=cache, result="hit" if hit else "miss")
+
+
+def start_http_server(port, host="localhost", registry=registry):
+    """
+    Serve the metrics of the registry at http://host:port/metrics in a background thread
+
+    :param port:        0 to use any free port
+    :param host:
+    :param registry:
+    :return:            server - the port is server.server_address[1], stop with server.shutdown()
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ["/metrics", "/"]:
+                self.send_error(404)
+                return
+
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info("Serving metrics on http://%s:%d/metrics" % (host, server.server_address[1]))
+    return server
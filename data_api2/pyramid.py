@@ -0,0 +1,194 @@
+import numpy
+
+from data_api2 import util
+from data_api2.aggregation import AggregationCollector
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Local multi-resolution rollups (min/mean/max/count) of retrieved channels. Every level is a durationPerBin
+# aggregation with bins aligned to the epoch, so data of neighbouring or overlapping queries ends up in the same bins.
+# The pyramid is a collector - raw events are folded into all levels while they are decoded.
+
+default_resolutions = ["PT1S", "PT1M", "PT1H"]
+
+
+class RollupPyramid:
+    """
+    Collector building rollups of raw events at several resolutions
+
+    Example:
+    pyramid = RollupPyramid()
+    idread_util.decode(stream, collector_function=pyramid.add_data)
+    pyramid.add_range("CHANNEL", start, end)
+    data = pyramid.get_data("CHANNEL", start, end, points=1000)
+    """
+
+    def __init__(self, resolutions=default_resolutions, chunk_size=100000):
+        """
+        :param resolutions: bin durations of the levels (ISO8601 durations, see util.parse_duration)
+        :param chunk_size:  number of raw events per channel buffered before they are folded into the levels
+        """
+
+        self.levels = []
+        for resolution in resolutions:
+            collector = AggregationCollector(util.construct_aggregation(
+                aggregations=["min", "mean", "max", "count"], duration_per_bin=resolution))
+            self.levels.append((resolution, collector))
+
+        # Finest resolution first
+        self.levels.sort(key=lambda level: level[1].binning.width)
+
+        self.chunk_size = chunk_size
+        self.channel_buffers = dict()
+        self.channel_ranges = dict()
+
+    def add_data(self, channel_name, backend, value, pulse_id, global_time, ioc_time, status, severity):
+
+        if value is None:
+            return
+
+        key = (backend, channel_name)
+        if key not in self.channel_buffers:
+            self.channel_buffers[key] = ([], [], [])
+
+        buffer = self.channel_buffers[key]
+        buffer[0].append(value)
+        buffer[1].append(pulse_id)
+        buffer[2].append(global_time)
+
+        if len(buffer[0]) >= self.chunk_size:
+            self._fold(key)
+
+    def add_arrays(self, channel_name, backend, values, pulse_ids, times):
+        """
+        Fold a chunk of already columnar events into all levels
+
+        :param channel_name:
+        :param backend:
+        :param values:      array of values
+        :param pulse_ids:   array of pulse-ids
+        :param times:       array of global times in nanoseconds
+        """
+        key = (backend, channel_name)
+        if key in self.channel_buffers:
+            self._fold(key)  # keep the order of the events
+
+        if len(values) == 0:
+            return
+
+        pulse_ids = numpy.asarray(pulse_ids, dtype=numpy.int64)
+        times = numpy.asarray(times, dtype=numpy.int64)
+        for _, collector in self.levels:
+            collector.add_arrays(channel_name, backend, values, pulse_ids, times)
+
+    def _fold(self, key):
+        values, pulse_ids, times = self.channel_buffers.pop(key)
+        if values:
+            self.add_arrays(key[1], key[0], values, pulse_ids, times)
+
+    def add_range(self, channel_name, start, end, backend=None):
+        """
+        Mark a range as completely retrieved for a channel - see covers()
+
+        :param channel_name:
+        :param start:       start of the range - date or nanoseconds
+        :param end:         end of the range - date or nanoseconds
+        :param backend:
+        """
+        start, end = _to_nanoseconds(start), _to_nanoseconds(end)
+        ranges = self.channel_ranges.setdefault((backend, channel_name), [])
+
+        # Keep the ranges sorted and merge overlapping ones
+        merged = []
+        for range_start, range_end in sorted(ranges + [(start, end)]):
+            if merged and range_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+            else:
+                merged.append((range_start, range_end))
+        self.channel_ranges[(backend, channel_name)] = merged
+
+    def covers(self, channel_name, start, end, backend=None):
+        """
+        Check whether the range was completely retrieved for the channel (see add_range)
+        """
+        start, end = _to_nanoseconds(start), _to_nanoseconds(end)
+        for range_start, range_end in self.channel_ranges.get((backend, channel_name), []):
+            if range_start <= start and end <= range_end:
+                return True
+        return False
+
+    def get_data(self, channel_name, start=None, end=None, points=1000, backend=None, resolution=None):
+        """
+        Get the rollup of a channel from the finest level with at most points bins in the range (or the coarsest
+        level if none fits)
+
+        :param channel_name:
+        :param start:       start of the range - date or nanoseconds (None for everything collected)
+        :param end:         end of the range - date or nanoseconds (None for everything collected)
+        :param points:      maximum number of bins to return
+        :param backend:
+        :param resolution:  explicitly select the level (one of the resolutions given at construction)
+        :return:            {"resolution": "PT1S", "data": {"timeRaw": array, "min": array, "mean": array,
+                            "max": array, "count": array, "eventCount": array, "pulseId": array}}
+                            timeRaw is the start of the bin. None if no data was collected for the channel.
+        """
+
+        key = (backend, channel_name)
+        if key in self.channel_buffers:
+            self._fold(key)
+
+        if resolution is not None:
+            levels = [level for level in self.levels if level[0] == resolution]
+            if not levels:
+                raise ValueError("Resolution %s is not available - available resolutions: %s" %
+                                 (resolution, " ".join([level[0] for level in self.levels])))
+        else:
+            levels = self.levels
+
+        for index, (level_resolution, collector) in enumerate(levels):
+            arrays = collector.get_channel_arrays(channel_name, backend)
+            if arrays is None:
+                return None
+
+            times = arrays["binStart"]
+            if start is None:
+                first = 0
+            else:
+                # include the bin containing start
+                first_bin = collector.binning.bins(None, numpy.int64(_to_nanoseconds(start)))
+                first = numpy.searchsorted(times, collector.binning.bin_start(first_bin), side="left")
+            last = len(times) if end is None else numpy.searchsorted(times, _to_nanoseconds(end), side="right")
+
+            if last - first <= points or index == len(levels) - 1:
+                data = {"timeRaw": times[first:last]}
+                for field in ["min", "mean", "max", "count", "eventCount", "pulseId"]:
+                    if field in arrays:
+                        data[field] = arrays[field][first:last]
+                return {"resolution": level_resolution, "data": data}
+
+    def get_arrays(self):
+        """
+        :return: rollups of all channels and levels: [{"channel": {"name": "", "backend": ""},
+                 "levels": {"PT1S": {"timeRaw": array, ...}, ...}}, ...]
+        """
+        for key in list(self.channel_buffers):
+            self._fold(key)
+
+        data = []
+        channels = self.levels[0][1].channel_data if self.levels else dict()
+        for backend, channel_name in channels:
+            levels = dict()
+            for resolution, _ in self.levels:
+                levels[resolution] = self.get_data(channel_name, points=0, backend=backend,
+                                                   resolution=resolution)["data"]
+            data.append({"channel": {"name": channel_name, "backend": backend}, "levels": levels})
+
+        return data
+
+
+def _to_nanoseconds(value):
+    if isinstance(value, (int, numpy.integer)):
+        return int(value)
+    return util.convert_date_to_nanoseconds(value)
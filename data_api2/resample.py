@@ -0,0 +1,152 @@
+import numpy
+from datetime import timedelta
+
+from data_api2 import util
+
+# Resampling of (irregular) channel data onto a fixed time grid. Values for the grid points are determined with
+# numpy.searchsorted directly from the sorted sample times - the samples are never concatenated with the grid nor
+# sorted again.
+
+interpolation_methods = ["last", "previous", "linear", "nearest"]
+
+
+def resample(times, values, grid, method="last"):
+    """
+    Resample values onto a target grid
+
+    :param times:   sorted sample times - numeric, must use the same unit as grid
+    :param values:  sample values, first dimension must match the length of times
+    :param grid:    sorted target times
+    :param method:  last (last sample at or before the grid point, default), previous (first sample at or after the
+                    grid point), linear (linear interpolation in time) or nearest (closest sample in time)
+    :return:        array with one value per grid point - NaN (None for non numeric values) if no value can be
+                    determined for a grid point
+    """
+
+    if method not in interpolation_methods:
+        raise RuntimeError("%s is not a valid interpolation specification" % method)
+
+    times = numpy.asarray(times)
+    values = numpy.asarray(values)
+    grid = numpy.asarray(grid)
+
+    if len(times) != len(values):
+        raise ValueError("times and values need to have the same length")
+
+    if method == "linear":
+        if values.dtype.kind not in "biuf" or values.ndim != 1:
+            raise ValueError("linear interpolation is only supported for numeric scalar values")
+        if len(times) == 0:
+            return numpy.full(len(grid), numpy.nan)
+        # Before the first sample no value can be determined, after the last sample the last value is kept
+        return numpy.interp(grid.astype(numpy.float64), times.astype(numpy.float64), values.astype(numpy.float64),
+                            left=numpy.nan, right=values[-1])
+
+    if len(times) == 0:
+        index = numpy.zeros(len(grid), dtype=numpy.int64)
+        valid = numpy.zeros(len(grid), dtype=bool)
+    elif method == "last":
+        index = numpy.searchsorted(times, grid, side="right") - 1
+        valid = index >= 0
+    elif method == "previous":
+        index = numpy.searchsorted(times, grid, side="left")
+        valid = index < len(times)
+    else:  # nearest
+        right = numpy.searchsorted(times, grid, side="left")
+        left = right - 1
+        right_clipped = numpy.minimum(right, len(times) - 1)
+        left_clipped = numpy.maximum(left, 0)
+
+        # Outside of the sampled range no value can be determined (except for exact matches)
+        exact = (right < len(times)) & (times[right_clipped] == grid)
+        valid = ((left >= 0) & (right < len(times))) | exact
+
+        take_left = (left >= 0) & ~exact & ((grid - times[left_clipped]) <= (times[right_clipped] - grid))
+        index = numpy.where(take_left, left_clipped, right_clipped)
+
+    if values.dtype.kind in "fc":
+        result = numpy.full((len(grid),) + values.shape[1:], numpy.nan, dtype=values.dtype)
+    elif values.dtype.kind in "biu":
+        result = numpy.full((len(grid),) + values.shape[1:], numpy.nan)
+    else:
+        result = numpy.full((len(grid),) + values.shape[1:], None, dtype=object)
+
+    result[valid] = values[index[valid]]
+    return result
+
+
+def time_grid(start, end, interval):
+    """
+    Create a fixed time grid
+
+    :param start:       start of the grid (datetime or string)
+    :param end:         end of the grid - included if it is on the grid (datetime or string)
+    :param interval:    grid interval - timedelta, seconds or ISO8601 duration string
+    :return:            array of grid points as nanoseconds since epoch (int64)
+    """
+
+    if isinstance(interval, str):
+        interval = util.parse_duration(interval)
+    if isinstance(interval, timedelta):
+        interval = interval.total_seconds()
+
+    interval_ns = int(round(interval * 1e9))
+    if interval_ns <= 0:
+        raise ValueError("interval needs to be positive")
+
+    start_ns = _to_nanoseconds(start)
+    end_ns = _to_nanoseconds(end)
+
+    return numpy.arange(start_ns, end_ns + 1, interval_ns, dtype=numpy.int64)
+
+
+def resample_data(data, grid, method="last"):
+    """
+    Resample data as returned by data_api2.get_data onto a fixed time grid
+
+    :param data:    data as returned by get_data - [{channel:{}, data:[{value: , timeRaw: ...}]}, ]. The events need
+                    to contain either timeRaw or time
+    :param grid:    target grid in nanoseconds since epoch (see time_grid)
+    :param method:  interpolation method - see resample
+    :return:        [{channel:{}, data: {"timeRaw": grid, "value": values}}, ]
+    """
+
+    grid = numpy.asarray(grid)
+
+    resampled = []
+    for channel in data:
+        events = [event for event in channel["data"] if event is not None and event["value"] is not None]
+
+        if events and "timeRaw" in events[0]:
+            times = numpy.fromiter((event["timeRaw"] for event in events), dtype=numpy.int64, count=len(events))
+        else:
+            times = numpy.fromiter((_to_nanoseconds(event["time"]) for event in events), dtype=numpy.int64,
+                                   count=len(events))
+
+        values = _to_array([event["value"] for event in events])
+
+        # The data api returns sorted events - only sort if necessary
+        if len(times) > 1 and numpy.any(numpy.diff(times) < 0):
+            order = numpy.argsort(times, kind="stable")
+            times = times[order]
+            values = values[order]
+
+        resampled.append({"channel": channel["channel"],
+                          "data": {"timeRaw": grid, "value": resample(times, values, grid, method=method)}})
+
+    return resampled
+
+
+def _to_array(values):
+    array = numpy.asarray(values)
+    if array.dtype == object and array.ndim != 1:
+        array = numpy.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            array[i] = value
+    return array
+
+
+def _to_nanoseconds(date):
+    if isinstance(date, (int, numpy.integer)):
+        return int(date)
+    return util.convert_date_to_nanoseconds(date)
@@ -4,6 +4,8 @@ from datetime import datetime, timedelta
 import re
 import logging
 
+_epoch = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
 
 def check_reachability_server(endpoint):
     """
@@ -55,6 +57,28 @@ def convert_date(date_string):
     return date
 
 
+def convert_date_to_nanoseconds(date):
+    """
+    Convert a date (string or datetime) to nanoseconds since epoch
+    :param date:    date to convert - dates without timezone are taken as Europe/Zurich time
+    :return:        nanoseconds since epoch (int)
+    """
+
+    date = convert_date(date)
+    # Integer arithmetic - a float timestamp is not precise enough for nanoseconds
+    return (date - _epoch) // timedelta(microseconds=1) * 1000
+
+
+def convert_nanoseconds_to_date(nanoseconds):
+    """
+    Convert nanoseconds since epoch to a date
+    :param nanoseconds: nanoseconds since epoch
+    :return:            datetime (UTC) - truncated to microseconds
+    """
+
+    return _epoch + timedelta(microseconds=int(nanoseconds) // 1000)
+
+
 def calculate_range(start, end, delta):
     """
     Calculate start - end range based on given start, end and/or delta parameter
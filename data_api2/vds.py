@@ -0,0 +1,91 @@
+import os
+import h5py
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stitching of split export files (e.g. name_000.h5, name_001.h5, ... written by the save action with --split) into
+# one index file. Every dataset of the split files becomes a virtual dataset in the index file that maps the
+# datasets of all files one after the other - no data is copied. The index file has the same layout as the split
+# files, so it can be read with the same tools (e.g. h5reader.H5Reader) and sliced across file boundaries.
+#
+# The split files are referenced relative to the directory of the index file - keep them together when moving.
+
+
+def _collect_datasets(filename):
+    datasets = dict()
+
+    def visit(name, item):
+        if isinstance(item, h5py.Dataset):
+            datasets[name] = (item.shape, item.dtype)
+
+    with h5py.File(filename, "r") as infile:
+        infile.visititems(visit)
+
+    return datasets
+
+
+def stitch(filenames, output, overwrite=False):
+    """
+    Create a virtual dataset index file of split files
+
+    :param filenames:   split files in the order they should be concatenated
+    :param output:      name of the index file
+    :param overwrite:   overwrite the index file if it exists
+    :return:            dictionary with the total length of every dataset
+    """
+
+    filenames = [str(filename) for filename in filenames]
+    output = str(output)
+
+    if not filenames:
+        raise ValueError("No files to stitch")
+
+    if os.path.exists(output):
+        if not overwrite:
+            raise RuntimeError("File %s exists, not overwriting by default." % output)
+        logger.info("Overwriting %s", output)
+
+    if os.path.abspath(output) in [os.path.abspath(filename) for filename in filenames]:
+        raise ValueError("Index file %s cannot be one of the split files" % output)
+
+    # Dataset name -> list of (filename, shape) in file order
+    sources = dict()
+    layouts = dict()
+    for filename in filenames:
+        for name, (shape, dtype) in _collect_datasets(filename).items():
+            if len(shape) == 0:
+                logger.warning("Skipping scalar dataset %s in %s", name, filename)
+                continue
+
+            if name not in layouts:
+                layouts[name] = (shape[1:], dtype)
+            elif layouts[name] != (shape[1:], dtype):
+                raise RuntimeError("Dataset %s in %s has shape %s and type %s - expected %s and %s" %
+                                   (name, filename, shape[1:], dtype, layouts[name][0], layouts[name][1]))
+
+            sources.setdefault(name, []).append((filename, shape))
+
+    directory = os.path.dirname(os.path.abspath(output))
+
+    lengths = dict()
+    with h5py.File(output, "w") as outfile:
+        for name, parts in sources.items():
+            inner_shape, dtype = layouts[name]
+            length = sum([shape[0] for _, shape in parts])
+
+            layout = h5py.VirtualLayout(shape=(length,) + inner_shape, dtype=dtype)
+            offset = 0
+            for filename, shape in parts:
+                if shape[0] == 0:
+                    continue
+                source_name = os.path.relpath(os.path.abspath(filename), directory)
+                layout[offset:offset + shape[0]] = h5py.VirtualSource(source_name, name, shape=shape)
+                offset += shape[0]
+
+            outfile.create_virtual_dataset(name, layout)
+            lengths[name] = length
+
+    logger.info("Stitched %d files into %s", len(filenames), output)
+    return lengths
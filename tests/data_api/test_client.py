@@ -1,6 +1,7 @@
 import unittest
 
 import math
+import os
 
 import datetime
 import data_api as api
@@ -65,6 +66,124 @@ class ClientTest(unittest.TestCase):
 
         print(data["A"])
 
+    def test_build_pandas_data_frame(self):
+        import data_api.client
+
+        def entry(pulse_id, value):
+            return {"pulseId": pulse_id, "globalSeconds": "%d.123456789" % pulse_id,
+                    "globalDate": "2018-01-01T00:00:%02d.123456789+01:00" % pulse_id, "eventCount": 1,
+                    "value": value}
+
+        data = [{"channel": {"name": "A"}, "data": [entry(1, 1.0), entry(3, 3.0), entry(3, 30.0), entry(5, 5.0)]},
+                {"channel": {"name": "B"}, "data": [entry(2, 2), entry(3, 3)]},
+                {"channel": {"name": "C"}, "data": []}]
+
+        data_frame = data_api.client._build_pandas_data_frame(data, index_field="pulseId")
+
+        self.assertEqual(data_frame.index.tolist(), [1, 2, 3, 5])
+        self.assertEqual(data_frame["A"].tolist()[0], 1.0)
+        self.assertTrue(math.isnan(data_frame["A"].tolist()[1]))
+        self.assertEqual(data_frame["A"].tolist()[2], 3.0)  # first occurrence of a duplicated index is kept
+        self.assertTrue(math.isnan(data_frame["B"].tolist()[0]))
+        self.assertEqual(data_frame["B"].tolist()[1:3], [2, 3])
+        self.assertTrue(data_frame["C"].isnull().all())
+        self.assertEqual(data_frame["globalSeconds"].tolist(), [1.123, 2.123, 3.123, 5.123])
+        self.assertEqual(data_frame["globalNanoseconds"].tolist(), [456789] * 4)
+
+    def test_build_pandas_data_frame_ragged(self):
+        import data_api.client
+
+        # Waveforms changing their length from event to event
+        data = [{"channel": {"name": "A"}, "data": [
+            {"pulseId": 1, "globalSeconds": "1.000000000", "globalDate": "2018-01-01T00:00:01.000000000+01:00",
+             "eventCount": 1, "value": [1, 2]},
+            {"pulseId": 2, "globalSeconds": "2.000000000", "globalDate": "2018-01-01T00:00:02.000000000+01:00",
+             "eventCount": 1, "value": [1, 2, 3]}]}]
+
+        data_frame = data_api.client._build_pandas_data_frame(data, index_field="pulseId")
+
+        self.assertEqual(data_frame.index.tolist(), [1, 2])
+        self.assertEqual(list(data_frame["A"].iloc[0]), [1, 2])
+        self.assertEqual(list(data_frame["A"].iloc[1]), [1, 2, 3])
+
+    def test_build_pandas_data_frame_from_arrays(self):
+        import data_api.client
+        from data_api2 import idread_util
+
+        collector = idread_util.ArrayCollector()
+        with open(os.path.join(os.path.dirname(__file__), '..', 'data_api2', 'data', 'out.bin'), mode='rb') as f:
+            idread_util.decode(f, collector_function=collector.add_data)
+
+        data = collector.get_data()
+        data_frame = data_api.client._build_pandas_data_frame_from_arrays(data, index_field="globalDate")
+
+        self.assertEqual(data_frame.shape[0], 600)
+        self.assertEqual(data_frame.columns.tolist(), ["pulseId", "globalSeconds", "eventCount",
+                                                       "SINEG01-RCIR-PUP10:SIG-AMPLT-MAX", "globalNanoseconds"])
+        self.assertTrue((data_frame["pulseId"].values == data[0]["data"]["pulseId"]).all())
+        self.assertTrue((data_frame["SINEG01-RCIR-PUP10:SIG-AMPLT-MAX"].values == data[0]["data"]["value"]).all())
+        self.assertTrue(data_frame.index.is_monotonic_increasing)
+
+    def test_build_pandas_data_frame_from_arrays_layout(self):
+        import data_api.client
+        from data_api2 import idread_util, util
+
+        dates = ["2018-01-01T00:00:01.123456789+01:00", "2018-07-01T00:00:02.000000001+02:00"]
+        times = [util.convert_date_to_nanoseconds("2018-01-01T00:00:01.123456+01:00") + 789,
+                 util.convert_date_to_nanoseconds("2018-07-01T00:00:02+02:00") + 1]
+        values = [[1, 2], [1, 2, 3]]  # waveforms changing their length
+        json_data = [{"channel": {"name": "A"}, "data": [
+            {"pulseId": i + 1, "globalSeconds": "%d.%09d" % divmod(times[i], 1000000000), "globalDate": dates[i],
+             "eventCount": 1, "value": values[i]} for i in range(2)]}]
+
+        collector = idread_util.ArrayCollector(event_fields=["value", "pulseId", "timeRaw"])
+        for i in range(2):
+            collector.add_data("A", None, values[i], i + 1, times[i], 0, 0, 0)
+        data = collector.get_data()
+        self.assertEqual(data[0]["data"]["value"].shape, (2,))
+
+        data_frame = data_api.client._build_pandas_data_frame_from_arrays(data, index_field="pulseId")
+        reference = data_api.client._build_pandas_data_frame(json_data, index_field="pulseId")
+
+        self.assertEqual(data_frame.columns.tolist(), reference.columns.tolist())
+        self.assertEqual(data_frame.index.tolist(), reference.index.tolist())
+        self.assertEqual(data_frame["globalDate"].tolist(), dates)
+        self.assertEqual(data_frame["globalSeconds"].tolist(), reference["globalSeconds"].tolist())
+        self.assertEqual(data_frame["globalNanoseconds"].tolist(), reference["globalNanoseconds"].tolist())
+        self.assertEqual([list(x) for x in data_frame["A"]], [list(x) for x in reference["A"]])
+
+    def test_get_data_fixed_time(self):
+        from data_api2 import util
+        from tests.data_api2 import mockserver
+
+        server = mockserver.start(mockserver.Configuration(rate=100, scalars=1, waveforms=0))
+        base_url = "http://%s:%d" % server.server_address[:2]
+        channel = "MOCK:SCALAR-000"
+        start = util.convert_nanoseconds_to_date(1500000000000000000)  # pulse-id 0, one event every 10ms
+        end = start + datetime.timedelta(seconds=2)
+
+        try:
+            raw = api.get_data(channel, start=start, end=end, index_field="pulseId", base_url=base_url)[channel]
+
+            for binary in [False, True]:
+                data = api.get_data(channel, start=start, end=end, base_url=base_url, binary=binary,
+                                    fixed_time=True, fixed_time_interval="105ms", interpolation_method="last")
+                self.assertEqual(data.index.name, "globalDate")
+                self.assertEqual(data.columns.tolist(), [channel])
+                self.assertEqual(len(data), 20)
+                self.assertEqual(data.index[0], start)
+                self.assertEqual(data.index[1] - data.index[0], datetime.timedelta(milliseconds=105))
+                # Last event at or before the grid point
+                self.assertEqual(data[channel].tolist(), [raw[math.floor(i * 10.5)] for i in range(20)])
+
+                data = api.get_data(channel, start=start, end=end, base_url=base_url, binary=binary,
+                                    fixed_time=True, fixed_time_interval="105ms", interpolation_method="previous")
+                # First event at or after the grid point
+                self.assertEqual(data[channel].tolist(), [raw[math.ceil(i * 10.5)] for i in range(20)])
+        finally:
+            server.shutdown()
+            server.server_close()
+
     def test_real_aggregation(self):
         now = datetime.datetime.now() - datetime.timedelta(hours=10)
         data = api.get_data(["SINDI01-RIQM-DCP10:FOR-PHASE-AVG", "S10CB01-RBOC-DCP10:FOR-PHASE-AVG"],
@@ -148,6 +267,18 @@ class ClientTest(unittest.TestCase):
 
         pass
 
+    def test_split_range(self):
+        from data_api import client
+
+        self.assertEqual(client._split_range(100, 350, 100), [(100, 200), (200, 300), (300, 350)])
+        self.assertEqual(client._split_range(100, 350), [(100, 350)])
+        self.assertEqual(client._split_range(100, 100, 100), [])
+
+        start = datetime.datetime(2018, 4, 5, 9)
+        segments = client._split_range(start, start + datetime.timedelta(hours=1), api.parse_duration("PT30M"))
+        self.assertEqual(segments, [(start, start + datetime.timedelta(minutes=30)),
+                                    (start + datetime.timedelta(minutes=30), start + datetime.timedelta(hours=1))])
+
     def test_parse_duration(self):
 
         # Month and year durations are not supported!
@@ -2,6 +2,9 @@ import unittest
 import os
 import datetime
 
+import numpy
+import pandas
+
 import data_api as api
 
 import logging
@@ -39,6 +42,27 @@ class HDF5ReadWrite(unittest.TestCase):
 
         self.assertTrue((data_readback.dropna() == data.dropna()).all().all())
 
+    def test_round_trip(self):
+        rows = 1000
+        data = pandas.DataFrame({"globalSeconds": numpy.arange(rows) * 0.01 + 1500000000.0,
+                                 "pulseId": numpy.arange(rows, dtype=numpy.int64) + 1000,
+                                 "A": numpy.random.random(rows),
+                                 "W": [numpy.arange(4) + i for i in range(rows)]})
+        data.set_index("pulseId", inplace=True)
+
+        api.to_hdf5(data, filename=self.fname, chunk_size=64)
+        data_readback = api.from_hdf5(self.fname, index_field="pulseId")
+
+        self.assertEqual(data_readback.index.tolist(), data.index.tolist())
+        self.assertTrue(numpy.array_equal(data_readback["A"].to_numpy(), data["A"].to_numpy()))
+        self.assertTrue(numpy.array_equal(data_readback["globalSeconds"].to_numpy(),
+                                          data["globalSeconds"].to_numpy()))
+        self.assertTrue(numpy.array_equal(numpy.stack(data_readback["W"].to_numpy()),
+                                          numpy.stack(data["W"].to_numpy())))
+
+        with self.assertRaises(RuntimeError):
+            api.from_hdf5(self.fname, index_field="globalDate")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,8 @@
 import unittest
+import os
+import tempfile
+
+import h5py
 
 import data_api.idread as iread
 from data_api.h5 import Serializer
@@ -33,6 +37,39 @@ class ClientTest(unittest.TestCase):
 
         self.assertTrue(True)
 
+    def test_decode_serializer(self):
+        data = os.path.join(os.path.dirname(__file__), '..', 'data_api2', 'data', 'out.bin')
+        channel = '/SINEG01-RCIR-PUP10:SIG-AMPLT-MAX'
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'out.h5')
+
+            serializer = Serializer(batch_size=256)
+            serializer.open(filename)
+            with open(data, mode='rb') as f:
+                iread.decode(f, serializer=serializer)
+            serializer.close()
+
+            with h5py.File(filename, 'r') as f:
+                self.assertEqual(f[channel + '/data'].shape, (600, 1))
+                self.assertEqual(f[channel + '/data'].dtype, 'u4')
+                self.assertEqual(f[channel + '/pulse_id'].shape, (600, 1))
+                pulse_ids = f[channel + '/pulse_id'][:, 0]
+                self.assertTrue((pulse_ids[1:] > pulse_ids[:-1]).all())
+                for name in ['timestamp', 'ioc_timestamp', 'status', 'severity']:
+                    self.assertEqual(f[channel + '/' + name].shape[0], 600)
+                self.assertIsNone(f[channel + '/data'].compression)
+
+            # Compression is opt-in
+            serializer.open(filename)
+            with open(data, mode='rb') as f:
+                iread.decode(f, serializer=serializer, compress=True)
+            serializer.close()
+
+            with h5py.File(filename, 'r') as f:
+                self.assertEqual(f[channel + '/data'].compression, 'gzip')
+                self.assertEqual(f[channel + '/data'].shape, (600, 1))
+
     def test_request(self):
 
         import requests
@@ -0,0 +1,499 @@
+from bottle import Bottle, request, response, HTTPResponse
+
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+from socketserver import ThreadingMixIn
+from datetime import datetime, timezone
+import threading
+import random
+import json
+import time
+import zlib
+import re
+
+import numpy
+import dateutil.parser
+
+from data_api2 import idread_encoder, aggregation
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# High volume stand-in for the Data API - generates data on the fly so that the client can be benchmarked offline.
+#
+# Served endpoints:
+#   POST /query             json (default) or rawevent response (query["response"]["format"]), optionally gzip
+#                           compressed (query["response"]["compression"]). Supports pulseId, globalSeconds and
+#                           globalDate ranges, server side mapping and aggregations (json only - aggregated client
+#                           side with data_api2.aggregation).
+#   POST /channels          channel search (regex, backends)
+#   GET  /params/backends   list of backends
+#
+# Every channel has an event for every pulse. Pulse-id p has the global time reference_time + p / rate. The value of
+# an event is taken from a small pool of values by its pulse-id (pool[p % pool_size]), scalars are p % pool_size,
+# arrays are arange(size) + p % pool_size reshaped to the shape of the channel - i.e. the data is reproducible and the
+# same for the json and the rawevent format.
+#
+# Channels that are not configured are served as scalar float64 channels.
+#
+# Example - 100Hz, 100 scalar channels, 10 waveforms of 2048 points, 200ms latency and 50MB/s bandwidth:
+#   python mockserver.py --rate 100 --scalars 100 --waveforms 10 --waveform-size 2048 --latency 0.2 --throttle 50e6
+#
+# Dropped connections can be simulated with --drop-after (bytes) - e.g. to test the resume of interrupted downloads.
+
+reference_time = 1500000000000000000  # global time (ns) of pulse-id 0
+
+
+class Configuration:
+    """
+    Configuration of the generated data and the injected delays
+    """
+
+    def __init__(self, rate=100.0, scalars=10, waveforms=0, waveform_size=1024, images=0, image_shape=(64, 64),
+                 type="float64", encoding="little", compression=None, backend="sf-databuffer", pool_size=16,
+                 chunk_size=65536, latency=0.0, throttle=None, error_rate=0.0, max_events=10000000,
+                 drop_after=None, drops=None, content_encoding=None):
+        """
+        :param rate:            events per second (and channel)
+        :param scalars:         number of scalar channels (MOCK:SCALAR-000, ...)
+        :param waveforms:       number of waveform channels (MOCK:WAVEFORM-000, ...)
+        :param waveform_size:
+        :param images:          number of image channels (MOCK:IMAGE-000, ...)
+        :param image_shape:     shape of the images in numpy order
+        :param type:            type of the waveform and image channels (see idread_encoder.types)
+        :param encoding:        byte order of the rawevent response
+        :param compression:     compression of waveforms and images in the rawevent response (bitshuffle_lz4)
+        :param backend:
+        :param pool_size:       number of distinct values per channel
+        :param chunk_size:      size of the response chunks (bytes)
+        :param latency:         delay (seconds) before a response is started
+        :param throttle:        maximum bandwidth (bytes per second) of a response - None for unlimited
+        :param error_rate:      fraction of queries failing with 503 (Service Unavailable)
+        :param max_events:      maximum number of events per channel and query
+        :param drop_after:      close the connection after this number of bytes of a response - None for no drops
+        :param drops:           number of responses to drop (see drop_after) - None for all
+        :param content_encoding: "deflate" or "gzip" to encode all query responses (transfer encoding with
+                                Content-Encoding header) independent of Accept-Encoding - like a misbehaving proxy
+        """
+        self.rate = rate
+        self.interval = int(1e9 / rate)
+        self.backend = backend
+        self.pool_size = pool_size
+        self.chunk_size = chunk_size
+        self.latency = latency
+        self.throttle = throttle
+        self.error_rate = error_rate
+        self.max_events = max_events
+        self.encoding = encoding
+        self.drop_after = drop_after
+        self.drops = drops
+        self.content_encoding = content_encoding
+        self.lock = threading.Lock()
+
+        self.channels = dict()
+        for i in range(scalars):
+            self.add_channel("MOCK:SCALAR-%03d" % i)
+        for i in range(waveforms):
+            self.add_channel("MOCK:WAVEFORM-%03d" % i, type=type, shape=[waveform_size], compression=compression)
+        for i in range(images):
+            self.add_channel("MOCK:IMAGE-%03d" % i, type=type, shape=list(image_shape), compression=compression)
+
+    def add_channel(self, name, type="float64", shape=None, compression=None):
+        self.channels[name] = _Channel(idread_encoder.Channel(name, backend=self.backend, type=type, shape=shape,
+                                                              encoding=self.encoding, compression=compression),
+                                       self.pool_size)
+
+    def get_channel(self, name):
+        if name not in self.channels:
+            self.add_channel(name)
+        return self.channels[name]
+
+    def drop(self):
+        # Whether the next response is to be dropped
+        with self.lock:
+            if self.drop_after is None or self.drops == 0:
+                return False
+            if self.drops is not None:
+                self.drops -= 1
+            return True
+
+    def pulse_id(self, global_time):
+        return (global_time - reference_time) // self.interval
+
+    def global_time(self, pulse_id):
+        return reference_time + pulse_id * self.interval
+
+
+class _Channel:
+    # Generated channel with its pool of values - pre-encoded for the rawevent and json format
+
+    def __init__(self, channel, pool_size):
+        self.channel = channel
+        self.values = []
+        for i in range(pool_size):
+            if channel.shape is None:
+                value = numpy.asarray(i, dtype=channel.dtype)
+            else:
+                value = (numpy.arange(int(numpy.prod(channel.shape))) + i).astype(channel.dtype)
+                value = value.reshape(channel.shape)
+            self.values.append(value)
+
+        self.encoded = [channel.encode_value(value) for value in self.values]
+        self.json = [json.dumps(value.tolist()) for value in self.values]
+        self.shape = json.dumps(channel.shape[::-1] if channel.shape is not None else [1])
+
+
+def _parse_seconds(seconds):
+    # "1513284361.797718484" -> ns without loosing precision
+    seconds, _, fraction = str(seconds).partition(".")
+    return int(seconds) * 1000000000 + int((fraction + "000000000")[:9])
+
+
+def _resolve_range(configuration, query_range):
+    # Inclusive range of pulse-ids of a query range
+    if "startPulseId" in query_range:
+        start = int(query_range["startPulseId"])
+        end = int(query_range["endPulseId"])
+    else:
+        if "startSeconds" in query_range:
+            start_time = _parse_seconds(query_range["startSeconds"])
+            end_time = _parse_seconds(query_range["endSeconds"])
+        else:
+            start_time = int(dateutil.parser.parse(query_range["startDate"]).timestamp() * 1e9)
+            end_time = int(dateutil.parser.parse(query_range["endDate"]).timestamp() * 1e9)
+
+        start = -(-(start_time - reference_time) // configuration.interval)  # first pulse at or after start
+        end = configuration.pulse_id(end_time)
+
+    start = max(start, 0)
+    if end - start + 1 > configuration.max_events:
+        logger.warning("Query of %d events limited to %d events", end - start + 1, configuration.max_events)
+        end = start + configuration.max_events - 1
+    return start, end
+
+
+def _format_date(global_time):
+    # Dates are formatted with nanoseconds like the server does, e.g. 2017-07-14T02:40:00.000000000+00:00
+    seconds = datetime.fromtimestamp(global_time // 1000000000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    return "%s.%09d+00:00" % (seconds, global_time % 1000000000)
+
+
+def _format_event(configuration, channel, pulse_id, fields, with_channel=False):
+    global_time = configuration.global_time(pulse_id)
+    index = pulse_id % len(channel.values)
+
+    parts = []
+    if with_channel:
+        parts.append('"channel": "%s", "backend": "%s"' % (channel.channel.name, channel.channel.backend))
+    for field in fields:
+        if field == "value":
+            parts.append('"value": ' + channel.json[index])
+        elif field == "pulseId":
+            parts.append('"pulseId": %d' % pulse_id)
+        elif field == "globalSeconds" or field == "iocSeconds":
+            parts.append('"%s": "%d.%09d"' % (field, global_time // 1000000000, global_time % 1000000000))
+        elif field == "globalDate" or field == "iocDate":
+            parts.append('"%s": "%s"' % (field, _format_date(global_time)))
+        elif field == "eventCount":
+            parts.append('"eventCount": 1')
+        elif field == "shape":
+            parts.append('"shape": ' + channel.shape)
+        elif field == "status" or field == "severity":
+            parts.append('"%s": 0' % field)
+    return "{" + ", ".join(parts) + "}"
+
+
+def _generate_json(configuration, channels, start, end, fields):
+    yield "["
+    for i, channel in enumerate(channels):
+        if i > 0:
+            yield ", "
+        yield '{"channel": %s, "data": [' % json.dumps({"name": channel.channel.name,
+                                                        "backend": channel.channel.backend})
+        for block in range(start, end + 1, 1000):
+            events = [_format_event(configuration, channel, pulse_id, fields)
+                      for pulse_id in range(block, min(block + 1000, end + 1))]
+            yield (", " if block > start else "") + ", ".join(events)
+        yield "]}"
+    yield "]"
+
+
+def _range_boundaries(query_range):
+    # Start and end of a query range as needed for the aggregation - pulse-ids (int) or dates
+    if "startPulseId" in query_range:
+        return int(query_range["startPulseId"]), int(query_range["endPulseId"])
+    if "startSeconds" in query_range:
+        return tuple(datetime.fromtimestamp(_parse_seconds(query_range[key]) // 1000 / 1e6, tz=timezone.utc)
+                     for key in ["startSeconds", "endSeconds"])
+    return query_range["startDate"], query_range["endDate"]
+
+
+def _generate_json_aggregation(configuration, channels, start, end, fields, query):
+    # Bins of durationPerBin and pulsesPerBin are aligned to epoch / pulse-id 0, nrOfBins to the query range
+    if "nrOfBins" in query["aggregation"]:
+        range_start, range_end = _range_boundaries(query["range"])
+        collector = aggregation.AggregationCollector(query["aggregation"], start=range_start, end=range_end)
+    else:
+        collector = aggregation.AggregationCollector(query["aggregation"])
+
+    pulse_ids = numpy.arange(start, end + 1, dtype=numpy.int64)
+    times = configuration.global_time(pulse_ids)
+    for channel in channels:
+        values = numpy.stack([channel.values[index] for index in (pulse_ids % len(channel.values)).tolist()]) \
+            if len(pulse_ids) > 0 else numpy.empty(0)
+        collector.add_arrays(channel.channel.name, channel.channel.backend, values, pulse_ids, times)
+
+    result = []
+    for channel, entry in zip(channels, collector.get_data()):
+        events = []
+        for event in entry["data"]:
+            formatted = {"value": {key: numpy.asarray(value).tolist() for key, value in event["value"].items()}}
+            global_time = event["timeRaw"]
+            for field in fields:
+                if field == "pulseId":
+                    formatted["pulseId"] = event["pulseId"]
+                elif field == "globalSeconds":
+                    formatted["globalSeconds"] = "%d.%09d" % (global_time // 1000000000, global_time % 1000000000)
+                elif field == "globalDate":
+                    formatted["globalDate"] = _format_date(global_time)
+                elif field == "eventCount":
+                    formatted["eventCount"] = event["eventCount"]
+            events.append(formatted)
+        result.append({"channel": {"name": channel.channel.name, "backend": channel.channel.backend},
+                       "data": events})
+
+    yield json.dumps(result)
+
+
+def _generate_json_mapping(configuration, channels, start, end, fields):
+    yield '{"data": ['
+    for block in range(start, end + 1, 100):
+        rows = []
+        for pulse_id in range(block, min(block + 100, end + 1)):
+            rows.append("[" + ", ".join([_format_event(configuration, channel, pulse_id, fields, with_channel=True)
+                                         for channel in channels]) + "]")
+        yield (", " if block > start else "") + ", ".join(rows)
+    yield "]}"
+
+
+def _generate_rawevent(configuration, channels, start, end):
+    yield idread_encoder.encode_header([channel.channel for channel in channels])
+    for pulse_id in range(start, end + 1):
+        global_time = configuration.global_time(pulse_id)
+        index = pulse_id % configuration.pool_size
+        yield idread_encoder.encode_values([channel.channel.encode_event(channel.encoded[index], pulse_id,
+                                                                         global_time)
+                                            for channel in channels])
+
+
+def _chunk(generator, chunk_size):
+    # Collect the generated parts into chunks of (at least) chunk_size bytes
+    parts = []
+    size = 0
+    for part in generator:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield b"".join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b"".join(parts)
+
+
+def _gzip(chunks, wbits=31):
+    compressor = zlib.compressobj(wbits=wbits)  # 31: gzip container, 15: zlib container (http deflate)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _throttle(chunks, bandwidth):
+    # Limit the bandwidth by delaying chunks that are ahead of schedule
+    start = time.time()
+    sent = 0
+    for chunk in chunks:
+        delay = start + sent / bandwidth - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        yield chunk
+        sent += len(chunk)
+
+
+def _drop(chunks, size):
+    # Stop the response after size bytes - the connection is closed in the middle of the response
+    sent = 0
+    for chunk in chunks:
+        if sent + len(chunk) >= size:
+            yield chunk[:size - sent]
+            logger.info("Dropping connection after %d bytes", size)
+            return
+        yield chunk
+        sent += len(chunk)
+
+
+def create_app(configuration):
+    """
+    Create the bottle application of the mock server
+
+    :param configuration:   Configuration
+    :return:                bottle application
+    """
+
+    app = Bottle()
+
+    @app.route('/query', method='POST')
+    def query():
+        if configuration.error_rate > 0 and random.random() < configuration.error_rate:
+            raise HTTPResponse(status=503, body="Injected error")
+
+        response_options = request.json.get("response", {})
+        if "aggregation" in request.json and response_options.get("format", "json") == "rawevent":
+            raise HTTPResponse(status=400, body="Aggregation is not supported for rawevent responses")
+
+        channels = [configuration.get_channel(channel["name"]) for channel in request.json["channels"]]
+        start, end = _resolve_range(configuration, request.json["range"])
+
+        if response_options.get("format", "json") == "rawevent":
+            generator = _generate_rawevent(configuration, channels, start, end)
+            response.content_type = "application/octet-stream"
+        else:
+            fields = request.json.get("eventFields", request.json.get("fields",
+                                      ["pulseId", "globalSeconds", "globalDate", "value", "eventCount"]))
+            if "aggregation" in request.json:
+                generator = _generate_json_aggregation(configuration, channels, start, end, fields, request.json)
+            elif "mapping" in request.json:
+                generator = _generate_json_mapping(configuration, channels, start, end, fields)
+            else:
+                generator = _generate_json(configuration, channels, start, end, fields)
+            response.content_type = "application/json"
+
+        chunks = _chunk(generator, configuration.chunk_size)
+        if response_options.get("compression") == "gzip":
+            chunks = _chunk(_gzip(chunks), configuration.chunk_size)
+        if configuration.content_encoding is not None:
+            chunks = _chunk(_gzip(chunks, wbits=15 if configuration.content_encoding == "deflate" else 31),
+                            configuration.chunk_size)
+            response.set_header("Content-Encoding", configuration.content_encoding)
+        if configuration.throttle:
+            chunks = _throttle(chunks, configuration.throttle)
+        if configuration.drop():
+            chunks = _drop(chunks, configuration.drop_after)
+
+        logger.info("Serving %d channels, pulse-ids %d - %d", len(channels), start, end)
+
+        if configuration.latency > 0:
+            time.sleep(configuration.latency)
+        return chunks
+
+    @app.route('/channels', method='POST')
+    def channels():
+        backends = request.json.get("backends")
+        if backends is not None and configuration.backend not in backends:
+            return json.dumps([])
+
+        regex = re.compile(request.json.get("regex", ".*"))
+        names = [name for name in configuration.channels if regex.search(name)]
+        if request.json.get("ordering") == "asc":
+            names.sort()
+        elif request.json.get("ordering") == "desc":
+            names.sort(reverse=True)
+
+        response.content_type = "application/json"
+        return json.dumps([{"backend": configuration.backend, "channels": names}])
+
+    @app.route('/params/backends', method='GET')
+    def backends():
+        response.content_type = "application/json"
+        return json.dumps([configuration.backend])
+
+    return app
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start(configuration=None, host="localhost", port=0):
+    """
+    Start a (multi threaded) mock server in a background thread
+
+    :param configuration:   Configuration - None for the default configuration
+    :param host:
+    :param port:            0 to use any free port
+    :return:                server - base url: "http://%s:%d" % server.server_address, stop with server.shutdown()
+    """
+    if configuration is None:
+        configuration = Configuration()
+
+    server = make_server(host, port, create_app(configuration), server_class=_ThreadingWSGIServer,
+                         handler_class=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+
+    import argparse
+    parser = argparse.ArgumentParser(description='High volume mock Data API server')
+    parser.add_argument('-n', '--name', help='Hostname to bind to', default="localhost")
+    parser.add_argument('-p', '--port', help='Port to bind to', type=int, default=8080)
+    parser.add_argument('--rate', help='Events per second and channel', type=float, default=100.0)
+    parser.add_argument('--scalars', help='Number of scalar channels', type=int, default=10)
+    parser.add_argument('--waveforms', help='Number of waveform channels', type=int, default=0)
+    parser.add_argument('--waveform-size', help='Size of the waveforms', type=int, default=1024)
+    parser.add_argument('--images', help='Number of image channels', type=int, default=0)
+    parser.add_argument('--image-shape', help='Shape of the images, e.g. 64x64', default="64x64")
+    parser.add_argument('--type', help='Type of waveforms and images', default="float64",
+                        choices=list(idread_encoder.types))
+    parser.add_argument('--encoding', help='Byte order of rawevent responses', default="little",
+                        choices=["little", "big"])
+    parser.add_argument('--compression', help='Compression of waveforms and images in rawevent responses',
+                        default=None, choices=["bitshuffle_lz4"])
+    parser.add_argument('--backend', help='Backend name', default="sf-databuffer")
+    parser.add_argument('--chunk-size', help='Size of the response chunks in bytes', type=int, default=65536)
+    parser.add_argument('--latency', help='Delay in seconds before a response is started', type=float, default=0.0)
+    parser.add_argument('--throttle', help='Maximum bandwidth of a response in bytes per second', type=float,
+                        default=None)
+    parser.add_argument('--error-rate', help='Fraction of queries failing with 503', type=float, default=0.0)
+    parser.add_argument('--max-events', help='Maximum number of events per channel and query', type=int,
+                        default=10000000)
+    parser.add_argument('--drop-after', help='Close the connection after this number of bytes of a response',
+                        type=int, default=None)
+    parser.add_argument('--drops', help='Number of responses to drop (default: all)', type=int, default=None)
+
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    configuration = Configuration(rate=arguments.rate, scalars=arguments.scalars, waveforms=arguments.waveforms,
+                                  waveform_size=arguments.waveform_size, images=arguments.images,
+                                  image_shape=[int(x) for x in arguments.image_shape.split("x")],
+                                  type=arguments.type, encoding=arguments.encoding,
+                                  compression=arguments.compression, backend=arguments.backend,
+                                  chunk_size=arguments.chunk_size, latency=arguments.latency,
+                                  throttle=arguments.throttle, error_rate=arguments.error_rate,
+                                  max_events=arguments.max_events, drop_after=arguments.drop_after,
+                                  drops=arguments.drops)
+
+    server = make_server(arguments.name, arguments.port, create_app(configuration),
+                         server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    logger.info("Serving on http://%s:%d", arguments.name, arguments.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
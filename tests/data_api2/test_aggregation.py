@@ -0,0 +1,127 @@
+import unittest
+
+import datetime
+import numpy
+
+from data_api2 import aggregation, util
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def events(values, first_pulse_id=100, first_time=1000000000000000000, time_step=10000000):
+    return [{"value": value, "pulseId": first_pulse_id + i, "timeRaw": first_time + i * time_step}
+            for i, value in enumerate(values)]
+
+
+class AggregationTest(unittest.TestCase):
+
+    def test_pulses_per_bin(self):
+        data = [{"channel": {"name": "A", "backend": "test"}, "data": events([3, 1, 2, 5, 4, 4, 0])}]
+        result = aggregation.aggregate(data, util.construct_aggregation(
+            aggregations=["min", "mean", "max", "count"], extrema=["minValue", "maxValue"], pulses_per_bin=3),
+            start=100)
+
+        bins = result[0]["data"]
+        self.assertEqual(len(bins), 3)
+
+        self.assertEqual(bins[0]["value"], {"min": 1, "mean": 2.0, "max": 3, "count": 3})
+        self.assertEqual(bins[0]["pulseId"], 100)
+        self.assertEqual(bins[0]["extrema"]["minValue"]["pulseId"], 101)
+        self.assertEqual(bins[0]["extrema"]["maxValue"]["pulseId"], 100)
+
+        self.assertEqual(bins[1]["value"], {"min": 4, "mean": 13 / 3, "max": 5, "count": 3})
+        self.assertEqual(bins[1]["extrema"]["maxValue"]["pulseId"], 103)
+
+        self.assertEqual(bins[2]["value"], {"min": 0, "mean": 0.0, "max": 0, "count": 1})
+        self.assertEqual(bins[2]["eventCount"], 1)
+
+    def test_streaming(self):
+        # Folding small chunks needs to give the same result as aggregating everything at once
+        values = numpy.random.RandomState(0).normal(size=1000)
+        agg = util.construct_aggregation(aggregations=["min", "mean", "max", "count"],
+                                         extrema=["minValue", "maxValue"], duration_per_bin="PT1S")
+
+        reference = aggregation.aggregate([{"channel": {"name": "A", "backend": "test"}, "data": events(values)}], agg)
+
+        collector = aggregation.AggregationCollector(agg, chunk_size=7)
+        for event in events(values):
+            collector.add_data("A", "test", event["value"], event["pulseId"], event["timeRaw"], None, 0, 0)
+        result = collector.get_data()
+
+        self.assertEqual(len(reference[0]["data"]), 10)
+        self.assertEqual(len(result[0]["data"]), 10)
+        for expected, actual in zip(reference[0]["data"], result[0]["data"]):
+            self.assertEqual(expected["value"]["min"], actual["value"]["min"])
+            self.assertEqual(expected["value"]["max"], actual["value"]["max"])
+            self.assertAlmostEqual(expected["value"]["mean"], actual["value"]["mean"])
+            self.assertEqual(expected["extrema"], actual["extrema"])
+
+    def test_sparse(self):
+        # Events a day apart with 1ms bins - only the bins with events are stored
+        day = 86400000000000
+        agg = util.construct_aggregation(aggregations=["min", "mean", "max", "count"],
+                                         duration_per_bin=datetime.timedelta(milliseconds=1))
+        collector = aggregation.AggregationCollector(agg, chunk_size=2)
+        for i in [0, 1, 2, 3, 4, 5]:
+            collector.add_data("A", "test", i, 100 + i, 1000000000000000000 + i * day, None, 0, 0)
+        # Out of order chunk - merged into the stored bins
+        collector.add_arrays("A", "test", [10, 11], [200, 201], [1000000000000000000 + day // 2,
+                                                                  1000000000000000000 + 2 * day + 1])
+
+        result = collector.get_channel_arrays("A", "test")
+        self.assertEqual(len(collector.channel_data[("test", "A")].arrays["count"]), 8)
+        self.assertEqual(list(result["bin"] - result["bin"][0]),
+                         [0, 43200000, 86400000, 172800000, 259200000, 345600000, 432000000])
+        self.assertEqual(list(result["count"]), [1, 1, 1, 2, 1, 1, 1])
+        self.assertEqual(list(result["mean"]), [0, 10, 1, 6.5, 3, 4, 5])
+        self.assertEqual(list(result["pulseId"]), [100, 200, 101, 102, 103, 104, 105])
+
+    def test_nr_of_bins(self):
+        start = datetime.datetime(2018, 1, 1, 12, 0, 0)
+        end = start + datetime.timedelta(seconds=10)
+        first_time = util.convert_date_to_nanoseconds(start)
+
+        data = [{"channel": {"name": "A", "backend": "test"},
+                 "data": events(range(101), first_time=first_time, time_step=100000000)}]
+        result = aggregation.aggregate(data, util.construct_aggregation(nr_of_bins=5), start=start, end=end)
+
+        bins = result[0]["data"]
+        self.assertEqual(len(bins), 5)
+        self.assertEqual(bins[0]["value"]["min"], 0)
+        self.assertEqual(bins[0]["value"]["max"], 19)
+        # The end of the range belongs to the last bin
+        self.assertEqual(bins[4]["value"]["max"], 100)
+
+        self.assertRaises(ValueError, aggregation.aggregate, data, util.construct_aggregation(nr_of_bins=5))
+
+    def test_nr_of_bins_pulse_ids(self):
+        # Pulse-id boundaries taken from a numpy array
+        pulse_ids = numpy.arange(1000, 6000, dtype=numpy.int64)
+        data = [{"channel": {"name": "A", "backend": "test"}, "data": events(range(5000), first_pulse_id=1000)}]
+        result = aggregation.aggregate(data, util.construct_aggregation(aggregations=["min", "max", "count"], nr_of_bins=10),
+                                       start=pulse_ids[0], end=pulse_ids[-1])
+
+        bins = result[0]["data"]
+        self.assertEqual(len(bins), 10)
+        self.assertEqual([event["value"]["count"] for event in bins], [500] * 10)
+
+    def test_waveform(self):
+        values = [numpy.array([1.0, 2.0, 3.0]), numpy.array([0.0, 5.0, 1.0])]
+        data = [{"channel": {"name": "A", "backend": "test"}, "data": events(values)}]
+
+        result = aggregation.aggregate(data, util.construct_aggregation(pulses_per_bin=10))
+        self.assertEqual(result[0]["data"][0]["value"], {"min": 0.0, "mean": 2.0, "max": 5.0})
+
+        result = aggregation.aggregate(data, util.construct_aggregation(aggregation_type="index", pulses_per_bin=10))
+        self.assertEqual(result[0]["data"][0]["value"]["min"].tolist(), [0.0, 2.0, 1.0])
+        self.assertEqual(result[0]["data"][0]["value"]["max"].tolist(), [1.0, 5.0, 3.0])
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, aggregation.AggregationCollector,
+                          util.construct_aggregation(aggregations=["sum"], pulses_per_bin=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+
+import datetime
+import re
+import tempfile
+import threading
+from unittest import mock
+from pathlib import Path
+
+import numpy
+
+from data_api2 import cli, idread_util
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class CliTest(unittest.TestCase):
+
+    def test_split_range(self):
+        self.assertEqual(cli._split_range(100, 349, "100", True), [(100, 199), (200, 299), (300, 349)])
+        self.assertEqual(cli._split_range(100, 349, "", True), [(100, 349)])
+
+        start = datetime.datetime(2018, 4, 5, 9)
+        segments = cli._split_range(start, start + datetime.timedelta(minutes=70), "PT30M", False)
+        self.assertEqual(segments, [(start, start + datetime.timedelta(minutes=30)),
+                                    (start + datetime.timedelta(minutes=30), start + datetime.timedelta(minutes=60)),
+                                    (start + datetime.timedelta(minutes=60), start + datetime.timedelta(minutes=70))])
+
+        with self.assertRaises(ValueError):
+            cli._split_range(start, start + datetime.timedelta(minutes=70), "PT0S", False)
+
+    def test_split_filename(self):
+        self.assertEqual(cli._split_filename("data/out.h5", 3), Path("data/out_003.h5"))
+        self.assertEqual(cli._split_filename("out", 12), Path("out_012.h5"))
+
+    def test_classify_channels(self):
+        catalog = {"sf-databuffer": ["DB-A", "DB-B", "DB-B-AVG"], "sf-archiverappliance": ["AA-A"]}
+        requests = []
+
+        def search(regex, backends=None):
+            requests.append(regex)
+            return {backend: [channel for channel in catalog[backend] if re.search(regex, channel)]
+                    for backend in backends or catalog}
+
+        with mock.patch("data_api2.search", side_effect=search):
+            db_channels, aa_channels = cli._classify_channels(
+                ["DB-A", "AA-A", "sf-archiverappliance/DB-B", "DB-B", "UNKNOWN"])
+
+        self.assertEqual(db_channels, ["DB-A", "DB-B"])
+        self.assertEqual(aa_channels, ["AA-A", "sf-archiverappliance/DB-B", "UNKNOWN"])
+        # One batched lookup, individual lookups only for unresolved channels
+        self.assertEqual(requests, [r"^(DB\-A|AA\-A|DB\-B|UNKNOWN)$", "UNKNOWN"])
+
+    def test_fetch_concurrent(self):
+        data = Path(__file__).parent / 'data' / 'out.bin'
+        barrier = threading.Barrier(2, timeout=10)
+        queries = []
+
+        def save_data_iread(query, filename, collector=None):
+            queries.append(query["channels"])
+            barrier.wait()  # fails unless both backends are queried at the same time
+            with data.open(mode='rb') as f:
+                idread_util.decode(f, collector_function=collector.add_data, header_function=collector.add_header)
+
+        collector = idread_util.ArrayCollector()
+        with mock.patch("data_api2.client.save_data_iread", side_effect=save_data_iread):
+            cli._fetch(collector, ["DB-A"], ["AA-A"], datetime.datetime(2018, 1, 1), datetime.datetime(2018, 1, 2),
+                       False)
+
+        self.assertEqual(sorted(queries, key=str), [[{"name": "AA-A"}], [{"name": "DB-A"}]])
+        # Both responses went into the same collector
+        self.assertEqual(len(collector.get_data()[0]["data"]["value"]), 1200)
+
+    def test_save_collector(self):
+        data = Path(__file__).parent / 'data' / 'out.bin'
+
+        collector = idread_util.DictionaryCollector(event_fields=["value", "pulseId", "timeRaw"])
+        with data.open(mode='rb') as f:
+            idread_util.decode(f, collector_function=collector.add_data)
+        expected = collector.get_data()
+        end_time = expected[0]["data"][500]["timeRaw"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = Path(directory) / "out.h5"
+            collector = cli._SaveCollector(batch_size=64)
+            collector.open(filename.as_posix())
+            with data.open(mode='rb') as f:
+                idread_util.decode(f, collector_function=collector.add_data, header_function=collector.add_header)
+            collector.close()
+
+            reference = Path(directory) / "reference.h5"
+            cli.to_hdf5(expected, reference)
+            with self.assertRaises(RuntimeError):
+                cli.to_hdf5(expected, reference)
+
+            result = cli.from_hdf5(filename, events=True)
+            self.assertEqual(len(result[0]["data"]), 600)
+            for event, expected_event in zip(result[0]["data"], cli.from_hdf5(reference, events=True)[0]["data"]):
+                self.assertEqual(event["value"], expected_event["value"])
+                self.assertEqual(event["pulseId"], expected_event["pulseId"])
+                self.assertEqual(event["timeRaw"], expected_event["timeRaw"])
+
+            # Skip pulse ids and events after the end of the segment
+            collector = cli._SaveCollector(channels_without_pulse_id=["SINEG01-RCIR-PUP10:SIG-AMPLT-MAX"])
+            collector.end_time = end_time
+            collector.open(filename.as_posix())
+            with data.open(mode='rb') as f:
+                idread_util.decode(f, collector_function=collector.add_data, header_function=collector.add_header)
+            collector.close()
+
+            result = cli.from_hdf5(filename, events=True)
+            self.assertEqual(len(result[0]["data"]), 500)
+            self.assertNotIn("pulseId", result[0]["data"][0])
+            self.assertTrue(numpy.all([event["timeRaw"] < end_time for event in result[0]["data"]]))
+
+    def test_from_hdf5(self):
+        data = [{"channel": {"name": "A"},
+                 "data": [{"value": i * 0.5, "pulseId": 100 + i, "timeRaw": 1000 + i} for i in range(1000)]},
+                {"channel": {"name": "B"},
+                 "data": [{"value": [i, i + 1], "timeRaw": 1000 + i} for i in range(10)]}]
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = Path(directory) / "out.h5"
+            cli.to_hdf5(data, filename)
+
+            for lazy in [False, True]:
+                result = cli.from_hdf5(filename, lazy=lazy)
+                self.assertEqual(result[0]["channel"], {"name": "A", "backend": "hdf5"})
+                self.assertTrue(numpy.array_equal(result[0]["data"]["value"], numpy.arange(1000) * 0.5))
+                self.assertTrue(numpy.array_equal(result[0]["data"]["pulseId"], numpy.arange(100, 1100)))
+                self.assertTrue(numpy.array_equal(result[0]["data"]["timeRaw"], numpy.arange(1000, 2000)))
+                self.assertNotIn("pulseId", result[1]["data"])
+                self.assertEqual(result[1]["data"]["value"].shape, (10, 2))
+
+            self.assertIsInstance(cli.from_hdf5(filename, lazy=True)[0]["data"]["value"], numpy.memmap)
+
+            events = cli.from_hdf5(filename, events=True)
+            self.assertEqual(events[0]["data"][3], {"value": 1.5, "timeRaw": 1003, "pulseId": 103})
+            self.assertEqual(events[1]["data"][3]["value"].tolist(), [3, 4])
+            self.assertEqual(set(events[1]["data"][3].keys()), {"value", "timeRaw"})
+
+
+if __name__ == '__main__':
+    unittest.main()
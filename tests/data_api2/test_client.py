@@ -1,9 +1,17 @@
 import unittest
 
+import concurrent.futures
+import threading
 import datetime
 import dateutil.tz
+import tempfile
+import socket
+import struct
+import os
 from data_api2 import util, client
 import numpy
+import h5py
+from tests.data_api2 import mockserver
 
 import logging
 logger = logging.getLogger(__name__)
@@ -91,6 +99,269 @@ class ClientTest(unittest.TestCase):
         for i in range(10):
             self.assertEqual(data[0]["data"][i]["value"], i)
 
+    def test_get_data_compressed(self):
+        configuration = mockserver.Configuration(scalars=2, waveforms=1, waveform_size=16)
+        server = mockserver.start(configuration)
+        base_url = "http://%s:%d" % server.server_address[:2]
+
+        try:
+            query = util.construct_data_query(channels=["MOCK:SCALAR-000", "MOCK:WAVEFORM-000"], start=1000, end=1599)
+            plain_stats = dict()
+            plain = client.get_data_json(query, base_url=base_url, stats=plain_stats)
+            stats = dict()
+            data = client.get_data_json(query, base_url=base_url, compression="gzip", stats=stats)
+
+            self.assertEqual(data, plain)
+            self.assertNotIn("response", query)  # the passed query is not modified
+            self.assertEqual(stats["bytes_decoded"], plain_stats["bytes_received"])
+            self.assertLess(stats["bytes_received"], stats["bytes_decoded"])
+            self.assertGreater(stats["compression_ratio"], 1)
+            self.assertEqual(plain_stats["compression_ratio"], 1)
+
+            query = util.construct_data_query(channels=["MOCK:SCALAR-000", "MOCK:WAVEFORM-000"], start=1000, end=1599,
+                                              event_fields=["value", "pulseId"])
+            plain = client.get_data_idread(query, base_url=base_url)
+            stats = dict()
+            data = client.get_data_idread(query, base_url=base_url, compression="gzip", stats=stats)
+
+            self.assertEqual(len(data[0]["data"]), 600)
+            self.assertEqual(data[0]["data"], plain[0]["data"])
+            self.assertLess(stats["bytes_received"], stats["bytes_decoded"])
+
+            # Content encodings added by the server (or a proxy) are decoded as well
+            for content_encoding in ["gzip", "deflate"]:
+                configuration.content_encoding = content_encoding
+                self.assertEqual(client.get_data_idread(query, base_url=base_url)[0]["data"], plain[0]["data"])
+                self.assertEqual(client.get_data_idread(query, base_url=base_url, compression="gzip")[0]["data"],
+                                 plain[0]["data"])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_stats(self):
+        server = mockserver.start(mockserver.Configuration(scalars=1, waveforms=0))
+        base_url = "http://%s:%d" % server.server_address[:2]
+        query = util.construct_data_query(channels=["MOCK:SCALAR-000"], start=1000, end=1599,
+                                          event_fields=["value", "pulseId"])
+
+        reported = []
+        client.add_stats_callback(reported.append)
+        try:
+            data = client.get_data_idread(query, base_url=base_url, compression="gzip")
+            with self.assertRaises(RuntimeError):
+                client.get_data_json(query, base_url=base_url + "/notexisting")
+        finally:
+            client.remove_stats_callback(reported.append)
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(reported), 2)
+        stats = reported[0]
+        self.assertEqual(stats["api"], "get_data_idread")
+        self.assertIsNone(stats["error"])
+        self.assertEqual(stats["events"], {"MOCK:SCALAR-000": 600})
+        self.assertEqual(len(data[0]["data"]), 600)
+        self.assertEqual(stats["missing"], {"MOCK:SCALAR-000": 0})
+        self.assertEqual(stats["messages"], 600)
+        self.assertGreater(stats["bytes_decoded"], stats["bytes_received"])
+        for field in ["time_to_first_byte", "read_time", "gzip_time", "decode_time", "collect_time"]:
+            self.assertGreaterEqual(stats[field], 0)
+        self.assertLessEqual(stats["collect_time"], stats["decode_time"])
+        self.assertLessEqual(stats["decode_time"], stats["total_time"])
+
+        self.assertEqual(reported[1]["status_code"], 404)
+        self.assertIsNotNone(reported[1]["error"])
+
+    def test_save_data_resume(self):
+        configuration = mockserver.Configuration(rate=100, scalars=2, waveforms=1, waveform_size=16, chunk_size=1024,
+                                                 drop_after=5000, drops=2)
+        server = mockserver.start(configuration)
+        base_url = "http://%s:%d" % server.server_address[:2]
+        channels = ["MOCK:SCALAR-000", "MOCK:SCALAR-001", "MOCK:WAVEFORM-000"]
+
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                # Pulse-id range
+                filename = os.path.join(directory, "pulse.h5")
+                stats = dict()
+                query = util.construct_data_query(channels, start=1000, end=1999)
+                client.save_data_iread(query, filename, base_url=base_url, backoff=0.01, stats=stats)
+
+                self.assertEqual(stats["retries"], 2)
+                with h5py.File(filename, "r") as f:
+                    for channel in channels:
+                        self.assertTrue(numpy.array_equal(f[channel + "/pulse_id"][:], numpy.arange(1000, 2000)))
+                    self.assertTrue(numpy.array_equal(f["MOCK:WAVEFORM-000/data"][5], numpy.arange(16) + 1005 % 16))
+
+                # Time range
+                configuration.drops = 2
+                filename = os.path.join(directory, "time.h5")
+                start = datetime.datetime.fromtimestamp(mockserver.reference_time / 1e9 + 10,
+                                                        tz=datetime.timezone.utc)
+                query = util.construct_data_query(channels, start=start, end=start + datetime.timedelta(seconds=10))
+                client.save_data_iread(query, filename, base_url=base_url, backoff=0.01)
+
+                with h5py.File(filename, "r") as f:
+                    for channel in channels:
+                        self.assertTrue(numpy.array_equal(f[channel + "/pulse_id"][:], numpy.arange(1000, 2001)))
+
+                # Not enough retries - the data decoded so far is kept
+                configuration.drops = 3
+                filename = os.path.join(directory, "failed.h5")
+                with self.assertRaises((EOFError, struct.error)):  # depending on where the stream is cut
+                    client.save_data_iread(util.construct_data_query(channels, start=1000, end=1999), filename,
+                                           base_url=base_url, retries=2, backoff=0.01)
+
+                with h5py.File(filename, "r") as f:
+                    pulse_ids = f["MOCK:SCALAR-000/pulse_id"][:]
+                    self.assertGreater(len(pulse_ids), 0)
+                    self.assertTrue(numpy.array_equal(pulse_ids, numpy.arange(1000, 1000 + len(pulse_ids))))
+
+                # Server errors are retried
+                configuration.drops = 0
+                configuration.error_rate = 1
+                stats = dict()
+                with self.assertRaises(RuntimeError):
+                    client.save_data_iread(util.construct_data_query(channels, start=1000, end=1999),
+                                           os.path.join(directory, "error.h5"), base_url=base_url, backoff=0.01,
+                                           stats=stats)
+                self.assertEqual(stats["retries"], 3)  # 503 is retried
+
+                # Client errors are not retried
+                configuration.error_rate = 0
+                query = util.construct_data_query(channels, start=1000, end=1999)
+                query["aggregation"] = util.construct_aggregation(nr_of_bins=10)
+                stats = dict()
+                with self.assertRaises(RuntimeError):
+                    client.save_data_iread(query, os.path.join(directory, "invalid.h5"), base_url=base_url,
+                                           backoff=0.01, stats=stats)
+                self.assertEqual(stats["retries"], 0)
+                self.assertEqual(stats["status_code"], 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_endpoint_pool(self):
+        pool = client.EndpointPool(["http://a", "http://b", "http://c"], cooldown=60)
+
+        # By latency and running queries - in order of preference as long as nothing is measured
+        self.assertEqual(pool.select(), "http://a")
+        pool.observe("http://a", 0.1)
+        pool.observe("http://b", 0.2)
+        pool.observe("http://c", 0.3)
+        self.assertEqual(pool.select(), "http://a")
+        pool.begin("http://a")
+        self.assertEqual(pool.select(), "http://b")  # equal score (0.1 * 2 queries, 0.2 * 1) - fewer running
+        pool.begin("http://b")
+        self.assertEqual(pool.select(), "http://a")
+        pool.end("http://a")
+        pool.end("http://b")
+        self.assertEqual(pool.select(exclude=["http://a"]), "http://b")
+
+        # Failed endpoints are not used until their cool down expired - client errors do not count
+        pool.begin("http://a")
+        pool.end("http://a", error=RuntimeError("Unable to retrieve data from server: ", None))
+        self.assertEqual(pool.select(), "http://a")
+        pool.begin("http://a")
+        pool.end("http://a", error=EOFError())
+        self.assertEqual(pool.select(), "http://b")
+        self.assertFalse(pool.status()["http://a"]["available"])
+        self.assertEqual(pool.status()["http://a"]["failures"], 1)
+
+        # All endpoints down - the one that is down the shortest
+        for url in ["http://b", "http://c"]:
+            pool.begin(url)
+            pool.end(url, error=EOFError())
+        self.assertEqual(pool.select(), "http://a")
+
+        with self.assertRaises(ValueError):
+            client.EndpointPool([])
+
+    def test_endpoint_pool_probes(self):
+        # An endpoint that never responds (no latency measurement) must not attract all queries
+        pool = client.EndpointPool(["http://a", "http://b"])
+        pool.observe("http://a", 0.1)
+
+        selected = []
+        for _ in range(10):
+            url = pool.select()
+            pool.begin(url)
+            selected.append(url)
+        self.assertEqual(selected.count("http://b"), 1)
+        self.assertEqual(pool.status()["http://a"]["running"], 9)
+
+        # Unmeasured endpoints are rated like the slowest measured endpoint
+        pool = client.EndpointPool(["http://a", "http://b", "http://c"], max_probes=10)
+        pool.observe("http://a", 0.1)
+        pool.observe("http://b", 0.4)
+        self.assertEqual(pool.select(), "http://a")
+        for _ in range(4):
+            pool.begin("http://a")
+        self.assertEqual(pool.select(exclude=["http://b"]), "http://c")  # 0.4 * 1 < 0.1 * 5
+
+        # Concurrent queries see each other's selection - only max_probes of them go to the unmeasured endpoint
+        pool = client.EndpointPool(["http://a", "http://b"])
+        pool.observe("http://a", 0.1)
+        barrier = threading.Barrier(20)
+
+        def acquire():
+            barrier.wait()
+            return pool.acquire()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
+            selected = list(executor.map(lambda _: acquire(), range(20)))
+        self.assertEqual(selected.count("http://b"), 1)
+        self.assertEqual(pool.status()["http://a"]["running"], 19)
+        self.assertEqual(pool.status()["http://b"]["running"], 1)
+
+    def test_failover(self):
+        channels = ["MOCK:SCALAR-000", "MOCK:WAVEFORM-000"]
+        failing = mockserver.start(mockserver.Configuration(scalars=1, waveforms=1, waveform_size=16, chunk_size=1024,
+                                                            drop_after=5000))  # every response is dropped
+        server = mockserver.start(mockserver.Configuration(scalars=1, waveforms=1, waveform_size=16))
+
+        # Endpoint that does not accept connections
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            unreachable = "http://127.0.0.1:%d" % s.getsockname()[1]
+
+        try:
+            base_url = "http://%s:%d" % server.server_address[:2]
+            failing_url = "http://%s:%d" % failing.server_address[:2]
+
+            pool = client.EndpointPool([unreachable, base_url], timeout=5)
+            query = util.construct_data_query(channels, start=1000, end=1099)
+            data = client.get_data_json(query, base_url=pool)
+            self.assertEqual([event["pulseId"] for event in data[0]["data"]], list(range(1000, 1100)))
+            self.assertFalse(pool.status()[unreachable]["available"])
+            self.assertTrue(pool.status()[base_url]["available"])
+            self.assertIsNotNone(pool.status()[base_url]["latency"])
+            self.assertEqual(client.search("MOCK:SCALAR-000", base_url=pool)["sf-databuffer"], ["MOCK:SCALAR-000"])
+
+            # The download is resumed on the other endpoint
+            pool = client.EndpointPool([failing_url, base_url], timeout=5)
+            with tempfile.TemporaryDirectory() as directory:
+                filename = os.path.join(directory, "failover.h5")
+                stats = dict()
+                client.save_data_iread(util.construct_data_query(channels, start=1000, end=1999), filename,
+                                       base_url=pool, backoff=60, stats=stats)  # no delay when failing over
+
+                self.assertEqual(stats["retries"], 1)
+                self.assertEqual(stats["base_url"], base_url)
+                with h5py.File(filename, "r") as f:
+                    for channel in channels:
+                        self.assertTrue(numpy.array_equal(f[channel + "/pulse_id"][:], numpy.arange(1000, 2000)))
+            self.assertEqual(pool.status()[failing_url]["failures"], 1)
+
+            # Concurrent queries are spread over the endpoints
+            pool = client.EndpointPool([base_url, failing_url])
+            pool.begin(base_url)
+            self.assertEqual(pool.select(), failing_url)
+        finally:
+            for s in [server, failing]:
+                s.shutdown()
+                s.server_close()
+
     @unittest.skipIf(test_offline_only, "Offline only testing enabled")
     def test_get_data_long_timerange(self):
         # If this test fails check whether the used channels are currently available in the databuffer / archiver
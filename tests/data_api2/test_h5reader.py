@@ -0,0 +1,111 @@
+import unittest
+
+import tempfile
+from pathlib import Path
+
+import numpy
+
+from data_api2 import cli, idread_util
+from data_api2.h5reader import H5Reader
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class H5ReaderTest(unittest.TestCase):
+    data = Path(__file__).parent / 'data'
+    channel = "SINEG01-RCIR-PUP10:SIG-AMPLT-MAX"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        collector = idread_util.ArrayCollector()
+        with (self.data / 'out.bin').open(mode='rb') as f:
+            idread_util.decode(f, collector_function=collector.add_data)
+        self.expected = collector.get_data()[0]["data"]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check(self, filename, check_pulse_ids=True):
+        pulse_ids = self.expected["pulseId"]
+        times = self.expected["timeRaw"]
+
+        with H5Reader(filename) as reader:
+            self.assertIn(self.channel, reader)
+            channel = reader[self.channel]
+            self.assertEqual(len(channel), 600)
+
+            data = channel.pulse_slice(pulse_ids[100], pulse_ids[199])
+            self.assertTrue(numpy.array_equal(data["value"], self.expected["value"][100:200]))
+            self.assertTrue(numpy.array_equal(data["pulseId"], pulse_ids[100:200]))
+
+            # Pulse-ids between events
+            self.assertEqual(channel.pulse_index(pulse_ids[100] + 1, pulse_ids[199] - 1), (101, 199))
+            self.assertEqual(channel.pulse_index(pulse_ids[-1] + 1, None), (600, 600))
+            self.assertEqual(len(channel.pulse_slice(pulse_ids[-1] + 1)["value"]), 0)
+
+            data = channel.time_slice(int(times[300]), int(times[349]))
+            self.assertTrue(numpy.array_equal(data["value"], self.expected["value"][300:350]))
+
+            data = channel[10:20]
+            self.assertTrue(numpy.array_equal(data["value"], self.expected["value"][10:20]))
+
+            data = reader.pulse_slice(pulse_ids[0], pulse_ids[9])
+            self.assertEqual(data[0]["channel"]["name"], self.channel)
+            self.assertEqual(len(data[0]["data"]["value"]), 10)
+
+    def test_cli_layout(self):
+        filename = Path(self.directory.name) / "cli.h5"
+        cli.to_hdf5(cli.to_events([{"channel": {"name": self.channel}, "data": self.expected}]), filename)
+        self.check(filename)
+
+    def test_collector_layout(self):
+        filename = Path(self.directory.name) / "collector.h5"
+        collector = idread_util.HDF5Collector()
+        collector.open(filename.as_posix())
+        with (self.data / 'out.bin').open(mode='rb') as f:
+            idread_util.decode(f, collector_function=collector.add_data, header_function=collector.add_header)
+        collector.close()
+        self.check(filename)
+
+    def test_serializer_layout(self):
+        import data_api.idread
+        from data_api.h5 import Serializer
+
+        filename = Path(self.directory.name) / "serializer.h5"
+        serializer = Serializer(batch_size=256)
+        serializer.open(filename.as_posix())
+        with (self.data / 'out.bin').open(mode='rb') as f:
+            data_api.idread.decode(f, serializer=serializer)
+        serializer.close()
+
+        self.check(filename)
+        with H5Reader(filename) as reader:
+            data = reader[self.channel][0:600]
+            for field in ["value", "pulseId", "timeRaw"]:
+                self.assertEqual(data[field].shape, (600,))
+            self.assertTrue(numpy.array_equal(data["timeRaw"], self.expected["timeRaw"]))
+
+    def test_legacy_layout(self):
+        import data_api
+        import data_api.client
+
+        filename = Path(self.directory.name) / "legacy.h5"
+        data_frame = data_api.client._build_pandas_data_frame_from_arrays(
+            [{"channel": {"name": self.channel}, "data": self.expected}], index_field="pulseId")
+        data_api.to_hdf5(data_frame, filename.as_posix())
+
+        with H5Reader(filename) as reader:
+            self.assertEqual(list(reader.keys()), [self.channel])
+            channel = reader[self.channel]
+            pulse_ids = self.expected["pulseId"]
+            data = channel.pulse_slice(pulse_ids[100], pulse_ids[199])
+            self.assertTrue(numpy.array_equal(data["value"], self.expected["value"][100:200]))
+            # globalSeconds is stored with millisecond precision
+            self.assertTrue(numpy.all(numpy.abs(data["timeRaw"] - self.expected["timeRaw"][100:200]) <= 1000000))
+
+
+if __name__ == '__main__':
+    unittest.main()
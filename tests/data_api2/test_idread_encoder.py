@@ -0,0 +1,100 @@
+import unittest
+import io
+
+import numpy
+
+from data_api2 import idread_util, idread_encoder
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def _decode(data):
+    collector = idread_util.DictionaryCollector(event_fields=["value", "pulseId", "timeRaw", "status", "severity"])
+    headers = []
+    idread_util.decode(io.BytesIO(data), collector_function=collector.add_data, header_function=headers.append)
+    return collector.get_data(), headers
+
+
+class EncoderTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        channels = []
+        for type in idread_encoder.types:
+            for encoding in ["little", "big"]:
+                channels.append(idread_encoder.Channel("SCALAR-%s-%s" % (type, encoding), type=type,
+                                                       encoding=encoding))
+                channels.append(idread_encoder.Channel("WAVEFORM-%s-%s" % (type, encoding), type=type,
+                                                       encoding=encoding, shape=[5],
+                                                       compression="bitshuffle_lz4" if encoding == "big" else None))
+        channels.append(idread_encoder.Channel("IMAGE", type="uint16", shape=[3, 4], compression="bitshuffle_lz4"))
+
+        values = dict()
+        messages = []
+        for i in range(3):
+            message = []
+            for channel in channels:
+                if channel.shape is None:
+                    value = i + 1
+                else:
+                    value = (numpy.arange(numpy.prod(channel.shape)) + i).reshape(channel.shape)
+                values.setdefault(channel.name, []).append(value)
+                message.append((value, 100 + i, 1000 + i, 999 + i, 0, 1))
+            messages.append(message)
+
+        stream = io.BytesIO()
+        idread_encoder.encode(stream, channels, messages)
+        data, headers = _decode(stream.getvalue())
+
+        self.assertEqual(len(headers), 1)
+        self.assertEqual(len(data), len(channels))
+        for channel_data in data:
+            name = channel_data["channel"]["name"]
+            self.assertEqual(channel_data["channel"]["backend"], "sf-databuffer")
+            self.assertEqual([event["pulseId"] for event in channel_data["data"]], [100, 101, 102])
+            self.assertEqual([event["timeRaw"] for event in channel_data["data"]], [1000, 1001, 1002])
+            self.assertEqual(channel_data["data"][0]["severity"], 1)
+            for event, value in zip(channel_data["data"], values[name]):
+                self.assertTrue(numpy.array_equal(numpy.asarray(event["value"]).reshape(numpy.shape(value)), value),
+                                name)
+
+    def test_missing_events(self):
+        channels = [idread_encoder.Channel("A"), idread_encoder.Channel("B", type="int32", shape=[8])]
+        data, _ = _decode(b"".join(idread_encoder.generate(channels, 1000, missing=0.3, compress_header=True)))
+
+        for channel_data in data:
+            self.assertEqual(len(channel_data["data"]), 1000)
+            present = [event for event in channel_data["data"] if event["value"] is not None]
+            self.assertGreater(len(present), 500)
+            self.assertLess(len(present), 900)
+
+            pulse_ids = [event["pulseId"] for event in present]
+            self.assertEqual(pulse_ids, sorted(pulse_ids))
+
+    def test_generate_stream(self):
+        channels = [idread_encoder.Channel("A"), idread_encoder.Channel("B", type="float32", shape=[1024])]
+        collector = idread_util.ArrayCollector()
+        idread_util.decode(idread_encoder.generate_stream(channels, 5000, start_pulse_id=10),
+                           collector_function=collector.add_data)
+
+        data = collector.get_data()
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[1]["data"]["value"].shape, (5000, 1024))
+        self.assertEqual(data[0]["data"]["pulseId"][0], 10)
+
+        # Endless streams are produced lazily
+        stream = idread_encoder.generate_stream(channels, None)
+        self.assertEqual(len(stream.read(10 * 1024 * 1024)), 10 * 1024 * 1024)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            idread_encoder.Channel("A", type="string")
+        with self.assertRaises(ValueError):
+            idread_encoder.Channel("A", compression="bitshuffle_lz4")
+        with self.assertRaises(ValueError):
+            idread_encoder.Channel("A", shape=[2]).encode_value([1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
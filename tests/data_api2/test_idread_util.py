@@ -1,5 +1,8 @@
 import unittest
 import requests
+import tempfile
+
+import h5py
 
 from data_api2 import util, idread_util
 import datetime
@@ -58,6 +61,43 @@ class ClientTest(unittest.TestCase):
 
         self.assertEqual(600, len(data[0]["data"]))
 
+    def test_decode_stats(self):
+        stats = dict()
+        with (self.data / 'out.bin').open('rb') as f:
+            idread_util.decode(f, collector_function=idread_util.ArrayCollector().add_data, stats=stats)
+
+        self.assertEqual(stats["messages"], 600)
+        self.assertEqual(sum(stats["events"].values()) + sum(stats["missing"].values()), 600)
+        self.assertGreaterEqual(stats["decode_time"], stats["collect_time"] + stats["header_time"])
+
+    def test_decode_hdf5_collector(self):
+        tmp = self.data / 'out.bin'
+        channel = '/SINEG01-RCIR-PUP10:SIG-AMPLT-MAX'
+
+        reference = idread_util.ArrayCollector()
+        with tmp.open('rb') as f:
+            idread_util.decode(f, collector_function=reference.add_data)
+        reference = reference.get_data()[0]["data"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = str(Path(directory) / 'out.h5')
+
+            collector = idread_util.HDF5Collector(batch_size=100)
+            collector.open(filename)
+            with tmp.open('rb') as f:
+                idread_util.decode(f, collector_function=collector.add_data, header_function=collector.add_header)
+            collector.close()
+
+            with h5py.File(filename, 'r') as f:
+                self.assertEqual(f[channel + '/data'].dtype, 'u4')
+                # Datasets grow geometrically while writing and are shrunk to the number of events on close
+                self.assertEqual(f[channel + '/data'].shape, (600,))
+                self.assertEqual(f[channel + '/data'].chunks, (100,))
+                self.assertTrue((f[channel + '/data'][:] == reference["value"]).all())
+                self.assertTrue((f[channel + '/pulse_id'][:] == reference["pulseId"]).all())
+                self.assertTrue((f[channel + '/timestamp'][:] == reference["timeRaw"]).all())
+                self.assertTrue((f[channel + '/severity'][:] == reference["severity"]).all())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+from datetime import timedelta
+
+import numpy
+
+from data_api2 import lod, pyramid, util
+from tests.data_api2 import mockserver
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class LocalLevelOfDetail(lod.LevelOfDetail):
+    # Serves a synthetic channel with one event every 10ms instead of querying a server
+
+    def __init__(self, *args, **kwargs):
+        super(LocalLevelOfDetail, self).__init__(*args, **kwargs)
+        self.times = util.convert_date_to_nanoseconds("2018-01-01T00:00:00+00:00") + \
+            numpy.arange(360000, dtype=numpy.int64) * 10000000
+        self.requests = []
+
+    def _fetch_aggregated(self, channel, start, end, points):
+        self.requests.append("aggregated")
+        width = int(numpy.ceil((end - start) / points))
+        times = self.times[(self.times >= start) & (self.times <= end)]
+        bins = (times - start) // width
+        edges = numpy.flatnonzero(numpy.diff(bins)) + 1
+        starts = numpy.concatenate(([0], edges))
+        values = times.astype(numpy.float64)
+        data = {"timeRaw": start + bins[starts] * width,
+                "min": numpy.minimum.reduceat(values, starts), "max": numpy.maximum.reduceat(values, starts),
+                "mean": numpy.add.reduceat(values, starts) / numpy.diff(numpy.append(starts, len(times))),
+                "count": numpy.diff(numpy.append(starts, len(times)))}
+        return lod._Level(start, end, width, data)
+
+    def _fetch_raw(self, channel, start, end):
+        self.requests.append("raw")
+        times = self.times[(self.times >= start) & (self.times <= end)]
+        return lod._Level(start, end, 0, {"timeRaw": times, "pulseId": numpy.arange(len(times)),
+                                          "value": times.astype(numpy.float64)}, raw=True)
+
+
+class LevelOfDetailTest(unittest.TestCase):
+
+    def test_get_data(self):
+        lod_client = LocalLevelOfDetail(points=1000)
+
+        # Overview - one hour is aggregated
+        data = lod_client.get_data("A", "2018-01-01T00:00:00+00:00", "2018-01-01T01:00:00+00:00")
+        self.assertTrue(data[0]["aggregated"])
+        self.assertEqual(data[0]["channel"], {"name": "A"})
+        self.assertLessEqual(len(data[0]["data"]["timeRaw"]), 1000)
+        self.assertEqual(lod_client.requests, ["aggregated"])
+
+        # Zoom into half of the range - the cached overview is still detailed enough
+        data = lod_client.get_data("A", "2018-01-01T00:00:00+00:00", "2018-01-01T00:30:00+00:00")
+        self.assertTrue(data[0]["aggregated"])
+        self.assertEqual(lod_client.requests, ["aggregated"])
+
+        # Zoom into 5 seconds - the counts of the overview show that the raw events fit the budget
+        data = lod_client.get_data("A", "2018-01-01T00:10:00+00:00", "2018-01-01T00:10:05+00:00")
+        self.assertFalse(data[0]["aggregated"])
+        self.assertEqual(len(data[0]["data"]["value"]), 501)
+        self.assertEqual(lod_client.requests, ["aggregated", "raw"])
+
+        # Within the cached raw events - served (and aggregated if needed) from the cache
+        data = lod_client.get_data("A", "2018-01-01T00:10:01+00:00", "2018-01-01T00:10:02+00:00")
+        self.assertFalse(data[0]["aggregated"])
+        self.assertEqual(len(data[0]["data"]["value"]), 101)
+
+        data = lod_client.get_data("A", "2018-01-01T00:10:00+00:00", "2018-01-01T00:10:05+00:00", points=100)
+        self.assertTrue(data[0]["aggregated"])
+        self.assertEqual(len(data[0]["data"]["timeRaw"]), 100)
+        self.assertEqual(int(data[0]["data"]["count"].sum()), 501)
+        self.assertEqual(lod_client.requests, ["aggregated", "raw"])
+
+    def test_pyramid(self):
+        lod_client = LocalLevelOfDetail(points=100, pyramid=pyramid.RollupPyramid())
+
+        # Ten minutes of raw events fit a budget of 100000 points - they are rolled up into the pyramid
+        data = lod_client.get_data("A", "2018-01-01T00:00:00+00:00", "2018-01-01T00:10:00+00:00", points=100000)
+        self.assertFalse(data[0]["aggregated"])
+        self.assertEqual(lod_client.requests, ["aggregated", "raw"])
+
+        lod_client.cache.clear()
+
+        # Any zoom level within the range is served from the pyramid without a request
+        data = lod_client.get_data("A", "2018-01-01T00:00:00+00:00", "2018-01-01T00:10:00+00:00")
+        self.assertTrue(data[0]["aggregated"])
+        self.assertEqual(len(data[0]["data"]["timeRaw"]), 11)  # 1 minute level, the end is inclusive
+        self.assertEqual(int(data[0]["data"]["count"].sum()), 60001)
+
+        data = lod_client.get_data("A", "2018-01-01T00:02:00+00:00", "2018-01-01T00:03:00+00:00")
+        self.assertEqual(len(data[0]["data"]["timeRaw"]), 61)  # 1 second level
+        self.assertEqual(lod_client.requests, ["aggregated", "raw"])
+
+    def test_invalid_range(self):
+        with self.assertRaises(ValueError):
+            lod.LevelOfDetail().get_data("A", "2018-01-01T01:00:00+00:00", "2018-01-01T00:00:00+00:00")
+
+
+class MockServerLevelOfDetailTest(unittest.TestCase):
+    # Goes through the real client against the in-process mock server (one event every 10ms)
+
+    def setUp(self):
+        self.server = mockserver.start(mockserver.Configuration(rate=100, scalars=1, waveforms=0, images=0))
+        self.base_url = "http://%s:%d" % self.server.server_address[:2]
+        self.start = util.convert_nanoseconds_to_date(1500000000000000000)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_data(self):
+        level_of_detail = lod.LevelOfDetail(points=100, base_url=self.base_url)
+
+        # 100000 events - aggregated in 10s bins
+        data = level_of_detail.get_data("MOCK:SCALAR-000", self.start, self.start + timedelta(seconds=999.99))
+        self.assertTrue(data[0]["aggregated"])
+        self.assertEqual(len(data[0]["data"]["timeRaw"]), 100)
+        self.assertEqual(data[0]["data"]["count"].sum(), 100000)
+        self.assertEqual(data[0]["data"]["count"][0], 1000)
+
+        # 100 events fit the budget - retrieved raw
+        data = level_of_detail.get_data("MOCK:SCALAR-000", self.start, self.start + timedelta(seconds=0.99))
+        self.assertFalse(data[0]["aggregated"])
+        self.assertEqual(len(data[0]["data"]["timeRaw"]), 100)
+        numpy.testing.assert_array_equal(data[0]["data"]["pulseId"], numpy.arange(100))
+        self.assertEqual(data[0]["data"]["timeRaw"][1] - data[0]["data"]["timeRaw"][0], 10000000)
+
+
+if __name__ == '__main__':
+    unittest.main()
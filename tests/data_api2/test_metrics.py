@@ -0,0 +1,116 @@
+import gc
+import unittest
+
+import requests
+
+from data_api2 import client, util, metrics
+from tests.data_api2 import mockserver
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+logging.getLogger("requests").setLevel(logging.ERROR)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_render(self):
+        registry = metrics.Registry()
+        counter = registry.counter("test_total", "Test counter", labels=("api",))
+        counter.inc(api="a")
+        counter.inc(2, api="a")
+        counter.inc(api="b\"")
+        histogram = registry.histogram("test_seconds", "Test histogram", buckets=[0.1, 1])
+        for value in [0.05, 0.5, 5]:
+            histogram.observe(value)
+
+        self.assertIs(registry.counter("test_total", "Test counter", labels=("api",)), counter)
+        with self.assertRaises(ValueError):
+            registry.histogram("test_total", "Test counter")
+        with self.assertRaises(ValueError):
+            counter.inc(-1)
+
+        text = registry.render()
+        self.assertIn("# TYPE test_total counter\n", text)
+        self.assertIn("test_total{api=\"a\"} 3\n", text)
+        self.assertIn("test_total{api=\"b\\\"\"} 1\n", text)
+        self.assertIn("# TYPE test_seconds histogram\n", text)
+        self.assertIn("test_seconds_bucket{le=\"0.1\"} 1\n", text)
+        self.assertIn("test_seconds_bucket{le=\"1\"} 2\n", text)
+        self.assertIn("test_seconds_bucket{le=\"+Inf\"} 3\n", text)
+        self.assertIn("test_seconds_sum 5.55\n", text)
+        self.assertIn("test_seconds_count 3\n", text)
+
+    def test_client_metrics(self):
+        server = mockserver.start(mockserver.Configuration(scalars=2))
+        base_url = "http://%s:%d" % server.server_address[:2]
+        registry = metrics.Registry()
+        metrics_server = metrics.start_http_server(0, registry=registry)
+        try:
+            client_metrics = metrics.enable(registry)
+            self.assertIs(metrics.enable(registry), client_metrics)
+
+            query = util.construct_data_query(["MOCK:SCALAR-000", "MOCK:SCALAR-001"], start=0, end=99)
+            client.get_data_idread(query, base_url=base_url)
+            client.get_data_json(query, base_url=base_url, compression="gzip")
+            with self.assertRaises(RuntimeError):
+                client.get_data_json(dict(query, aggregation={}), base_url=base_url)
+
+            metrics.disable(registry)
+            client.get_data_json(query, base_url=base_url)
+
+            self.assertEqual(client_metrics.requests.get(api="get_data_idread", endpoint=base_url, result="ok"), 1)
+            self.assertEqual(client_metrics.requests.get(api="get_data_json", endpoint=base_url, result="ok"), 1)
+            self.assertEqual(client_metrics.requests.get(api="get_data_json", endpoint=base_url, result="error"), 1)
+            self.assertEqual(client_metrics.events.get(api="get_data_idread"), 200)
+            self.assertEqual(client_metrics.events.get(api="get_data_json"), 200)
+            self.assertGreater(client_metrics.bytes_decoded.get(api="get_data_json"),
+                               client_metrics.bytes_received.get(api="get_data_json"))
+            self.assertEqual(client_metrics.duration.get(api="get_data_json")[0], 2)
+            self.assertEqual(client_metrics.decode_duration.get(api="get_data_idread")[0], 1)
+
+            response = requests.get("http://%s:%d/metrics" % metrics_server.server_address[:2])
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+            self.assertIn("data_api_events_total{api=\"get_data_idread\"} 200", response.text)
+        finally:
+            metrics.disable(registry)
+            metrics_server.shutdown()
+            server.shutdown()
+
+    def test_cache_access(self):
+        registry = metrics.Registry()
+        metrics.cache_access("lod", True, registry=registry)  # not counted - metrics are not enabled
+        self.assertNotIn("data_api_cache_requests_total", registry.render())
+
+        metrics.enable(registry)
+        try:
+            metrics.cache_access("lod", True, registry=registry)
+            metrics.cache_access("lod", False, registry=registry)
+            metrics.cache_access("lod", True, registry=registry)
+        finally:
+            metrics.disable(registry)
+        self.assertIn("data_api_cache_requests_total{cache=\"lod\",result=\"hit\"} 2", registry.render())
+        self.assertIn("data_api_cache_requests_total{cache=\"lod\",result=\"miss\"} 1", registry.render())
+
+    def test_registry_lifetime(self):
+        enabled = len(metrics._client_metrics)
+        registry = metrics.Registry()
+        client_metrics = metrics.enable(registry)
+        client.remove_stats_callback(client_metrics)
+        self.assertIn(registry, metrics._client_metrics)
+
+        # The metrics of a collected registry are not handed out to a new registry (that may get the same id)
+        del registry
+        gc.collect()
+        self.assertEqual(len(metrics._client_metrics), enabled)
+
+        registry = metrics.Registry()
+        try:
+            self.assertIsNot(metrics.enable(registry), client_metrics)
+        finally:
+            metrics.disable(registry)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import datetime
+import time
+
+import numpy
+import requests
+
+from data_api2 import client, util
+from tests.data_api2 import mockserver
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+logging.getLogger("requests").setLevel(logging.ERROR)
+
+
+class MockServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.configuration = mockserver.Configuration(rate=100, scalars=3, waveforms=1, waveform_size=16, images=1,
+                                                      image_shape=(4, 8), type="int16",
+                                                      compression="bitshuffle_lz4", chunk_size=1024)
+        self.server = mockserver.start(self.configuration)
+        self.base_url = "http://%s:%d" % self.server.server_address[:2]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_json(self):
+        query = util.construct_data_query(["MOCK:SCALAR-000", "MOCK:WAVEFORM-000"], start=100, end=199)
+        data = client.get_data_json(query, base_url=self.base_url)
+
+        self.assertEqual(len(data), 2)
+        self.assertEqual([event["pulseId"] for event in data[0]["data"]], list(range(100, 200)))
+        self.assertEqual(data[0]["data"][5]["value"], 105 % self.configuration.pool_size)
+        self.assertEqual(data[1]["data"][0]["value"], list(range(100 % 16, 100 % 16 + 16)))
+        self.assertEqual(data[0]["data"][1]["time"] - data[0]["data"][0]["time"], datetime.timedelta(seconds=0.01))
+
+        # Time range - same events as the pulse-id range
+        start = data[0]["data"][0]["time"]
+        end = data[0]["data"][-1]["time"]
+        query = util.construct_data_query(["MOCK:SCALAR-000"], start=start, end=end)
+        data_time = client.get_data_json(query, base_url=self.base_url, compression="gzip")
+        self.assertEqual([event["pulseId"] for event in data_time[0]["data"]], list(range(100, 200)))
+
+    def test_rawevent(self):
+        query = util.construct_data_query(["MOCK:SCALAR-001", "MOCK:IMAGE-000", "UNKNOWN"], start=0, end=999)
+        stats = dict()
+        data = client.get_data_idread(query, base_url=self.base_url, compression="gzip", stats=stats)
+
+        self.assertEqual(len(data), 3)
+        self.assertEqual(len(data[1]["data"]), 1000)
+        self.assertEqual(data[0]["data"][17]["value"], 17 % self.configuration.pool_size)
+        self.assertEqual(data[1]["data"][3]["value"].shape, (4, 8))
+        self.assertTrue(numpy.array_equal(data[1]["data"][3]["value"].ravel(), numpy.arange(32) + 3))
+        self.assertGreater(stats["compression_ratio"], 1)
+
+    def test_mapping(self):
+        query = util.construct_data_query(["MOCK:SCALAR-000", "MOCK:SCALAR-001"], start=10, end=19,
+                                          value_mapping=util.construct_value_mapping())
+        data = client.get_data_json(query, base_url=self.base_url)
+
+        self.assertEqual(len(data), 10)
+        self.assertEqual([event["channel"] for event in data[0]], ["MOCK:SCALAR-000", "MOCK:SCALAR-001"])
+
+    def test_aggregation(self):
+        query = util.construct_data_query(["MOCK:SCALAR-000", "MOCK:WAVEFORM-000"], start=100, end=199,
+                                          aggregation=util.construct_aggregation(
+                                              aggregations=["min", "mean", "max", "count"], pulses_per_bin=16))
+        data = client.get_data_json(query, base_url=self.base_url)
+
+        self.assertEqual([event["pulseId"] for event in data[0]["data"]], [100] + list(range(112, 200, 16)))
+        self.assertEqual(data[0]["data"][1]["value"], {"min": 0, "mean": 7.5, "max": 15, "count": 16})
+        self.assertEqual(data[1]["data"][1]["value"]["max"], 30)  # over all values of the waveforms
+
+        with self.assertRaises(RuntimeError):  # not supported for rawevent
+            client.get_data_idread(query, base_url=self.base_url)
+
+    def test_channels(self):
+        self.assertEqual(client.get_supported_backends(base_url=self.base_url), ["sf-databuffer"])
+        channels = client.search("SCALAR", base_url=self.base_url)
+        self.assertEqual(channels["sf-databuffer"], ["MOCK:SCALAR-000", "MOCK:SCALAR-001", "MOCK:SCALAR-002"])
+
+    def test_injection(self):
+        self.configuration.latency = 0.2
+        self.configuration.throttle = 100000
+        query = util.construct_data_query(["MOCK:WAVEFORM-000"], start=0, end=999,
+                                          response=util.construct_response(format="rawevent"))
+        start = time.time()
+        with requests.post(self.base_url + "/query", json=query) as response:
+            size = len(response.content)
+        self.assertGreater(time.time() - start, 0.2 + size / 100000 * 0.8)
+
+        self.configuration.latency = 0
+        self.configuration.error_rate = 1
+        with self.assertRaises(RuntimeError):
+            client.get_data_json(query, base_url=self.base_url)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+import numpy
+from pathlib import Path
+
+from data_api2 import idread_util, pyramid
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class RollupPyramidTest(unittest.TestCase):
+    data = Path(__file__).parent / 'data'
+
+    def test_decode(self):
+        rollups = pyramid.RollupPyramid(chunk_size=100)
+        with (self.data / 'out.bin').open(mode='rb') as f:
+            idread_util.decode(f, collector_function=rollups.add_data)
+
+        collector = idread_util.ArrayCollector()
+        with (self.data / 'out.bin').open(mode='rb') as f:
+            idread_util.decode(f, collector_function=collector.add_data)
+        raw = collector.get_data()[0]["data"]
+
+        channel = "SINEG01-RCIR-PUP10:SIG-AMPLT-MAX"
+        backend = "sf-databuffer"
+
+        # The file holds 600 events within one minute - every level holds all of them
+        for resolution in pyramid.default_resolutions:
+            level = rollups.get_data(channel, backend=backend, resolution=resolution)["data"]
+            self.assertEqual(int(level["count"].sum()), 600)
+            self.assertEqual(level["min"].min(), raw["value"].min())
+            self.assertEqual(level["max"].max(), raw["value"].max())
+            self.assertEqual(level["timeRaw"][0] % {"PT1S": 10 ** 9, "PT1M": 60 * 10 ** 9,
+                                                    "PT1H": 3600 * 10 ** 9}[resolution], 0)
+
+        level = rollups.get_data(channel, backend=backend, resolution="PT1S")["data"]
+        times = raw["timeRaw"] // 10 ** 9 * 10 ** 9
+        second = times == level["timeRaw"][0]
+        self.assertAlmostEqual(level["mean"][0], raw["value"][second].mean())
+
+        # Level selection by point budget
+        self.assertEqual(rollups.get_data(channel, backend=backend, points=1000)["resolution"], "PT1S")
+        self.assertEqual(rollups.get_data(channel, backend=backend, points=10)["resolution"], "PT1M")
+
+        # Range selection includes the bin containing start
+        start = int(raw["timeRaw"][100])
+        end = int(raw["timeRaw"][200])
+        level = rollups.get_data(channel, start, end, backend=backend, resolution="PT1S")["data"]
+        self.assertEqual(level["timeRaw"][0], start // 10 ** 9 * 10 ** 9)
+        self.assertLessEqual(level["timeRaw"][-1], end)
+
+        self.assertIsNone(rollups.get_data("UNKNOWN"))
+        with self.assertRaises(ValueError):
+            rollups.get_data(channel, backend=backend, resolution="PT5S")
+
+        arrays = rollups.get_arrays()
+        self.assertEqual(arrays[0]["channel"], {"name": channel, "backend": backend})
+        self.assertEqual(sorted(arrays[0]["levels"].keys()), sorted(pyramid.default_resolutions))
+
+    def test_ranges(self):
+        rollups = pyramid.RollupPyramid()
+        rollups.add_range("A", 100, 200)
+        rollups.add_range("A", 300, 400)
+        self.assertTrue(rollups.covers("A", 120, 180))
+        self.assertFalse(rollups.covers("A", 150, 350))
+
+        rollups.add_range("A", 200, 300)
+        self.assertTrue(rollups.covers("A", 150, 350))
+        self.assertEqual(rollups.channel_ranges[(None, "A")], [(100, 400)])
+        self.assertFalse(rollups.covers("A", 150, 350, backend="sf-databuffer"))
+
+        rollups.add_arrays("A", None, numpy.array([1.0, 3.0]), [1, 2], [0, 500000000])
+        level = rollups.get_data("A")["data"]
+        self.assertEqual(level["mean"].tolist(), [2.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
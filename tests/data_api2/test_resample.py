@@ -0,0 +1,67 @@
+import unittest
+
+import datetime
+import math
+import numpy
+
+from data_api2 import resample
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class ResampleTest(unittest.TestCase):
+
+    times = numpy.array([10, 20, 30])
+    values = numpy.array([1.0, 2.0, 3.0])
+    grid = numpy.array([5, 10, 14, 16, 30, 35])
+
+    def assertValues(self, expected, result):
+        self.assertEqual(len(expected), len(result))
+        for e, r in zip(expected, result):
+            if e is None:
+                self.assertTrue(math.isnan(r))
+            else:
+                self.assertAlmostEqual(e, r)
+
+    def test_last(self):
+        result = resample.resample(self.times, self.values, self.grid, method="last")
+        self.assertValues([None, 1.0, 1.0, 1.0, 3.0, 3.0], result)
+
+    def test_previous(self):
+        result = resample.resample(self.times, self.values, self.grid, method="previous")
+        self.assertValues([1.0, 1.0, 2.0, 2.0, 3.0, None], result)
+
+    def test_linear(self):
+        result = resample.resample(self.times, self.values, self.grid, method="linear")
+        self.assertValues([None, 1.0, 1.4, 1.6, 3.0, 3.0], result)
+
+    def test_nearest(self):
+        result = resample.resample(self.times, self.values, self.grid, method="nearest")
+        self.assertValues([None, 1.0, 1.0, 2.0, 3.0, None], result)
+
+    def test_invalid_method(self):
+        with self.assertRaises(RuntimeError):
+            resample.resample(self.times, self.values, self.grid, method="cubic")
+
+    def test_integer_values(self):
+        # Integer values need to be upcasted to be able to mask grid points without value
+        result = resample.resample(self.times, numpy.array([1, 2, 3]), self.grid, method="last")
+        self.assertValues([None, 1, 1, 1, 3, 3], result)
+
+    def test_resample_data(self):
+        start = datetime.datetime(2018, 1, 1, 12, 0, 0)
+        grid = resample.time_grid(start, start + datetime.timedelta(seconds=10), "PT2S")
+        self.assertEqual(len(grid), 6)
+
+        data = [{"channel": {"name": "A", "backend": "test"},
+                 "data": [{"value": float(i), "timeRaw": int(grid[0] + i * 1e9)} for i in range(11)]}]
+
+        result = resample.resample_data(data, grid)
+        self.assertEqual(result[0]["channel"]["name"], "A")
+        self.assertValues([0.0, 2.0, 4.0, 6.0, 8.0, 10.0], result[0]["data"]["value"])
+
+
+if __name__ == '__main__':
+    unittest.main()
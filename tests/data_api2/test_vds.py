@@ -0,0 +1,78 @@
+import unittest
+
+import argparse
+import tempfile
+from pathlib import Path
+
+import h5py
+import numpy
+
+from data_api2 import cli, vds
+from data_api2.h5reader import H5Reader
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class VdsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filenames = []
+        for i in range(3):
+            data = [{"channel": {"name": "A"},
+                     "data": [{"value": [j, -j], "pulseId": j, "timeRaw": 1000 + j}
+                              for j in range(i * 10, i * 10 + 10)]}]
+            if i != 1:  # channel B is missing in the second file
+                data.append({"channel": {"name": "B"},
+                             "data": [{"value": float(j), "timeRaw": 1000 + j} for j in range(i * 5, i * 5 + 5)]})
+
+            filename = Path(self.directory.name) / ("export_%03d.h5" % i)
+            cli.to_hdf5(data, filename)
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_stitch(self):
+        output = Path(self.directory.name) / "export.h5"
+        lengths = vds.stitch(self.filenames, output)
+        self.assertEqual(lengths["A/values"], 30)
+        self.assertEqual(lengths["B/values"], 10)
+
+        with h5py.File(output.as_posix(), "r") as infile:
+            self.assertTrue(infile["A/values"].is_virtual)
+            self.assertEqual(infile["A/values"].shape, (30, 2))
+
+        with H5Reader(output) as reader:
+            data = reader["A"].pulse_slice(5, 24)  # across file boundaries
+            self.assertTrue(numpy.array_equal(data["pulseId"], numpy.arange(5, 25)))
+            self.assertTrue(numpy.array_equal(data["value"][:, 1], -numpy.arange(5, 25)))
+
+            data = reader["B"][:]
+            self.assertEqual(data["value"].tolist(), [0.0, 1.0, 2.0, 3.0, 4.0, 10.0, 11.0, 12.0, 13.0, 14.0])
+
+        with self.assertRaises(RuntimeError):
+            vds.stitch(self.filenames, output)
+        with self.assertRaises(ValueError):
+            vds.stitch(self.filenames, self.filenames[0], overwrite=True)
+
+    def test_stitch_cli(self):
+        output = Path(self.directory.name) / "index.h5"
+        prefix = Path(self.directory.name) / "export.h5"
+        cli.stitch(argparse.Namespace(filename=output.as_posix(), files=[prefix.as_posix()], overwrite=False))
+
+        with H5Reader(output) as reader:
+            self.assertEqual(len(reader["A"]), 30)
+
+    def test_stitch_mismatch(self):
+        filename = Path(self.directory.name) / "other.h5"
+        cli.to_hdf5([{"channel": {"name": "A"}, "data": [{"value": 1.0, "pulseId": 1, "timeRaw": 1}]}], filename)
+
+        with self.assertRaises(RuntimeError):
+            vds.stitch(self.filenames + [filename], Path(self.directory.name) / "index.h5")
+
+
+if __name__ == '__main__':
+    unittest.main()
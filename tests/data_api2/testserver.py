@@ -2,6 +2,8 @@ from bottle import Bottle, run, request
 
 import datetime
 import json
+import gzip
+import os
 import logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
 
@@ -86,6 +88,16 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(mes
 # }
 
 
+def _respond(body):
+    # Compress the response if requested by the query
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    if request.json.get("response", {}).get("compression") == "gzip":
+        return gzip.compress(body)
+    return body
+
+
 def main():
 
     import argparse
@@ -145,7 +157,7 @@ def main():
 
             channel_value_increment += 10
 
-        return json.dumps(response_data)
+        return _respond(json.dumps(response_data))
 
     @app.route('/archivertestdatamerge/query', method='POST')
     def archiver_test_data_merge_needed():
@@ -197,7 +209,13 @@ def main():
             channel_value_increment += 10
             channel_counter += 1
 
-        return json.dumps(response_data)
+        return _respond(json.dumps(response_data))
+
+    @app.route('/idreadtestdata/query', method='POST')
+    def idread_test_data():
+        # Serves a recorded rawevent response, independent of the query
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "out.bin"), mode="rb") as f:
+            return _respond(f.read())
 
     run(app, host=hostname, port=port)
 